@@ -1,27 +1,46 @@
 import platform
-import socket
-import json
 import tkinter as tk
 from tkinter import ttk
 import time
 import gc
 import datetime
+import queue
 import threading
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
 
 import psutil
 
+import protocol
+from alerting import ALERTS, format_alert
+from collectors import format_uptime
+from heartbeat import HEARTBEATS, health
+from metrics_store import STORE
+from master_discovery import listen_for_slaves
+from registry import REGISTRY
+from telemetry import SlaveTelemetry
+from timing import TIMINGS
+
 DEBUG = False
 
 # Configuration
-SLAVES = {
-    "masterpc": "localhost",  # Add master PC as localhost
-    "slavepi1": "192.168.0.15",
-    "slavepi2": "192.168.0.20",
-    "slavepi3": "192.168.0.25",
-}
+# Slaves come from discovery broadcasts (see registry.py); the master PC is always shown
+MASTER_ID = "masterpc"
+FRAME_COLUMNS = 2
+# The slave grid scrolls once it is taller than this
+SLAVES_VIEW_MAX_HEIGHT = 520
 PORT = 65432
-TIMEOUT = 5
+REFRESH_INTERVAL_MS = 2000
+UI_QUEUE_POLL_MS = 100
+# The status bar clock and garbage collection do not need the refresh rate
+STATUS_INTERVAL_MS = 10000
+# How often slaves are asked for their GET_STATS timings
+SLAVE_STATS_INTERVAL_MS = 30000
+GC_INTERVAL_MS = 300000
+POLLER_WORKERS = 4
+# Custom commands fan out to at most this many slaves at once
+COMMAND_WORKERS = 8
+COMMAND_TIMEOUT = 60
 DETAIL_COMMANDS = [
     "GET_CPU_TEMP",
     "GET_UPTIME",
@@ -36,12 +55,8 @@ def send_command(ip, command, params=None):
     try:
         if ip == "localhost":
             return fetch_local_data(command)
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(TIMEOUT)
-            s.connect((ip, PORT))
-            s.sendall(json.dumps({"command": command, "params": params}).encode())
-            data = s.recv(4096)
-            return json.loads(data.decode())
+        # Timeouts adapt to the slave's RTT, see health.py
+        return protocol.send_command(ip, command, params)
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -95,25 +110,40 @@ def fetch_local_data(command):
         return {"status": "error", "message": str(e)}
 
 
-def get_raspberry_pi_model(ip):
-    """Fetch the Raspberry Pi model using /proc/device-tree/model."""
-    if ip == "localhost":
-        return "Master PC"
-    try:
-        response = send_command(ip, "RUN_SCRIPT", params={"script": "cat /proc/device-tree/model"})
-        if response.get("status") == "success":
-            raw_model = response.get("data", "Unknown").strip()
-            if "Raspberry Pi 5" in raw_model:
-                return "Raspberry Pi 5"
-            elif "Raspberry Pi 4" in raw_model:
-                return "Raspberry Pi 4"
-            else:
-                return raw_model
-        else:
-            if DEBUG: print(f"[WARNING] Failed to detect model for {ip}: {response.get('message')}")
-    except Exception as e:
-        print(f"[ERROR] Exception while detecting model for {ip}: {e}")
-    return "Unknown"
+def normalize_model(raw_model):
+    """Shorten a /proc/device-tree/model string to the Pi generation."""
+    if "Raspberry Pi 5" in raw_model:
+        return "Raspberry Pi 5"
+    elif "Raspberry Pi 4" in raw_model:
+        return "Raspberry Pi 4"
+    return raw_model
+
+
+def snapshot_to_display(snapshot):
+    """Convert a GET_SNAPSHOT result into the values shown by SlaveFrame."""
+    data = {
+        "cpu_temp": snapshot.get("cpu_temp") or 0,
+        "disk_usage": snapshot.get("disk_usage") or 0,
+        "uptime": snapshot.get("uptime") or "--",
+    }
+    usb_devices = snapshot.get("usb_devices")
+    data["usb_devices"] = "--" if usb_devices is None else usb_devices
+    adc_value = snapshot.get("adc_value")
+    # Only the Raspberry Pi 5 PMIC exposes the ADC
+    data["adc_value"] = f"{adc_value:.2f}V" if adc_value is not None else "Not Supported"
+    if snapshot.get("model"):
+        data["model"] = normalize_model(snapshot["model"])
+    return data
+
+
+def heartbeat_to_display(heartbeat):
+    """Convert a heartbeat into the values shown by SlaveFrame; it carries no ADC or USB reading."""
+    if not heartbeat["alive"]:
+        return {"status": "Offline"}
+    data = snapshot_to_display(dict(health(heartbeat), uptime=format_uptime(heartbeat["uptime_seconds"])))
+    data["adc_value"] = "--"
+    data["status"] = "Online"
+    return data
 
 
 class SlaveFrame(tk.Frame):
@@ -124,6 +154,7 @@ class SlaveFrame(tk.Frame):
         self.ip = ip
         self.model = model
         self.is_master = is_master  # Flag to identify the master PC
+        self._shown = {}  # Last value given to each widget, to skip no-op reconfigures
 
         # Title with model info
         title_text = f"Master PC ({ip}) - {model}" if self.is_master else f"Slave PC {slave_id} ({ip}) - {model}"
@@ -165,29 +196,48 @@ class SlaveFrame(tk.Frame):
         setattr(self, f"value_{label_text.lower().replace(' ', '_').strip(':')}", value_label)
 
     def update_data(self, data):
-        """Update the frame's data and progress bars."""
+        """Update the frame's data and progress bars; unchanged widgets are left alone."""
         # Update CPU Temp
         cpu_temp = data.get("cpu_temp", 0)
-        self.progress_cpu_temp["value"] = self._safe_value(cpu_temp)
-        self.value_cpu_temp.config(text=f"{cpu_temp:.1f}°C")
+        self._show(self.progress_cpu_temp, "value", round(self._safe_value(cpu_temp), 1))
+        self._show(self.value_cpu_temp, "text", f"{cpu_temp:.1f}°C")
 
         # Update Disk Usage
         disk_usage = data.get("disk_usage", 0)
-        self.progress_disk_usage["value"] = self._safe_value(disk_usage)
-        self.value_disk_usage.config(text=f"{disk_usage:.1f}%")
+        self._show(self.progress_disk_usage, "value", round(self._safe_value(disk_usage), 1))
+        self._show(self.value_disk_usage, "text", f"{disk_usage:.1f}%")
 
         # Update USB Devices
-        self.value_usb_devices.config(text=f"{data.get('usb_devices', '--')}")
+        self._show(self.value_usb_devices, "text", f"{data.get('usb_devices', '--')}")
 
         # Update ADC Value (only for slaves)
         if not self.is_master:
-            self.value_adc_value.config(text=f"{data.get('adc_value', '--')}")
+            self._show(self.value_adc_value, "text", f"{data.get('adc_value', '--')}")
 
         # Update Uptime
-        self.value_uptime.config(text=f"{data.get('uptime', '--')}")
+        self._show(self.value_uptime, "text", f"{data.get('uptime', '--')}")
 
         # Update Status
-        self.value_status.config(text=f"{data.get('status', 'Online')}")
+        self._show(self.value_status, "text", f"{data.get('status', 'Online')}")
+
+        # Update the title if the slave reports a different model
+        model = data.get("model")
+        if model and model != self.model:
+            self.set_model(model)
+
+    def _show(self, widget, option, value):
+        """Configure a widget option only if its value changed."""
+        key = (str(widget), option)
+        if self._shown.get(key) != value:
+            self._shown[key] = value
+            widget[option] = value
+
+    def set_model(self, model):
+        """Show a newly detected model in the frame title."""
+        if self.is_master:
+            return
+        self.model = model
+        self.title_label.config(text=f"Slave PC {self.slave_id} ({self.ip}) - {model}")
 
     @staticmethod
     def _safe_value(value):
@@ -222,15 +272,44 @@ class RackMonitorApp(tk.Tk):
         self.grid_columnconfigure(0, weight=1)
         self.grid_columnconfigure(1, weight=1)
 
-        # Slave Frames
-        self.slave_frames = []
-        for idx, (slave_id, ip) in enumerate(SLAVES.items(), start=1):
-            is_master = ip == "localhost"  # Detect master PC
-            model = "Master PC" if is_master else self.fetch_slave_model(ip)
-            frame = SlaveFrame(self, slave_id, ip, model=model, is_master=is_master)
-            frame.grid(row=(idx - 1) // 2, column=(idx - 1) % 2, padx=10, pady=10, sticky="nsew")
-            self.slave_frames.append((slave_id, frame))
-
+        # Network and other blocking work runs on a fixed worker pool; results
+        # come back to the Tk thread through a queue drained by process_ui_queue
+        self.pool = ThreadPoolExecutor(max_workers=POLLER_WORKERS)
+        self.command_pool = ThreadPoolExecutor(max_workers=COMMAND_WORKERS)
+        self.ui_queue = queue.Queue()
+        self.polls_in_flight = set()
+
+        # Slave Frames, added and removed as the registry changes.
+        # Slaves push their metrics; the GUI only renders the latest state.
+        self.slaves = {}
+        self.slave_frames = {}
+        self.telemetry = {}
+        # Latest data per slave not yet shown; applied in one after_idle pass
+        self.pending_data = {}
+        self.render_scheduled = False
+        self.status_counts = None
+        self.status_updated = 0
+        self.slowest_commands = {}  # slave_id -> (command, p99 ms) from GET_STATS
+
+        # Frames live in a scrollable canvas; only the visible ones are redrawn
+        self.slaves_canvas = tk.Canvas(self, bg="#282c34", highlightthickness=0, height=0)
+        self.slaves_canvas.grid(row=0, column=0, columnspan=3, sticky="nsew")
+        self.slaves_scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.scroll_slaves)
+        self.slaves_scrollbar.grid(row=0, column=3, sticky="ns")
+        self.slaves_canvas.configure(yscrollcommand=self.slaves_scrollbar.set)
+        self.slaves_container = tk.Frame(self.slaves_canvas, bg="#282c34")
+        self.slaves_window = self.slaves_canvas.create_window((0, 0), window=self.slaves_container, anchor="nw")
+        self.slaves_container.bind("<Configure>", self.on_slaves_resized)
+        self.slaves_canvas.bind("<Configure>", self.on_canvas_resized)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.slaves_canvas.bind_all(sequence, self.on_mouse_wheel)
+        for column in range(FRAME_COLUMNS):
+            self.slaves_container.grid_columnconfigure(column, weight=1)
+        self.add_slave(MASTER_ID, "localhost")
+        REGISTRY.subscribe(lambda event, slave: self.call_in_ui(self.on_registry_event, event, slave))
+        for slave in REGISTRY.all():
+            self.on_registry_event("added", slave)
+        threading.Thread(target=listen_for_slaves, daemon=True).start()
 
         # Command Input
         self.command_frame = tk.Frame(self, bg="#282c34")
@@ -273,28 +352,180 @@ class RackMonitorApp(tk.Tk):
         )
         self.status_label.grid(row=4, column=0, columnspan=3, padx=10, pady=(0, 10))
 
+        ALERTS.subscribe(lambda alert: self.call_in_ui(self.append_log, format_alert(alert) + "\n"))
+        ALERTS.follow(REGISTRY).start()
+
+        self.process_ui_queue()
         self.update_real_data()
-    
-    def fetch_slave_model(self, ip):
-        """Fetch the Raspberry Pi model for a given IP."""
-        if ip == "localhost":
-            # No model detection for localhost
-            return "Master PC"
-        try:
-            response = send_command(ip, "RUN_SCRIPT", params={"script": "cat /proc/device-tree/model"})
-            if response.get("status") == "success":
-                raw_model = response.get("data", "Unknown").strip()
-                if "Raspberry Pi 5" in raw_model:
-                    return "Raspberry Pi 5"
-                elif "Raspberry Pi 4" in raw_model:
-                    return "Raspberry Pi 4"
-                return raw_model
-            else:
-                print(f"[WARNING] Failed to fetch model for {ip}: {response.get('message')}")
-        except Exception as e:
-            print(f"[ERROR] Error fetching model for {ip}: {e}")
-        return "Unknown"
-    
+        self.collect_garbage()
+        self.refresh_slave_stats()
+
+    def run_in_background(self, func, on_done, *args):
+        """Run `func(*args)` on the worker pool and pass its result to `on_done` on the Tk thread."""
+        def job():
+            try:
+                result = func(*args)
+            except Exception as e:
+                print(f"[ERROR] Background task {func.__name__} failed: {e}")
+                return
+            self.ui_queue.put((on_done, (result,)))
+        self.pool.submit(job)
+
+    def call_in_ui(self, func, *args):
+        """Schedule `func(*args)` on the Tk thread from any thread."""
+        self.ui_queue.put((func, args))
+
+    def process_ui_queue(self):
+        """Apply results handed over by worker threads; runs on the Tk thread."""
+        while True:
+            try:
+                func, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"[ERROR] UI update failed: {e}")
+        self.after(UI_QUEUE_POLL_MS, self.process_ui_queue)
+
+    def destroy(self):
+        """Stop background work before tearing down the window."""
+        for telemetry in self.telemetry.values():
+            # Connections are closed on exit, which ends the subscriptions slave-side
+            telemetry.stop(unsubscribe=False)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.command_pool.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
+    def on_slaves_resized(self, event):
+        """Track the grid's size: grow the view up to its limit, scroll beyond it."""
+        self.slaves_canvas.configure(
+            scrollregion=(0, 0, event.width, event.height), height=min(event.height, SLAVES_VIEW_MAX_HEIGHT)
+        )
+        self.schedule_render()
+
+    def on_canvas_resized(self, event):
+        self.slaves_canvas.itemconfigure(self.slaves_window, width=event.width)
+        self.schedule_render()
+
+    def scroll_slaves(self, *args):
+        self.slaves_canvas.yview(*args)
+        self.schedule_render()
+
+    def on_mouse_wheel(self, event):
+        if not str(event.widget).startswith(str(self.slaves_canvas)):
+            return  # Leave the wheel to the command log
+        if event.num == 4 or event.delta > 0:
+            self.scroll_slaves("scroll", -1, "units")
+        else:
+            self.scroll_slaves("scroll", 1, "units")
+
+    def visible_slaves(self):
+        """Ids of the frames at least partly inside the scrolled view."""
+        top = self.slaves_canvas.canvasy(0)
+        bottom = top + self.slaves_canvas.winfo_height()
+        return {
+            slave_id for slave_id, frame in self.slave_frames.items()
+            if frame.winfo_y() + frame.winfo_height() >= top and frame.winfo_y() <= bottom
+        }
+
+    def show_data(self, slave_id, data):
+        """Queue data for a slave's frame; repeated updates before the next render collapse."""
+        self.pending_data[slave_id] = data
+        self.schedule_render()
+
+    def schedule_render(self):
+        if not self.render_scheduled:
+            self.render_scheduled = True
+            self.after_idle(self.render)
+
+    def render(self):
+        """Apply pending data to visible frames; hidden frames keep theirs until scrolled into view."""
+        self.render_scheduled = False
+        for slave_id in self.visible_slaves() & self.pending_data.keys():
+            self.slave_frames[slave_id].update_data(self.pending_data.pop(slave_id))
+
+    def refresh_slave_stats(self):
+        """Ask every slave for its timing percentiles in the background."""
+        for slave_id, ip in self.slaves.items():
+            if ip != "localhost":
+                self.run_in_background(
+                    send_command, lambda response, slave_id=slave_id: self.on_slave_stats(slave_id, response),
+                    ip, "GET_STATS",
+                )
+        self.after(SLAVE_STATS_INTERVAL_MS, self.refresh_slave_stats)
+
+    def on_slave_stats(self, slave_id, response):
+        """Remember the slave's slowest command handler (p99)."""
+        if slave_id not in self.slaves or response.get("status") != "success":
+            return
+        timings = response.get("data", {}).get("timings", {})
+        handlers = [(summary.get("p99_ms", 0), name[len("handler."):])
+                    for name, summary in timings.items() if name.startswith("handler.") and summary.get("count")]
+        if handlers:
+            p99, command = max(handlers)
+            self.slowest_commands[slave_id] = (command, p99)
+
+    def timing_status(self):
+        """Status bar text: round-trip percentiles, slowest slave and slowest command."""
+        per_slave = {name[len("slave."):]: summary
+                     for name, summary in TIMINGS.summary("slave.").items() if summary.get("count")}
+        parts = []
+        if per_slave:
+            p50 = sorted(summary["p50_ms"] for summary in per_slave.values())[len(per_slave) // 2]
+            ip, slowest = max(per_slave.items(), key=lambda item: item[1]["p90_ms"])
+            name = next((slave_id for slave_id, slave_ip in self.slaves.items() if slave_ip == ip), ip)
+            parts.append(f"RTT p50: {p50:.0f} ms | Slowest: {name} (p90 {slowest['p90_ms']:.0f} ms)")
+        if self.slowest_commands:
+            slave_id, (command, p99) = max(self.slowest_commands.items(), key=lambda item: item[1][1])
+            parts.append(f"Slowest command: {command} on {slave_id} (p99 {p99:.0f} ms)")
+        return "".join(f" | {part}" for part in parts)
+
+    def collect_garbage(self):
+        """Periodically free memory without doing it on every refresh."""
+        gc.collect()
+        self.after(GC_INTERVAL_MS, self.collect_garbage)
+
+    def on_registry_event(self, event, slave):
+        """Add, replace or remove a slave's frame when discovery changes (Tk thread)."""
+        if slave["name"] in self.slaves:
+            self.remove_slave(slave["name"])
+        if event != "removed":
+            self.add_slave(slave["name"], slave["ip"], slave.get("description", ""))
+
+    def add_slave(self, slave_id, ip, description=""):
+        """Create the frame for a slave; update_real_data subscribes to it while it is in view."""
+        is_master = ip == "localhost"  # Detect master PC
+        if is_master:
+            model = "Master PC"
+        else:
+            model = normalize_model(description) if description else "Detecting..."
+        frame = SlaveFrame(self.slaves_container, slave_id, ip, model=model, is_master=is_master)
+        self.slaves[slave_id] = ip
+        self.slave_frames[slave_id] = frame
+        self.layout_frames()
+
+    def remove_slave(self, slave_id):
+        """Drop a slave that left the registry."""
+        self.slaves.pop(slave_id, None)
+        self.pending_data.pop(slave_id, None)
+        self.slowest_commands.pop(slave_id, None)
+        telemetry = self.telemetry.pop(slave_id, None)
+        if telemetry:
+            telemetry.stop()
+        frame = self.slave_frames.pop(slave_id, None)
+        if frame:
+            frame.destroy()
+        self.layout_frames()
+
+    def layout_frames(self):
+        """Grid the frames with the master PC first and slaves sorted by name."""
+        order = sorted(self.slave_frames, key=lambda slave_id: (slave_id != MASTER_ID, slave_id))
+        for idx, slave_id in enumerate(order):
+            self.slave_frames[slave_id].grid(
+                row=idx // FRAME_COLUMNS, column=idx % FRAME_COLUMNS, padx=10, pady=10, sticky="nsew"
+            )
+
     def clear_placeholder(self, event):
         """Clear placeholder text when the user clicks the entry box."""
         if self.command_entry.get() == "Enter custom command...":
@@ -335,126 +566,154 @@ class RackMonitorApp(tk.Tk):
                 except Exception as e:
                     print(f"[ERROR] Failed to execute {command} on localhost: {e}")
         else:
-            # Fetch data from the slave
-            model = get_raspberry_pi_model(ip)
-            supports_adc = "5" in model  # Only Raspberry Pi 5 supports ADC
-
-            for command in DETAIL_COMMANDS:
-                if command == "REQUEST_ADC" and not supports_adc:
-                    data["adc_value"] = "Not Supported"
-                    continue
-
-                params = {"channel": "EXT5V_V"} if command == "REQUEST_ADC" else None
-                response = send_command(ip, command, params)
-                if response.get("status") == "success":
-                    is_online = True
-                    raw_data = response.get("data", "")
-                    if command == "GET_CPU_TEMP":
-                        try:
-                            data["cpu_temp"] = float(raw_data.split("=")[1].strip("'C"))
-                        except Exception:
-                            data["cpu_temp"] = 0
-                    elif command == "GET_UPTIME":
-                        data["uptime"] = raw_data
-                    elif command == "GET_DISK_USAGE":
-                        try:
-                            data["disk_usage"] = float(raw_data.strip("%"))
-                        except Exception:
-                            data["disk_usage"] = 0
-                    elif command == "LIST_USB":
-                        data["usb_devices"] = len(raw_data.splitlines())
-                    elif command == "REQUEST_ADC":
-                        try:
-                            data["adc_value"] = f"{float(raw_data.split('=')[-1].strip('V')):.2f}V"
-                        except Exception:
-                            data["adc_value"] = "N/A"
-                else:
-                    if DEBUG: print(f"[WARNING] Command {command} failed for {ip}: {response.get('message')}")
+            # Fetch every metric from the slave in a single round trip
+            response = send_command(ip, "GET_SNAPSHOT", {"channel": "EXT5V_V"})
+            if response.get("status") == "success":
+                is_online = True
+                with TIMINGS.time("parse"):
+                    data = snapshot_to_display(response.get("data", {}))
+                if DEBUG and response.get("errors"):
+                    print(f"[WARNING] Snapshot fields failed for {ip}: {response['errors']}")
+            else:
+                if DEBUG: print(f"[WARNING] Snapshot failed for {ip}: {response.get('message')}")
 
         data["status"] = "Online" if is_online else "Offline"
         return data
 
     
+    def sync_subscription(self, slave_id, ip, visible, heartbeat):
+        """Subscribe over TCP to slaves on screen, and to those without heartbeats to go by."""
+        telemetry = self.telemetry.get(slave_id)
+        wanted = visible or heartbeat is None
+        if wanted and telemetry is None:
+            # The model arrives with the first snapshot the subscription pushes
+            self.telemetry[slave_id] = SlaveTelemetry(ip, interval=REFRESH_INTERVAL_MS / 1000).start()
+        elif not wanted and telemetry is not None:
+            self.telemetry.pop(slave_id).stop()
+
     def update_real_data(self):
-        """Fetch and update data for all slaves."""
-        for slave_id, frame in self.slave_frames:
-            ip = SLAVES[slave_id]
-            threading.Thread(target=self.update_slave_frame, args=(frame, ip)).start()
-        
-        # Perform garbage collection to free up memory
-        gc.collect()
+        """Fetch and update data for all slaves.
+
+        Liveness and basic health come from heartbeats; slaves in view also
+        get a telemetry subscription for their full detail.
+        """
+        visible = self.visible_slaves()
+        online = total = 0
+        for slave_id, frame in self.slave_frames.items():
+            ip = self.slaves[slave_id]
+            if ip == "localhost":
+                if ip not in self.polls_in_flight:
+                    # Skip this cycle if the previous poll has not finished yet
+                    self.polls_in_flight.add(ip)
+                    self.run_in_background(self.poll_slave, self.make_poll_callback(frame, ip), ip)
+                continue
+            heartbeat = HEARTBEATS.get(slave_id)
+            self.sync_subscription(slave_id, ip, slave_id in visible, heartbeat)
+            telemetry = self.telemetry.get(slave_id)
+            if telemetry is not None and (telemetry.is_live or heartbeat is None):
+                live, metrics = telemetry.is_live, telemetry.state
+                self.show_data(slave_id, self.telemetry_data(telemetry))
+            else:
+                live, metrics = heartbeat["alive"], health(heartbeat)
+                self.show_data(slave_id, heartbeat_to_display(heartbeat))
+            STORE.record_snapshot(slave_id, metrics, live)
+            ALERTS.observe(slave_id, metrics if live else None)
+            online += live
+            total += 1
+
+        # Redraw the status bar when the counts change, otherwise only now and then for the clock
+        counts = (online, total)
+        if counts != self.status_counts or time.monotonic() - self.status_updated >= STATUS_INTERVAL_MS / 1000:
+            self.status_counts = counts
+            self.status_updated = time.monotonic()
+            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.status_label.config(
+                text=f"System Monitor v1.0.0 | Connected Slaves: {online}/{total} | Last Update: {now}"
+                     f"{self.timing_status()}"
+            )
+        self.after(REFRESH_INTERVAL_MS, self.update_real_data)
 
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.status_label.config(
-            text=f"System Monitor v1.0.0 | Connected PC's: {len(self.slave_frames)}/{len(SLAVES)} | Last Update: {now}"
-        )
-        self.after(2000, self.update_real_data)
+    @staticmethod
+    def telemetry_data(telemetry):
+        """Display data for a slave from the state it last pushed."""
+        if not telemetry.is_live:
+            return {"status": "Offline"}
+        data = snapshot_to_display(telemetry.state)
+        data["status"] = "Online"
+        return data
 
-    def update_slave_frame(self, frame, ip):
-        """Update a single slave frame with fetched data."""
+    def poll_slave(self, ip):
+        """Fetch a slave's data, reporting it offline on failure (worker thread)."""
         try:
-            data = self.fetch_slave_data(ip)
-            frame.update_data(data)
+            return self.fetch_slave_data(ip)
         except Exception as e:
             print(f"[ERROR] Failed to update {ip}: {e}")
+            return {"status": "Offline"}
+
+    def make_poll_callback(self, frame, ip):
+        """Callback that renders a finished poll and allows the next one."""
+        def on_done(data):
+            self.polls_in_flight.discard(ip)
+            if self.slave_frames.get(frame.slave_id) is not frame:
+                return  # The slave was removed while the poll was running
+            self.show_data(frame.slave_id, data)
+            STORE.record_snapshot(frame.slave_id, data, data.get("status") == "Online")
+            ALERTS.observe(frame.slave_id, data if data.get("status") == "Online" else None)
+        return on_done
 
     def send_command(self, event=None):
-        """Send a custom command to all slaves and log responses."""
+        """Send a custom command to all slaves in parallel and log responses as they arrive."""
         command = self.command_entry.get()
         if command:
             now = datetime.datetime.now().strftime("%H:%M:%S")
-            self.command_log.config(state="normal")
-            self.command_log.insert(tk.END, f"> Sending command: {command} ({now})\n\n")
-
-            # Send the command to all slaves
-            for slave_id, ip in SLAVES.items():
+            self.append_log(f"> Sending command: {command} ({now})\n\n")
+            self.command_entry.delete(0, tk.END)
+            for slave_id, ip in list(self.slaves.items()):
                 if ip == "localhost":  # Skip localhost
                     continue
+                self.command_pool.submit(self._execute_command_on_slave, slave_id, ip, command)
 
-                try:
-                    response = send_command(ip, "RUN_SCRIPT", params={"script": command})
-                    if response is None:
-                        response = {"status": "error", "message": "No response"}
-                    status = response.get("status", "unknown")
-                    message = response.get("data", response.get("message", "No response"))
-
-                    # Append response with enforced line breaks
-                    self.command_log.insert(
-                        tk.END, f"{slave_id} ({ip}) [{now}]: {message}\n\n"
-                    )
-                    self.command_log.insert(tk.END, "\n")  # Extra line break to ensure spacing
-                except Exception as e:
-                    self.command_log.insert(
-                        tk.END, f"{slave_id} ({ip}) [{now}]: ERROR - {str(e)}\n\n"
-                    )
-
-            # Add final line break for spacing
-            self.command_log.insert(tk.END, "\n\n")
-            self.command_log.see(tk.END)
-            self.command_log.config(state="disabled")
-            self.command_entry.delete(0, tk.END)
+    def append_log(self, text):
+        """Append text to the read-only command log (Tk thread only)."""
+        self.command_log.config(state="normal")
+        self.command_log.insert(tk.END, text)
+        self.command_log.see(tk.END)
+        self.command_log.config(state="disabled")
 
 
     def _execute_command_on_slave(self, slave_id, ip, command):
-        """Execute a custom command on a single slave and log the response."""
+        """Execute a custom command on a single slave and stream its output to the log (worker thread)."""
+        prefix = f"{slave_id} ({ip})"
+        pending_line = [""]
+
+        def on_output(chunk):
+            # Only log whole lines so output from different slaves does not interleave mid-line
+            lines = (pending_line[0] + chunk).split("\n")
+            pending_line[0] = lines.pop()
+            if lines:
+                self.call_in_ui(self.append_log, "".join(f"{prefix}: {line}\n" for line in lines))
+
         try:
-            # Send the command as part of RUN_SCRIPT
-            response = send_command(ip, "RUN_SCRIPT", {"script": command})
+            # Send the command as part of RUN_SCRIPT. The script gets the same limit as
+            # the wait, and if the wait runs out first the slave is told to cancel it.
+            response = protocol.send_command(
+                ip, "RUN_SCRIPT", {"script": command, "stream": True, "timeout": COMMAND_TIMEOUT},
+                timeout=COMMAND_TIMEOUT, on_partial=on_output,
+            )
+            if pending_line[0]:
+                on_output("\n")
             now = datetime.datetime.now().strftime("%H:%M:%S")
             if response.get("status") == "success":
-                output = response.get("data", "No output")
-                self.command_log.insert(tk.END, f"{slave_id} ({ip}) [{now}]: {output}\n")
+                self.call_in_ui(self.append_log, f"{prefix} [{now}]: done\n\n")
             else:
                 error_message = response.get("message", "Unknown error")
-                self.command_log.insert(tk.END, f"{slave_id} ({ip}) [{now}]: ERROR - {error_message}\n")
+                self.call_in_ui(self.append_log, f"{prefix} [{now}]: ERROR - {error_message}\n\n")
         except Exception as e:
-            self.command_log.insert(tk.END, f"{slave_id} ({ip}): ERROR - {e}\n")
-        finally:
-            self.command_log.config(state="disabled")
-            self.command_log.see(tk.END)
+            self.call_in_ui(self.append_log, f"{prefix}: ERROR - {e}\n\n")
 
 
 
 if __name__ == "__main__":
     app = RackMonitorApp()
     app.mainloop()
+    protocol.close_all()
@@ -0,0 +1,173 @@
+"""Rack-level aggregation for multi-rack deployments.
+
+An aggregator is a master that polls the slaves of its own rack and
+answers upstream over the slave protocol, so a top-level master polls
+one aggregator per rack instead of every Pi. Its GET_SNAPSHOT returns
+rack-wide values (hottest CPU, fullest disk, lowest ADC reading) that
+slot into the fields a slave snapshot has. One entry per slave is only
+included when asked for with {"detail": true}; GET_SLAVE returns a single
+slave's entry for drill-down.
+
+A slave that stops answering does not fail the rack: its entry keeps
+the last metrics that were read, with `online` false and its error, and
+the snapshot is marked `partial`. Entries whose last good poll is older
+than STALE_INTERVALS poll intervals are marked `stale` and left out of
+the rack-wide values.
+
+    python master_main.py --aggregator --rack rack1           # On each rack
+    python master_main.py --aggregators 10.0.1.5 10.0.2.5     # On the top-level master
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import protocol
+from cluster_state import STALE_INTERVALS
+from commands import get_stats
+from registry import REGISTRY
+from slave import SlaveServer
+
+AGGREGATOR_PORT = 65435
+RACK_NAME = socket.gethostname()
+# Rack-wide value of each snapshot field, from the values of the fresh online slaves
+ROLLUPS = {
+    "cpu_temp": max,
+    "disk_usage": max,
+    "adc_value": min,
+    "usb_devices": sum,
+}
+PREFIX = "rack-"
+
+
+class RackState:
+    """Last known state of every slave in the rack, kept across failed polls."""
+    def __init__(self, rack=RACK_NAME):
+        self.rack = rack
+        self._slaves = {}
+        self._poller = None
+        self._lock = threading.Lock()
+
+    def attach(self, poller, registry=REGISTRY):
+        self._poller = poller
+        poller.subscribe(self.on_result)
+        registry.subscribe(lambda event, slave: event == "removed" and self.remove(slave["name"]))
+        return self
+
+    def on_result(self, result):
+        with self._lock:
+            entry = self._slaves.setdefault(result.name, {"metrics": {}, "last_ok": None})
+            entry.update(ip=result.ip, online=result.ok, error=result.error)
+            if result.ok:
+                entry["metrics"] = result.data
+                entry["last_ok"] = result.timestamp
+
+    def remove(self, name):
+        with self._lock:
+            self._slaves.pop(name, None)
+
+    def _stale_after(self, name):
+        if self._poller is None:
+            return None
+        return STALE_INTERVALS * self._poller.interval_for(name)
+
+    def _with_staleness(self, name, entry, now):
+        stale_after = self._stale_after(name)
+        stale = entry["last_ok"] is None or (stale_after is not None and now - entry["last_ok"] > stale_after)
+        return dict(entry, stale=stale)
+
+    def get(self, name):
+        """One slave's entry, or None."""
+        with self._lock:
+            entry = self._slaves.get(name)
+            return self._with_staleness(name, entry, time.time()) if entry else None
+
+    def snapshot(self, detail=False):
+        """The rack as one GET_SNAPSHOT result."""
+        now = time.time()
+        with self._lock:
+            slaves = {name: self._with_staleness(name, entry, now) for name, entry in sorted(self._slaves.items())}
+        fresh = [entry for entry in slaves.values() if entry["online"] and not entry["stale"]]
+        snapshot = {
+            "rack": self.rack,
+            "model": f"Rack {self.rack}",
+            "slaves_total": len(slaves),
+            "slaves_online": sum(1 for entry in slaves.values() if entry["online"]),
+            "slaves_stale": sum(1 for entry in slaves.values() if entry["stale"]),
+            "partial": len(fresh) < len(slaves),
+        }
+        for field, rollup in ROLLUPS.items():
+            values = [entry["metrics"].get(field) for entry in fresh]
+            values = [value for value in values if isinstance(value, (int, float))]
+            snapshot[field] = rollup(values) if values else None
+        if detail:
+            snapshot["slaves"] = slaves
+        return snapshot
+
+
+def aggregator_commands(rack_state, poller):
+    """Command table served upstream by an aggregator."""
+    def get_snapshot(params):
+        return {"status": "success", "data": rack_state.snapshot(detail=bool(params.get("detail")))}
+
+    def get_slave(params):
+        entry = rack_state.get(params.get("name"))
+        if entry is None:
+            return {"status": "error", "message": f"Unknown slave: {params.get('name')}"}
+        return {"status": "success", "data": entry}
+
+    def get_aggregator_stats(params):
+        response = get_stats(params)
+        response["data"]["poller"] = poller.stats()
+        return response
+
+    return {
+        "GET_SNAPSHOT": get_snapshot,
+        "GET_SLAVE": get_slave,
+        "GET_STATS": get_aggregator_stats,
+    }
+
+
+def serve_aggregator(poller, registry=REGISTRY, rack=RACK_NAME, port=AGGREGATOR_PORT):
+    """Answer upstream masters with this rack's state; blocks forever."""
+    rack_state = RackState(rack).attach(poller, registry)
+    print(f"Serving rack {rack} upstream on port {port}...")
+
+    async def run():
+        server = SlaveServer(port=port, metrics_port=0, file_port=0,
+                             commands=aggregator_commands(rack_state, poller))
+        await server.serve_forever()
+
+    asyncio.run(run())
+
+
+def register_aggregators(addresses, registry=REGISTRY):
+    """Add "host[:port]" aggregators to the registry so the poller treats each rack as one slave."""
+    for address in addresses:
+        host, _, port = address.partition(":")
+        registry.update(PREFIX + host, host, "Rack aggregator", static=True,
+                        port=int(port) if port else AGGREGATOR_PORT)
+
+
+def print_rack(ip, port=AGGREGATOR_PORT):
+    """Show one aggregator's view of its rack."""
+    response = protocol.send_command(ip, "GET_SNAPSHOT", {"detail": True}, port=port)
+    if response.get("status") != "success":
+        print(f"[ERROR] {ip}: {response.get('message', 'Unknown error')}")
+        return
+    rack = response["data"]
+    print(f"Rack {rack['rack']}: {rack['slaves_online']}/{rack['slaves_total']} online, "
+          f"{rack['slaves_stale']} stale{' (partial)' if rack['partial'] else ''}")
+    for name, entry in rack["slaves"].items():
+        state = "stale" if entry["stale"] else "online" if entry["online"] else "offline"
+        print(f"  {name} ({entry['ip']}): {state} cpu_temp={entry['metrics'].get('cpu_temp')}"
+              f"{' - ' + entry['error'] if entry['error'] else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show what a rack aggregator reports")
+    parser.add_argument("address", help="host[:port] of the aggregator")
+    args = parser.parse_args()
+    host, _, port = args.address.partition(":")
+    print_rack(host, int(port) if port else AGGREGATOR_PORT)
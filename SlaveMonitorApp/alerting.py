@@ -0,0 +1,396 @@
+"""Alert rules evaluated on the master as samples arrive.
+
+Every sample (one slave's metrics from a poll or telemetry push) is
+checked only against the rules for the metrics it contains, using state
+kept per rule and slave, so nothing is ever rescanned. Absence rules are
+driven by a heap of deadlines that is only looked at when one is due.
+
+An alert is raised once when a rule starts firing and resolved once when
+it stops; repeats while it keeps firing are dropped. Notifications are
+rate-limited per alert (a flapping rule notifies at most every
+NOTIFY_INTERVAL) and overall (MAX_ALERTS_PER_MINUTE). An alert held back
+by a limit stays pending and is sent once the limit allows, as long as it
+is still firing. Notifications are handed to subscribers on the engine's
+own thread, so a slow sink never holds up polling.
+
+    python alerting.py    # Run the local webhook receiver that stands in for a real one
+"""
+import heapq
+import json
+import queue
+import socket
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logging_server import LOGGING_PORT
+from registry import REGISTRY
+
+WARNING = "warning"
+CRITICAL = "critical"
+
+NOTIFY_INTERVAL = 300
+MAX_ALERTS_PER_MINUTE = 30
+TICK_INTERVAL = 1
+MAX_QUEUED_ALERTS = 1000
+
+WEBHOOK_PORT = 8765
+WEBHOOK_URL = f"http://127.0.0.1:{WEBHOOK_PORT}/alerts"
+WEBHOOK_TIMEOUT = 2
+LOGGING_ADDRESS = ("127.0.0.1", LOGGING_PORT)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ThresholdRule:
+    """Fires when a metric is above `above` (or below `below`) for `for_seconds`.
+
+    It resolves only once the metric is back past `clear`, which defaults
+    to the threshold itself; a gap between the two keeps a value hovering
+    around the threshold from flapping.
+    """
+    def __init__(self, name, metric, above=None, below=None, clear=None, for_seconds=0, severity=WARNING):
+        self.name = name
+        self.metric = metric
+        self.above = above
+        self.below = below
+        self.threshold = above if above is not None else below
+        self.clear = self.threshold if clear is None else clear
+        self.for_seconds = for_seconds
+        self.severity = severity
+
+    def evaluate(self, state, value, now, firing):
+        """True to fire, False to resolve, None for no change."""
+        if not _is_number(value):
+            return None
+        if firing:
+            cleared = value <= self.clear if self.above is not None else value >= self.clear
+            if not cleared:
+                return None
+            state.pop("since", None)  # A new breach has to last for_seconds again
+            return False
+        breached = value > self.above if self.above is not None else value < self.below
+        if not breached:
+            state.pop("since", None)
+            return None
+        since = state.setdefault("since", now)
+        return True if now - since >= self.for_seconds else None
+
+    def message(self, slave, value):
+        return f"{slave} {self.metric} {value:g} {'>' if self.above is not None else '<'} {self.threshold:g}"
+
+
+class RateRule:
+    """Fires when a metric changes faster than `per_minute` over the last `window` seconds.
+
+    A positive `per_minute` watches for rises and a negative one for drops.
+    It resolves once the rate is back under `clear` (half of `per_minute`
+    unless given).
+    """
+    def __init__(self, name, metric, per_minute, window=60, clear=None, severity=WARNING):
+        self.name = name
+        self.metric = metric
+        self.per_minute = per_minute
+        self.window = window
+        self.clear = per_minute / 2 if clear is None else clear
+        self.severity = severity
+
+    def rate(self, state, value, now):
+        samples = state.setdefault("samples", deque())
+        samples.append((now, value))
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        first_at, first_value = samples[0]
+        if now - first_at < self.window / 2:
+            return None  # Too short a span to tell a trend from noise
+        return (value - first_value) / (now - first_at) * 60
+
+    def evaluate(self, state, value, now, firing):
+        if not _is_number(value):
+            return None
+        rate = self.rate(state, value, now)
+        state["rate"] = rate
+        if rate is None:
+            return None
+        direction = 1 if self.per_minute > 0 else -1
+        if firing:
+            return False if rate * direction < abs(self.clear) else None
+        return True if rate * direction >= abs(self.per_minute) else None
+
+    def message(self, slave, value):
+        return f"{slave} {self.metric} changing faster than {self.per_minute:+g}/min (now {value:g})"
+
+
+class AbsenceRule:
+    """Fires when a slave has not answered for `seconds`."""
+    metric = None
+
+    def __init__(self, name, seconds, severity=CRITICAL):
+        self.name = name
+        self.seconds = seconds
+        self.severity = severity
+
+    def message(self, slave, value):
+        return f"{slave} has not responded for {self.seconds:g}s"
+
+
+DEFAULT_RULES = [
+    ThresholdRule("cpu_hot", "cpu_temp", above=80, clear=75, severity=CRITICAL),
+    ThresholdRule("cpu_warm", "cpu_temp", above=70, clear=65),
+    RateRule("cpu_heating", "cpu_temp", per_minute=10),
+    # USB allows 5 V -5%; brief dips while the load changes are normal
+    ThresholdRule("undervoltage", "adc_value", below=4.75, clear=4.85, for_seconds=10, severity=CRITICAL),
+    ThresholdRule("disk_full", "disk_usage", above=90, clear=85),
+    # Shorter than the registry's expiry, so it fires before the slave is forgotten
+    AbsenceRule("offline", 30),
+]
+
+
+class AlertEngine:
+    """Evaluates rules per sample and notifies subscribers of alert changes.
+
+    Alerts are dicts with "rule", "slave", "severity", "state" ("firing" or
+    "resolved"), "value", "message", "since" and "timestamp".
+    """
+    def __init__(self, rules=DEFAULT_RULES, notify_interval=NOTIFY_INTERVAL,
+                 max_per_minute=MAX_ALERTS_PER_MINUTE):
+        self.rules = list(rules)
+        self.notify_interval = notify_interval
+        self.max_per_minute = max_per_minute
+        self._by_metric = {}
+        for rule in self.rules:
+            if rule.metric is not None:
+                self._by_metric.setdefault(rule.metric, []).append(rule)
+        self._absence_rules = [rule for rule in self.rules if isinstance(rule, AbsenceRule)]
+        self._states = {}  # (rule name, slave) -> rule state
+        self._active = {}  # (rule name, slave) -> firing alert
+        self._last_seen = {}  # slave -> time of its last answer
+        self._deadlines = []  # Heap of (time, rule name, slave) for absence rules
+        self._last_notified = {}  # (rule name, slave) -> time its last firing was sent
+        self._sent = deque()  # Times of recent notifications, for the overall limit
+        self._pending = set()  # Keys of firing alerts whose notification was held back
+        self._listeners = []
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_ALERTS)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"fired": 0, "resolved": 0, "suppressed": 0, "dropped": 0}
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def attach(self, poller, registry=REGISTRY):
+        """Evaluate every result of a Poller and forget slaves the registry drops."""
+        poller.subscribe(lambda result: self.observe(result.name, result.data if result.ok else None,
+                                                     result.timestamp))
+        self.follow(registry)
+        return self
+
+    def follow(self, registry):
+        registry.subscribe(lambda event, slave: event == "removed" and self.forget(slave["name"]))
+        return self
+
+    def forget(self, slave, now=None):
+        """Resolve a departed slave's alerts and drop everything kept for it."""
+        now = time.time() if now is None else now
+        rules = {rule.name: rule for rule in self.rules}
+        with self._lock:
+            for name, _ in [key for key in self._active if key[1] == slave]:
+                self._transition(rules[name], slave, False, None, now)
+            for key in [key for key in self._states if key[1] == slave]:
+                del self._states[key]
+            for key in [key for key in self._last_notified if key[1] == slave]:
+                del self._last_notified[key]
+            self._last_seen.pop(slave, None)
+            self._deadlines = [deadline for deadline in self._deadlines if deadline[2] != slave]
+            heapq.heapify(self._deadlines)
+
+    def observe(self, slave, metrics, timestamp=None):
+        """Feed one sample; `metrics` is None when the slave did not answer."""
+        now = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if slave not in self._last_seen:
+                self._last_seen[slave] = now  # Absence is measured from the first sample
+                for rule in self._absence_rules:
+                    heapq.heappush(self._deadlines, (now + rule.seconds, rule.name, slave))
+            if metrics is None:
+                return
+            self._last_seen[slave] = now
+            for rule in self._absence_rules:
+                if (rule.name, slave) in self._active:
+                    self._transition(rule, slave, False, None, now)
+                    heapq.heappush(self._deadlines, (now + rule.seconds, rule.name, slave))
+            for metric, value in metrics.items():
+                for rule in self._by_metric.get(metric, ()):
+                    key = (rule.name, slave)
+                    change = rule.evaluate(self._states.setdefault(key, {}), value, now, key in self._active)
+                    if change is not None:
+                        self._transition(rule, slave, change, value, now)
+
+    def tick(self, now=None):
+        """Fire absence rules whose deadline has passed and send held-back alerts."""
+        now = time.time() if now is None else now
+        rules = {rule.name: rule for rule in self._absence_rules}
+        with self._lock:
+            for key in sorted(self._pending, key=lambda key: self._active[key]["since"]):
+                self._notify(self._active[key], key, now)
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, name, slave = heapq.heappop(self._deadlines)
+                rule = rules[name]
+                due = self._last_seen[slave] + rule.seconds
+                if due > now:
+                    heapq.heappush(self._deadlines, (due, name, slave))  # Answered since
+                else:
+                    # Re-armed once the slave answers again
+                    self._transition(rule, slave, True, None, now)
+
+    def _transition(self, rule, slave, firing, value, now):
+        key = (rule.name, slave)
+        if firing:
+            if key in self._active:
+                return
+            alert = {
+                "rule": rule.name, "slave": slave, "severity": rule.severity, "state": "firing",
+                "value": value, "message": rule.message(slave, value), "since": now, "timestamp": now,
+            }
+            self._active[key] = alert
+            self.stats["fired"] += 1
+            alert["notified"] = False
+            self._notify(alert, key, now)
+        else:
+            alert = self._active.pop(key, None)
+            if alert is None:
+                return
+            self._pending.discard(key)
+            self.stats["resolved"] += 1
+            # A resolve is only news to whoever heard about the alert
+            if alert["notified"]:
+                self._enqueue(dict(alert, state="resolved", value=value, timestamp=now,
+                                   message=f"Resolved: {alert['message']}"))
+
+    def _notify(self, alert, key, now):
+        """Send a firing alert, or keep it pending until the limits allow it."""
+        if not self._allow(key, now):
+            if key not in self._pending:
+                self.stats["suppressed"] += 1
+                self._pending.add(key)
+            return
+        self._pending.discard(key)
+        alert["notified"] = True
+        self._last_notified[key] = now
+        self._enqueue(dict(alert, timestamp=now))
+
+    def _allow(self, key, now):
+        last = self._last_notified.get(key)
+        while self._sent and now - self._sent[0] > 60:
+            self._sent.popleft()
+        if (last is not None and now - last < self.notify_interval) or len(self._sent) >= self.max_per_minute:
+            return False
+        self._sent.append(now)
+        return True
+
+    def _enqueue(self, alert):
+        alert = {name: value for name, value in alert.items() if name != "notified"}
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def active(self):
+        """Currently firing alerts, oldest first."""
+        with self._lock:
+            return sorted((dict(alert) for alert in self._active.values()), key=lambda alert: alert["since"])
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            try:
+                alert = self._queue.get(timeout=max(0, next_tick - time.monotonic()))
+            except queue.Empty:
+                alert = None
+            if alert is not None:
+                for listener in list(self._listeners):
+                    try:
+                        listener(alert)
+                    except Exception as e:
+                        print(f"[ERROR] Alert delivery failed: {e}")
+            if time.monotonic() >= next_tick:
+                self.tick()
+                next_tick = time.monotonic() + TICK_INTERVAL
+
+    def start(self):
+        """Start delivering alerts and checking absence rules in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+
+def format_alert(alert):
+    stamp = time.strftime("%H:%M:%S", time.localtime(alert["timestamp"]))
+    return f"[ALERT] {stamp} {alert['severity'].upper()} {alert['rule']}: {alert['message']}"
+
+
+def print_alert(alert):
+    print(format_alert(alert))
+
+
+class LogSink:
+    """Sends alerts to the logging server as log entries of the affected slave."""
+    def __init__(self, address=LOGGING_ADDRESS):
+        self.address = address
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, alert):
+        level = alert["severity"].upper() if alert["state"] == "firing" else "INFO"
+        message = {
+            "slave_name": alert["slave"],
+            "logs": [{"ts": alert["timestamp"], "level": level, "message": f"[ALERT] {alert['message']}"}],
+        }
+        self._sock.sendto(json.dumps(message).encode(), self.address)
+
+
+class WebhookSink:
+    """POSTs each alert as JSON to a webhook URL."""
+    def __init__(self, url=WEBHOOK_URL, timeout=WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(alert).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except OSError as e:
+            print(f"[WARNING] Webhook {self.url} failed: {e}")
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            print(f"Webhook received: {format_alert(json.loads(body))}")
+            self.send_response(204)
+        except (ValueError, KeyError, TypeError):
+            self.send_response(400)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_webhook(port=WEBHOOK_PORT):
+    """Local receiver standing in for a real webhook (chat, paging); prints what it gets."""
+    print(f"Webhook receiver listening on port {port}...")
+    ThreadingHTTPServer(("127.0.0.1", port), _WebhookHandler).serve_forever()
+
+
+ALERTS = AlertEngine()
+
+
+if __name__ == "__main__":
+    serve_webhook()
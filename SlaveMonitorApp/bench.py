@@ -0,0 +1,255 @@
+"""Load test the master's poller against simulated slaves on localhost.
+
+Fake slaves are real SlaveServer instances (same framing, dispatch and
+worker pool as slave.py) whose COMMANDS are replaced by stubs with a
+configurable latency and failure rate. They run in worker processes so
+the numbers measured here belong to the master side only.
+
+For every slave count the poller runs for a fixed time and one JSON line
+is written with poll latency percentiles, throughput, coverage, and the
+master's CPU and memory use. Pass a previous run with --compare to fail
+on regressions.
+
+    python bench.py --slaves 10 50 100 200 --output bench_output.txt
+    python bench.py --slaves 10 50 100 200 --compare bench_output.txt
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+import slave
+from poller import Poller
+from registry import SlaveRegistry
+
+BASE_PORT = 47000
+DEFAULT_SLAVE_COUNTS = (10, 50, 100)
+DEFAULT_DURATION = 20
+DEFAULT_INTERVAL = 1.0
+SLAVES_PER_PROCESS = 50
+# A metric regresses when it is this much worse than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+def make_stub_commands(latency, jitter, failure_rate, seed=None):
+    """COMMANDS replacements that sleep like a real collector and sometimes fail."""
+    rng = random.Random(seed)
+
+    def work():
+        time.sleep(max(0.0, rng.gauss(latency, jitter)))
+        if rng.random() < failure_rate:
+            raise RuntimeError("Simulated failure")
+
+    def get_snapshot(params):
+        work()
+        return {"status": "success", "errors": {}, "data": {
+            "cpu_temp": round(rng.uniform(40, 70), 1),
+            "uptime_seconds": time.monotonic(),
+            "uptime": "up 1 day",
+            "disk_usage": round(rng.uniform(10, 90), 1),
+            "usb_devices": rng.randint(0, 4),
+            "adc_value": round(rng.uniform(4.9, 5.2), 2),
+            "model": "Simulated Pi",
+        }}
+
+    def get_uptime(params):
+        work()
+        return {"status": "success", "data": "up 1 day"}
+
+    return {"GET_SNAPSHOT": get_snapshot, "GET_UPTIME": get_uptime}
+
+
+def run_fake_slaves(ports, latency, jitter, failure_rate, ready):
+    """Serve one stubbed SlaveServer per port on a single event loop (worker process)."""
+    slave.COMMAND_TTLS.clear()  # Slaves in one process must not share cached results
+    sys.stdout = open(os.devnull, "w")  # Per-connection logging would drown the results
+
+    async def serve():
+        servers = []
+        for port in ports:
+            server = slave.SlaveServer(host="127.0.0.1", port=port, metrics_port=0, commands=make_stub_commands(
+                latency, jitter, failure_rate, seed=port))
+            servers.append(await asyncio.start_server(server.handle_connection, "127.0.0.1", port,
+                                                      reuse_address=True))
+        ready.set()
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    asyncio.run(serve())
+
+
+def start_fake_slaves(count, args):
+    """Launch `count` fake slaves across worker processes; returns (processes, ports)."""
+    ports = list(range(args.base_port, args.base_port + count))
+    processes = []
+    events = []
+    for start in range(0, count, args.slaves_per_process):
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=run_fake_slaves,
+            args=(ports[start:start + args.slaves_per_process], args.latency, args.jitter, args.failure_rate, ready),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+        events.append(ready)
+    for ready in events:
+        if not ready.wait(30):
+            raise RuntimeError("Fake slaves did not start")
+    return processes, ports
+
+
+def rss_bytes():
+    """Current resident memory of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_step(count, args):
+    """Poll `count` fake slaves for args.duration seconds and summarise."""
+    processes, ports = start_fake_slaves(count, args)
+    registry = SlaveRegistry(expiry=float("inf"), static={})
+    for index, port in enumerate(ports):
+        registry.update(f"bench{index:04d}", "127.0.0.1", port=port)
+
+    latencies = []
+    failures = 0
+
+    def on_result(result):
+        nonlocal failures
+        if result.ok:
+            latencies.append(result.latency)
+        else:
+            failures += 1
+
+    poller = Poller(registry=registry, interval=args.interval)
+    poller.subscribe(on_result)
+    rss_before = rss_bytes()
+    poller.start()
+    time.sleep(args.warmup)
+    latencies.clear()
+    failures = 0
+    wall_start, cpu_start = time.monotonic(), time.process_time()
+    time.sleep(args.duration)
+    wall, cpu = time.monotonic() - wall_start, time.process_time() - cpu_start
+    ok = len(latencies)
+    measured = list(latencies)
+    skipped = sum(stats["skipped"] for stats in poller.stats().values())
+    poller.stop()
+    rss_after = rss_bytes()
+    for process in processes:
+        process.terminate()
+        process.join()
+
+    expected = count * wall / args.interval
+    return {
+        "slaves": count,
+        "duration": round(wall, 3),
+        "interval": args.interval,
+        "slave_latency": args.latency,
+        "failure_rate": args.failure_rate,
+        "polls_ok": ok,
+        "polls_failed": failures,
+        "polls_skipped": skipped,
+        "throughput": round(ok / wall, 2),
+        "coverage": round((ok + failures) / expected, 3) if expected else None,
+        "latency_p50_ms": round(percentile(measured, 50) * 1000, 3) if measured else None,
+        "latency_p95_ms": round(percentile(measured, 95) * 1000, 3) if measured else None,
+        "latency_p99_ms": round(percentile(measured, 99) * 1000, 3) if measured else None,
+        "latency_max_ms": round(max(measured) * 1000, 3) if measured else None,
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "rss_bytes": rss_after,
+        "rss_growth_bytes": rss_after - rss_before,
+    }
+
+
+# Metric -> True if higher is better
+COMPARED_METRICS = {
+    "throughput": True,
+    "coverage": True,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "cpu_percent": False,
+}
+
+
+def compare(results, baseline_path, tolerance):
+    """Return regressions of `results` against the JSON lines in `baseline_path`."""
+    with open(baseline_path) as f:
+        baseline = {entry["slaves"]: entry for entry in map(json.loads, filter(str.strip, f))
+                    if "slaves" in entry}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["slaves"])
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{result['slaves']} slaves: {metric} {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PiVortex master load test with simulated slaves")
+    parser.add_argument("--slaves", type=int, nargs="+", default=list(DEFAULT_SLAVE_COUNTS),
+                        help="Slave counts to run, one step each")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each step")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Poll interval per slave")
+    parser.add_argument("--latency", type=float, default=0.005, help="Mean simulated handler latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.002, help="Standard deviation of handler latency (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of handler calls that fail")
+    parser.add_argument("--base-port", type=int, default=BASE_PORT)
+    parser.add_argument("--slaves-per-process", type=int, default=SLAVES_PER_PROCESS)
+    parser.add_argument("--output", help="Write JSON lines here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="Exit non-zero if worse than this earlier output")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    header = {"benchmark": "poller", "python": platform.python_version(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "started": time.time()}
+    lines = [header]
+    results = []
+    for count in args.slaves:
+        print(f"[INFO] Polling {count} simulated slaves for {args.duration}s...", file=sys.stderr)
+        result = run_step(count, args)
+        print(f"[INFO] {json.dumps(result)}", file=sys.stderr)
+        results.append(result)
+        lines.append(result)
+
+    text = "".join(json.dumps(line) + "\n" for line in lines)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"[ERROR] Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
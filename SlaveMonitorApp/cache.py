@@ -0,0 +1,88 @@
+"""Time-based result cache shared by every connection to the slave."""
+import threading
+import time
+
+
+class MetricCache:
+    """Caches computed values per key for a TTL and counts hits and misses.
+
+    Concurrent lookups of the same missing key wait for a single
+    computation instead of each running it.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._inflight = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, outcome):
+        counters = self._counters.setdefault(name, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def get_or_compute(self, name, key, ttl, compute, cacheable=lambda value: True, wait_timeout=None):
+        """Return the cached value for (name, key), computing it if expired.
+
+        `name` groups keys for statistics and invalidation. A `ttl` of None
+        caches forever. Values for which `cacheable` is false are returned
+        but not stored. A lookup that waits more than `wait_timeout` seconds
+        for another thread's computation computes the value itself.
+        """
+        entry_key = (name, key)
+        while True:
+            with self._lock:
+                entry = self._entries.get(entry_key)
+                if entry and (entry[0] is None or entry[0] > time.monotonic()):
+                    self._count(name, "hits")
+                    return entry[1]
+                waiter = self._inflight.get(entry_key)
+                if waiter is None:
+                    self._count(name, "misses")
+                    self._inflight[entry_key] = threading.Event()
+                    break
+            # Another thread is computing this key; use its result when it lands
+            if not waiter.wait(wait_timeout):
+                with self._lock:
+                    self._count(name, "misses")
+                # That computation is stuck; do not let it hold this thread too
+                return self._compute(entry_key, ttl, compute, cacheable)
+
+        try:
+            return self._compute(entry_key, ttl, compute, cacheable)
+        finally:
+            with self._lock:
+                self._inflight.pop(entry_key).set()
+
+    def _compute(self, entry_key, ttl, compute, cacheable):
+        value = compute()
+        if cacheable(value):
+            expires = None if ttl is None else time.monotonic() + ttl
+            with self._lock:
+                self._entries[entry_key] = (expires, value)
+        return value
+
+    def invalidate(self, name=None):
+        """Drop cached values for one name and the names under it ("<name>.<part>"),
+        or everything if name is None."""
+        with self._lock:
+            if name is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if key[0] == name or key[0].startswith(name + ".")]
+                removed = len(keys)
+                for key in keys:
+                    del self._entries[key]
+        return removed
+
+    def stats(self):
+        """Hit/miss counters per name plus the number of cached entries."""
+        with self._lock:
+            counters = {name: dict(counts) for name, counts in self._counters.items()}
+            entries = len(self._entries)
+        for counts in counters.values():
+            total = counts["hits"] + counts["misses"]
+            counts["hit_ratio"] = round(counts["hits"] / total, 3) if total else 0.0
+        return {"entries": entries, "counters": counters}
+
+
+METRIC_CACHE = MetricCache()
@@ -0,0 +1,123 @@
+"""Latest known state of every slave, as seen by the poller.
+
+Readers such as the dashboard serve requests from this snapshot and never
+query slaves themselves. Every change bumps a version number, which
+doubles as a cache key and lets stream clients ask for what changed since
+the version they last saw.
+"""
+import threading
+import time
+
+# Metrics summarised across the rack as min/max/mean
+SUMMARY_METRICS = ("cpu_temp", "disk_usage", "adc_value")
+# A slave whose last poll is older than this many poll intervals is stale
+STALE_INTERVALS = 3
+
+
+class ClusterState:
+    """Thread-safe map of slave name to its latest poll result."""
+    def __init__(self):
+        self.version = 0
+        self._slaves = {}
+        self._versions = {}  # Version at which each slave last changed
+        self._removed = {}  # Slaves removed at a given version, so streams can report it
+        self._poller = None
+        self._changed = threading.Condition()
+
+    def attach(self, poller, registry):
+        """Follow a Poller's results and drop slaves the registry forgets."""
+        self._poller = poller
+        poller.subscribe(self.on_result)
+        registry.subscribe(lambda event, slave: event == "removed" and self.remove(slave["name"]))
+        return self
+
+    def on_result(self, result):
+        entry = {
+            "name": result.name,
+            "ip": result.ip,
+            "online": result.ok,
+            "metrics": result.data,
+            "errors": result.errors,
+            "error": result.error,
+            "latency": result.latency,
+            "updated": result.timestamp,
+        }
+        with self._changed:
+            previous = self._slaves.get(result.name)
+            if previous is not None and {**previous, "latency": None, "updated": None} == \
+                    {**entry, "latency": None, "updated": None}:
+                # Nothing a client shows has changed; keep caches and streams quiet
+                previous["latency"] = result.latency
+                previous["updated"] = result.timestamp
+                return
+            self.version += 1
+            self._slaves[result.name] = entry
+            self._versions[result.name] = self.version
+            self._removed.pop(result.name, None)
+            self._changed.notify_all()
+
+    def remove(self, name):
+        with self._changed:
+            if self._slaves.pop(name, None) is None:
+                return
+            self._versions.pop(name, None)
+            self.version += 1
+            self._removed[name] = self.version
+            self._changed.notify_all()
+
+    def _interval(self, name):
+        if self._poller is None:
+            return None
+        return self._poller.interval_for(name)
+
+    def _with_staleness(self, entry, now):
+        interval = self._interval(entry["name"])
+        stale = interval is not None and now - entry["updated"] > STALE_INTERVALS * interval
+        return dict(entry, stale=stale)
+
+    def slaves(self):
+        """Copies of all entries, sorted by name."""
+        now = time.time()
+        with self._changed:
+            return [self._with_staleness(self._slaves[name], now) for name in sorted(self._slaves)]
+
+    def get(self, name):
+        with self._changed:
+            entry = self._slaves.get(name)
+            return self._with_staleness(entry, time.time()) if entry else None
+
+    def summary(self):
+        """Rack-wide counts and per-metric min/max/mean over online slaves."""
+        slaves = self.slaves()
+        online = [slave for slave in slaves if slave["online"] and not slave["stale"]]
+        metrics = {}
+        for metric in SUMMARY_METRICS:
+            values = [(slave["metrics"].get(metric), slave["name"]) for slave in online]
+            values = [(value, name) for value, name in values if isinstance(value, (int, float))]
+            if values:
+                metrics[metric] = {
+                    "min": min(values)[0],
+                    "max": max(values)[0],
+                    "mean": sum(value for value, _ in values) / len(values),
+                    "max_slave": max(values)[1],
+                }
+        return {
+            "total": len(slaves),
+            "online": len(online),
+            "offline": sum(1 for slave in slaves if not slave["online"]),
+            "stale": sum(1 for slave in slaves if slave["stale"]),
+            "metrics": metrics,
+        }
+
+    def changes_since(self, version, timeout=None):
+        """Wait until the state moves past `version`; return (version, changed entries, removed names)."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+            now = time.time()
+            changed = [self._with_staleness(self._slaves[name], now)
+                       for name, changed_at in self._versions.items() if changed_at > version]
+            removed = [name for name, removed_at in self._removed.items() if removed_at > version]
+            return self.version, changed, removed
+
+
+CLUSTER = ClusterState()
@@ -0,0 +1,100 @@
+"""Native metric readers for the slave agent.
+
+Each reader takes a `root` directory so it can be pointed at a fake
+sysfs/procfs tree; on a real Pi the root is "/".
+"""
+import os
+
+ROOT = os.environ.get("PIVORTEX_ROOT", "/")
+
+
+def _path(root, path):
+    return os.path.join(root, path.lstrip("/"))
+
+
+def _read_text(root, path):
+    with open(_path(root, path)) as f:
+        return f.read().strip("\x00\n ")
+
+
+def read_cpu_temp(root=ROOT):
+    """Return the CPU temperature in °C from the thermal zones in sysfs."""
+    base = _path(root, "/sys/class/thermal")
+    zones = sorted(name for name in os.listdir(base) if name.startswith("thermal_zone"))
+    if not zones:
+        raise FileNotFoundError(f"No thermal zones under {base}")
+    # Prefer the zone the kernel labels as the CPU; zone0 is the SoC on a Pi
+    chosen = zones[0]
+    for zone in zones:
+        try:
+            if "cpu" in _read_text(root, f"/sys/class/thermal/{zone}/type").lower():
+                chosen = zone
+                break
+        except OSError:
+            continue
+    return int(_read_text(root, f"/sys/class/thermal/{chosen}/temp")) / 1000
+
+
+def read_uptime_seconds(root=ROOT):
+    """Return the system uptime in seconds from /proc/uptime."""
+    return float(_read_text(root, "/proc/uptime").split()[0])
+
+
+def format_uptime(seconds):
+    """Format seconds like `uptime -p`, e.g. "up 2 days, 3 hours, 4 minutes"."""
+    minutes = int(seconds) // 60
+    parts = []
+    for unit, size in (("week", 7 * 24 * 60), ("day", 24 * 60), ("hour", 60), ("minute", 1)):
+        count, minutes = divmod(minutes, size)
+        if count:
+            parts.append(f"{count} {unit}{'s' if count != 1 else ''}")
+    return "up " + (", ".join(parts) if parts else "0 minutes")
+
+
+def read_disk_usage(path="/", root=ROOT):
+    """Return size, used and available bytes plus the use percentage, as df computes them."""
+    stats = os.statvfs(_path(root, path))
+    size = stats.f_blocks * stats.f_frsize
+    used = (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+    available = stats.f_bavail * stats.f_frsize
+    percent = used / (used + available) * 100 if used + available else 0.0
+    return {"size": size, "used": used, "available": available, "percent": percent}
+
+
+def read_mounts(root=ROOT):
+    """Return (device, mount point) pairs for block-device filesystems."""
+    mounts = []
+    for line in _read_text(root, "/proc/mounts").splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].startswith("/dev/"):
+            mounts.append((fields[0], fields[1]))
+    return mounts
+
+
+def list_usb_devices(root=ROOT):
+    """Return the USB devices registered in /sys/bus/usb/devices."""
+    base = _path(root, "/sys/bus/usb/devices")
+    devices = []
+    for name in sorted(os.listdir(base)):
+        # Interfaces (e.g. "1-1:1.0") have no idVendor and are skipped
+        if not os.path.exists(os.path.join(base, name, "idVendor")):
+            continue
+        device_dir = f"/sys/bus/usb/devices/{name}"
+        device = {
+            "bus": int(_read_text(root, f"{device_dir}/busnum")),
+            "device": int(_read_text(root, f"{device_dir}/devnum")),
+            "vendor_id": _read_text(root, f"{device_dir}/idVendor"),
+            "product_id": _read_text(root, f"{device_dir}/idProduct"),
+        }
+        for field in ("manufacturer", "product"):
+            try:
+                device[field] = _read_text(root, f"{device_dir}/{field}")
+            except OSError:
+                device[field] = ""
+        devices.append(device)
+    return devices
+
+
+def read_model(root=ROOT):
+    """Return the board model string from the device tree."""
+    return _read_text(root, "/proc/device-tree/model")
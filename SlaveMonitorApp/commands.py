@@ -1,5 +1,71 @@
 import subprocess
 
+import collectors
+from cache import METRIC_CACHE
+from jobs import EXITED, JOBS, JobError
+from timing import TIMINGS
+from transfers import TRANSFERS, TransferError
+
+STREAM_CHUNK_SIZE = 4096
+# Limits of one JOB_OUTPUT call, so tailing never holds a worker for long
+JOB_OUTPUT_MAX_BYTES = 64 * 1024
+JOB_OUTPUT_MAX_WAIT = 5
+# Extra wait for a synchronous script past its own limit before it is cancelled
+SYNC_SCRIPT_GRACE = 2
+
+# How long each GET_SNAPSHOT field may be served from the cache, in seconds.
+# None caches for the lifetime of the agent; fields not listed are always read.
+SNAPSHOT_FIELD_TTLS = {
+    "model": None,
+    "usb_devices": 10,
+    "disk_usage": 30,
+}
+# Longest a snapshot waits for another request reading the same field before reading it itself
+SNAPSHOT_FIELD_WAIT = 5
+
+# Native readers are used first; subprocess is only a fallback for hosts
+# without the expected sysfs/procfs entries.
+
+def _native_or_fallback(native, fallback):
+    try:
+        return native()
+    except (OSError, ValueError):
+        return fallback()
+
+def _parse_vcgencmd_value(output, unit):
+    """Extract the number from vcgencmd output such as "temp=45.2'C"."""
+    return float(output.split("=")[-1].strip().rstrip(unit))
+
+def _vcgencmd_temp():
+    return _parse_vcgencmd_value(subprocess.check_output(["vcgencmd", "measure_temp"]).decode(), "'C")
+
+def _read_adc(channel):
+    # The PMIC ADC has no sysfs interface, so vcgencmd is the only source
+    return _parse_vcgencmd_value(
+        subprocess.check_output(["vcgencmd", "pmic_read_adc", channel]).decode(), "V")
+
+def _human_size(num_bytes):
+    """Format a byte count the way `df -h` does."""
+    for unit in ("", "K", "M", "G", "T"):
+        if num_bytes < 1024 or unit == "T":
+            return f"{num_bytes:.1f}{unit}" if unit and num_bytes < 10 else f"{num_bytes:.0f}{unit}"
+        num_bytes /= 1024
+
+def _format_usb_device(device):
+    name = " ".join(filter(None, (device["manufacturer"], device["product"])))
+    return (f"Bus {device['bus']:03d} Device {device['device']:03d}: "
+            f"ID {device['vendor_id']}:{device['product_id']} {name}").rstrip()
+
+def _format_disk_usage():
+    lines = [f"{'Filesystem':<16}{'Size':>6}{'Used':>6}{'Avail':>6}{'Use%':>5} Mounted on"]
+    for device, mount_point in collectors.read_mounts():
+        usage = collectors.read_disk_usage(mount_point)
+        lines.append(
+            f"{device:<16}{_human_size(usage['size']):>6}{_human_size(usage['used']):>6}"
+            f"{_human_size(usage['available']):>6}{usage['percent']:>4.0f}% {mount_point}"
+        )
+    return "\n".join(lines)
+
 def request_adc(params):
     try:
         channel = params.get("channel", "EXT5V_V")
@@ -10,22 +76,28 @@ def request_adc(params):
 
 def get_uptime(params):
     try:
-        result = subprocess.check_output(["uptime", "-p"])
-        return {"status": "success", "data": result.decode().strip()}
+        result = _native_or_fallback(
+            lambda: collectors.format_uptime(collectors.read_uptime_seconds()),
+            lambda: subprocess.check_output(["uptime", "-p"]).decode().strip(),
+        )
+        return {"status": "success", "data": result}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 def get_cpu_temp(params):
     try:
-        result = subprocess.check_output(["vcgencmd", "measure_temp"])
-        return {"status": "success", "data": result.decode().strip()}
+        temp = _native_or_fallback(collectors.read_cpu_temp, _vcgencmd_temp)
+        return {"status": "success", "data": f"temp={temp:.1f}'C"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 def list_usb(params):
     try:
-        result = subprocess.check_output(["lsusb"])
-        return {"status": "success", "data": result.decode().strip()}
+        result = _native_or_fallback(
+            lambda: "\n".join(_format_usb_device(d) for d in collectors.list_usb_devices()),
+            lambda: subprocess.check_output(["lsusb"]).decode().strip(),
+        )
+        return {"status": "success", "data": result}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -38,25 +110,179 @@ def reboot(params):
 
 def get_disk_usage(params):
     try:
-        result = subprocess.check_output(["df", "-h"])
-        return {"status": "success", "data": result.decode().strip()}
+        result = _native_or_fallback(
+            _format_disk_usage,
+            lambda: subprocess.check_output(["df", "-h"]).decode().strip(),
+        )
+        return {"status": "success", "data": result}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def get_snapshot(params):
+    """Collect every dashboard metric in one call, as typed fields.
+
+    Fields that cannot be read are set to None and the reason is reported
+    under "errors", so one failing source does not hide the others.
+    """
+    channel = params.get("channel", "EXT5V_V")
+    readers = {
+        "cpu_temp": lambda: _native_or_fallback(collectors.read_cpu_temp, _vcgencmd_temp),
+        "uptime_seconds": collectors.read_uptime_seconds,
+        "disk_usage": lambda: collectors.read_disk_usage("/")["percent"],
+        "usb_devices": lambda: len(collectors.list_usb_devices()),
+        "adc_value": lambda: _read_adc(channel),
+        "model": collectors.read_model,
+    }
+    snapshot = {}
+    errors = {}
+    for field, reader in readers.items():
+        try:
+            if field in SNAPSHOT_FIELD_TTLS:
+                snapshot[field] = METRIC_CACHE.get_or_compute(
+                    f"GET_SNAPSHOT.{field}", None, SNAPSHOT_FIELD_TTLS[field], reader,
+                    wait_timeout=SNAPSHOT_FIELD_WAIT)
+            else:
+                snapshot[field] = reader()
+        except Exception as e:
+            snapshot[field] = None
+            errors[field] = str(e)
+    uptime_seconds = snapshot["uptime_seconds"]
+    snapshot["uptime"] = collectors.format_uptime(uptime_seconds) if uptime_seconds is not None else None
+    return {"status": "success", "data": snapshot, "errors": errors}
+
+def get_stats(params):
+    """Report cache hit/miss counters and rolling timing percentiles.
+
+    Timer names are "queue" (waiting for a worker), "handle_request.<COMMAND>"
+    (every request, cache hits included) and "handler.<COMMAND>" (handler runs).
+    """
+    return {"status": "success", "data": {"cache": METRIC_CACHE.stats(), "timings": TIMINGS.summary()}}
+
+def invalidate_cache(params):
+    """Drop cached results for one command (or snapshot field), or all of them."""
+    removed = METRIC_CACHE.invalidate(params.get("command"))
+    return {"status": "success", "data": {"removed": removed}}
+
+class ScriptStream:
+    """Output of a job, read incrementally as the script produces it."""
+    def __init__(self, job):
+        self.job = job
+        self.offset = 0
+
+    def read_chunk(self):
+        """Return the next chunk of output, or None once the job has finished."""
+        while True:
+            data, self.offset, _, drained = self.job.output.read(self.offset, STREAM_CHUNK_SIZE, wait=1)
+            if data:
+                return data.decode(errors="replace")
+            if drained:
+                return None
+
+    def finish(self):
+        """Wait for the job to end and return the final status."""
+        self.job.wait()
+        return _job_result(self.job, "")
+
+    def cancel(self):
+        """Kill the job if it is still running."""
+        if not self.job.done:
+            JOBS.cancel(self.job.id)
+
+def _job_result(job, data):
+    if job.state == EXITED and job.returncode == 0:
+        return {"status": "success", "data": data}
+    if job.state == EXITED:
+        return {"status": "error", "message": data or f"Script exited with code {job.returncode}"}
+    return {"status": "error", "message": job.error or f"Script {job.state}"}
+
 def run_script(params):
-    """Execute a custom script or command."""
+    """Execute a custom script or command as a job.
+
+    By default waits and returns the output (at most OUTPUT_BUFFER_BYTES).
+    Such a call holds a worker, so it is refused rather than queued when no
+    job slot is free. With `async` set, returns the job ID at once for
+    JOB_STATUS, JOB_OUTPUT and JOB_CANCEL; with `stream` set, returns a
+    ScriptStream so the caller can forward output as it is produced.
+    """
     try:
         script = params.get("script", "")
         if not script:
             return {"status": "error", "message": "No script provided"}
-        # Execute the script
-        result = subprocess.check_output(script, shell=True, stderr=subprocess.STDOUT)
-        return {"status": "success", "data": result.decode().strip()}
-    except subprocess.CalledProcessError as e:
-        return {"status": "error", "message": e.output.decode().strip()}
+        background = params.get("async") or params.get("stream")
+        job = JOBS.submit(script, params.get("timeout"), may_queue=bool(background))
+        if params.get("async"):
+            return {"status": "success", "data": job.status()}
+        if params.get("stream"):
+            return ScriptStream(job)
+        # The job kills itself at its limit; cancel in case that did not end it
+        if not job.wait(job.timeout + SYNC_SCRIPT_GRACE):
+            JOBS.cancel(job.id)
+            return {"status": "error", "message": f"Script timed out after {job.timeout:g}s"}
+        output, _, dropped, _ = job.output.read()
+        data = output.decode(errors="replace").strip()
+        if dropped:
+            data = f"[{dropped} bytes of output dropped]\n{data}"
+        return _job_result(job, data)
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def job_status(params):
+    """State of one job, or of every job the slave still remembers."""
+    try:
+        if "job_id" not in params:
+            return {"status": "success", "data": JOBS.jobs()}
+        return {"status": "success", "data": JOBS.get(params["job_id"]).status()}
+    except JobError as e:
+        return {"status": "error", "message": str(e)}
+
+def job_output(params):
+    """Output of a job from byte `offset` on, for tailing.
+
+    Pass the returned `offset` back to get the next part. `dropped` counts
+    bytes that left the ring buffer before they were read, and `done` is set
+    once the job has finished and all its output was returned. With `wait`,
+    blocks up to that many seconds (at most JOB_OUTPUT_MAX_WAIT) for new output.
+    """
+    try:
+        job = JOBS.get(params.get("job_id"))
+        wait = min(float(params.get("wait", 0)), JOB_OUTPUT_MAX_WAIT)
+        max_bytes = min(int(params.get("max_bytes", JOB_OUTPUT_MAX_BYTES)), JOB_OUTPUT_MAX_BYTES)
+        data, offset, dropped, done = job.output.read(int(params.get("offset", 0)), max_bytes, wait)
+        return {"status": "success", "data": {
+            "output": data.decode(errors="replace"),
+            "offset": offset,
+            "dropped": dropped,
+            "done": done,
+            "job": job.status(),
+        }}
+    except (JobError, ValueError) as e:
+        return {"status": "error", "message": str(e)}
+
+def job_cancel(params):
+    try:
+        return {"status": "success", "data": JOBS.cancel(params.get("job_id")).status()}
+    except JobError as e:
+        return {"status": "error", "message": str(e)}
+
+def file_push(params):
+    """Prepare to receive a file pushed by the master, see transfers.py.
+
+    Returns `skipped` if the destination already has the content; otherwise
+    the data port, a token and the offset to send from.
+    """
+    if not TRANSFERS.port:
+        return {"status": "error", "message": "File pushes are disabled"}
+    try:
+        transfer = TRANSFERS.begin(params.get("path", ""), int(params["size"]), params["sha256"],
+                                   list(params["chunks"]))
+    except (TransferError, KeyError, TypeError, ValueError, OSError) as e:
+        return {"status": "error", "message": str(e)}
+    if transfer is None:
+        return {"status": "success", "data": {"skipped": True}}
+    return {"status": "success", "data": {
+        "skipped": False, "port": TRANSFERS.port, "token": transfer.token, "offset": transfer.offset,
+    }}
+
 COMMANDS = {
     "REQUEST_ADC": request_adc,
     "GET_UPTIME": get_uptime,
@@ -64,5 +290,12 @@ COMMANDS = {
     "LIST_USB": list_usb,
     "REBOOT": reboot,
     "GET_DISK_USAGE": get_disk_usage,
-    "RUN_SCRIPT": run_script
+    "RUN_SCRIPT": run_script,
+    "GET_SNAPSHOT": get_snapshot,
+    "GET_STATS": get_stats,
+    "INVALIDATE_CACHE": invalidate_cache,
+    "JOB_STATUS": job_status,
+    "JOB_OUTPUT": job_output,
+    "JOB_CANCEL": job_cancel,
+    "FILE_PUSH": file_push,
 }
\ No newline at end of file
@@ -1,32 +1,264 @@
-from flask import Flask, jsonify
+import gzip
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+import protocol
+from cluster_state import CLUSTER
+from exposition import CONTENT_TYPE, gauge, render
+from heartbeat import HEARTBEATS
+from log_store import default_store
+from logging_server import default_ingestor
+from metrics_store import STORE
+from poller import default_poller
+from registry import REGISTRY
 
 app = Flask(__name__)
-slaves = [
-    {"name": "slavepi1", "ip": "192.168.0.15", "description": "Raspberry Pi 4"},
-    {"name": "slavepi2", "ip": "192.168.0.20", "description": "Raspberry Pi 5"},
-    {"name": "slavepi3", "ip": "192.168.0.25", "description": "Raspberry Pi 5"},
-    {"name": "slavepi4", "ip": "192.168.0.30", "description": "Raspberry Pi 4"}
-]
+
+DEFAULT_LOG_PAGE = 500
+MAX_LOG_PAGE = 10000
+
+# Responses are built once per state version and reused for every client
+# for up to CACHE_MAX_AGE seconds (so staleness flags still move on).
+CACHE_MAX_AGE = 1.0
+MAX_CACHED_RESPONSES = 256
+GZIP_MIN_SIZE = 512
+DEFAULT_HISTORY_WINDOW = 3600
+STREAM_KEEPALIVE = 15
+# Fields refreshed by every poll; left out of the ETag so it only moves with what changed
+VOLATILE_FIELDS = ("latency", "updated")
+
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+
+def _stable(value):
+    """`value` without VOLATILE_FIELDS, for hashing."""
+    if isinstance(value, dict):
+        return {name: _stable(item) for name, item in value.items() if name not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_stable(item) for item in value]
+    return value
+
+
+def _cached_json(key, build):
+    """JSON response with ETag and optional gzip, built at most once per state version."""
+    now = time.monotonic()
+    with _response_cache_lock:
+        cached = _response_cache.get(key)
+    if cached is None or cached["version"] != CLUSTER.version or now - cached["built"] > CACHE_MAX_AGE:
+        data = build()
+        body = json.dumps(data).encode()
+        etag = hashlib.sha1(json.dumps(_stable(data)).encode()).hexdigest()
+        cached = {"version": CLUSTER.version, "built": now, "body": body, "etag": etag, "gzip": None}
+        with _response_cache_lock:
+            if len(_response_cache) >= MAX_CACHED_RESPONSES:
+                _response_cache.clear()
+            _response_cache[key] = cached
+
+    if request.if_none_match.contains_weak(cached["etag"]):
+        response = Response(status=304)
+    else:
+        body = cached["body"]
+        response = Response(body, mimetype="application/json")
+        if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("Accept-Encoding", ""):
+            if cached["gzip"] is None:
+                cached["gzip"] = gzip.compress(body, 6)
+            response.set_data(cached["gzip"])
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(cached["etag"])
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def _breaker(slave):
+    """Circuit breaker of the connection the poller uses for a registry entry."""
+    return protocol.get_connection(slave["ip"], slave.get("port", protocol.PORT)).breaker
+
 
 @app.route("/slaves", methods=["GET"])
 def get_slaves():
-    return jsonify(slaves)
+    return jsonify([
+        dict(slave, health=_breaker(slave).stats(),
+             heartbeat=HEARTBEATS.get(slave["name"]))
+        for slave in REGISTRY.all()
+    ])
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+@app.route("/api/heartbeats", methods=["GET"])
+def get_heartbeats():
+    """Latest heartbeat of every slave: liveness and basic health without polling."""
+    return jsonify(HEARTBEATS.all())
 
-# 7. `logging_server.py`: Centralized Logging Server
-import socket
-import json
+@app.route("/api/slaves", methods=["GET"])
+def get_cluster():
+    """Latest metrics of every slave."""
+    return _cached_json("slaves", CLUSTER.slaves)
 
-def receive_logs():
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.bind(('', 65434))
-        print("Listening for logs...")
+@app.route("/api/slaves/<name>", methods=["GET"])
+def get_cluster_slave(name):
+    """Latest metrics of one slave."""
+    if CLUSTER.get(name) is None:
+        return jsonify({"status": "error", "message": f"Unknown slave: {name}"}), 404
+    # Someone is looking at this slave; poll it at the full rate for a while
+    default_poller().focus(name)
+    return _cached_json(("slave", name), lambda: CLUSTER.get(name))
+
+@app.route("/api/slaves/<name>/history", methods=["GET"])
+def get_history(name):
+    """Stored samples of one metric.
+
+    Query parameters: metric (default cpu_temp), window in seconds back
+    from now (default 1 h), resolution (a rollup interval such as 60 or
+    3600; raw samples if omitted).
+    """
+    metric = request.args.get("metric", "cpu_temp")
+    try:
+        window = _float_arg("window") or DEFAULT_HISTORY_WINDOW
+        resolution = request.args.get("resolution")
+        resolution = int(resolution) if resolution else None
+        # Round the window's end so clients asking at the same time share the cached result
+        end = int(time.time()) + 1
+        samples = STORE.query(name, metric, end - window, end, resolution)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid parameter: {e}"}), 400
+    key = ("history", name, metric, window, resolution, end)
+    return _cached_json(key, lambda: {"slave": name, "metric": metric, "resolution": resolution,
+                                      "samples": samples})
+
+@app.route("/api/summary", methods=["GET"])
+def get_summary():
+    """Rack-wide counts and metric ranges."""
+    return _cached_json("summary", CLUSTER.summary)
+
+@app.route("/api/stream", methods=["GET"])
+def stream_cluster():
+    """Server-sent events: the full state first, then only slaves that changed."""
+    def generate():
+        version = CLUSTER.version
+        yield f"event: snapshot\nid: {version}\ndata: {json.dumps(CLUSTER.slaves())}\n\n"
         while True:
-            data, addr = s.recvfrom(1024)
-            log = json.loads(data.decode())
-            print(f"Log from {log['slave_name']}: {log['log_message']}")
+            new_version, changed, removed = CLUSTER.changes_since(version, timeout=STREAM_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            data = json.dumps({"changed": changed, "removed": removed})
+            yield f"event: update\nid: {version}\ndata: {data}\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# (metric in the poll result, exported name, help)
+EXPORTED_METRICS = [
+    ("cpu_temp", "pivortex_cpu_temperature_celsius", "CPU temperature"),
+    ("disk_usage", "pivortex_disk_usage_percent", "Root filesystem usage"),
+    ("adc_value", "pivortex_adc_volts", "PMIC ADC reading (EXT5V_V)"),
+    ("uptime_seconds", "pivortex_uptime_seconds", "System uptime"),
+    ("usb_devices", "pivortex_usb_devices", "Connected USB devices"),
+]
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus exposition of the rack, rendered from the cached cluster state."""
+    slaves = CLUSTER.slaves()
+    labels = {slave["name"]: {"slave": slave["name"], "ip": slave["ip"]} for slave in slaves}
+    families = [
+        gauge("pivortex_slave_up", "1 if the last poll succeeded",
+              [(labels[slave["name"]], slave["online"] and not slave["stale"]) for slave in slaves]),
+        gauge("pivortex_poll_latency_seconds", "Round trip of the last poll",
+              [(labels[slave["name"]], slave["latency"]) for slave in slaves]),
+        gauge("pivortex_last_poll_timestamp_seconds", "When the slave was last polled",
+              [(labels[slave["name"]], slave["updated"]) for slave in slaves]),
+    ]
+    for field, name, help_text in EXPORTED_METRICS:
+        families.append(gauge(name, help_text, [
+            (labels[slave["name"]], slave["metrics"].get(field))
+            for slave in slaves if isinstance(slave["metrics"].get(field), (int, float))
+        ]))
+
+    # Cluster entries carry no port; the registry knows which connection the poller uses
+    breakers = [(labels[slave["name"]], _breaker(REGISTRY.get(slave["name"]) or slave).stats())
+                for slave in slaves]
+    poll_stats = default_poller().stats()
+    heartbeats = HEARTBEATS.all()
+    log_stats = default_ingestor().get_stats()
+    families += [
+        gauge("pivortex_breaker_open", "1 while requests to the slave fail fast",
+              [(slave_labels, stats["state"] != "closed") for slave_labels, stats in breakers]),
+        gauge("pivortex_breaker_consecutive_failures", "Failures since the last success",
+              [(slave_labels, stats["failures"]) for slave_labels, stats in breakers]),
+        gauge("pivortex_smoothed_rtt_seconds", "Smoothed request round-trip time",
+              [(slave_labels, stats["srtt"]) for slave_labels, stats in breakers]),
+        gauge("pivortex_polls_total", "Completed polls", [
+            ({"slave": name}, stats["polls"]) for name, stats in sorted(poll_stats.items())], kind="counter"),
+        gauge("pivortex_polls_skipped_total", "Polls skipped because the previous one overran", [
+            ({"slave": name}, stats["skipped"]) for name, stats in sorted(poll_stats.items())], kind="counter"),
+        gauge("pivortex_heartbeat_age_seconds", "Time since the slave's last heartbeat", [
+            ({"slave": beat["name"], "ip": beat["ip"]}, beat["age"]) for beat in heartbeats]),
+        gauge("pivortex_heartbeats_lost_total", "Heartbeats missing from the sequence", [
+            ({"slave": beat["name"], "ip": beat["ip"]}, beat["lost"]) for beat in heartbeats], kind="counter"),
+        gauge("pivortex_log_datagrams_total", "Log datagrams received, and dropped because the queue was full", [
+            ({"outcome": outcome}, log_stats[outcome]) for outcome in ("received", "dropped")], kind="counter"),
+        gauge("pivortex_log_malformed_total", "Unparseable log datagrams and entries",
+              [({}, log_stats["malformed"])], kind="counter"),
+        gauge("pivortex_log_records_total", "Log records stored, and lost in transit by sequence gaps", [
+            ({"outcome": outcome}, log_stats[outcome]) for outcome in ("stored", "lost")], kind="counter"),
+        gauge("pivortex_log_queued_batches", "Received log batches waiting to be written",
+              [({}, log_stats["queued_batches"])]),
+        protocol.REQUEST_LATENCY.render(),
+        protocol.REQUEST_ERRORS.render(),
+        protocol.CONNECTS.render(),
+    ]
+    return Response(render(*families), content_type=CONTENT_TYPE)
+
+def _float_arg(name):
+    value = request.args.get(name)
+    return float(value) if value not in (None, "") else None
+
+@app.route("/logs", methods=["GET"])
+def get_logs():
+    """Query stored slave logs.
+
+    Filters: slave, since/until (Unix timestamps), grep (substring).
+    Returns a page of at most `limit` records with a `next_cursor` to pass
+    back as `cursor`; with stream=1 every match is streamed as NDJSON.
+    """
+    try:
+        since = _float_arg("since")
+        until = _float_arg("until")
+        cursor = int(request.args.get("cursor") or 0)
+        limit = min(int(request.args.get("limit") or DEFAULT_LOG_PAGE), MAX_LOG_PAGE)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid parameter: {e}"}), 400
+
+    matches = default_store().query(
+        slave=request.args.get("slave") or None,
+        since=since,
+        until=until,
+        grep=request.args.get("grep") or None,
+        cursor=cursor,
+    )
+
+    if request.args.get("stream") in ("1", "true"):
+        def generate():
+            for _, record in matches:
+                yield json.dumps(record) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    page = list(itertools.islice(matches, limit + 1))
+    next_cursor = page[limit][0] if len(page) > limit else None
+    return jsonify({"logs": [record for _, record in page[:limit]], "next_cursor": next_cursor})
 
 if __name__ == "__main__":
-    receive_logs()
+    from master_discovery import listen_for_slaves
+    threading.Thread(target=listen_for_slaves, daemon=True).start()
+    # The dashboard only reads what the poller publishes; requests never reach a slave
+    CLUSTER.attach(default_poller(), REGISTRY)
+    default_poller().start()
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,167 @@
+"""Push a file to every slave at once.
+
+The file is hashed once; slaves that already hold the same content skip
+it. The others receive it over their data port with sendfile, within a
+per-slave and a rack-wide bandwidth cap, and a push that breaks off is
+resumed from the last chunk the slave verified. See transfers.py for the
+slave side.
+
+    python file_push.py build/firmware.bin firmware/firmware.bin --rate 5 --total-rate 40
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+from master_discovery import listen_for_slaves
+from registry import REGISTRY
+from transfers import file_digest
+
+MAX_PARALLEL = 16
+ATTEMPTS = 3
+RETRY_DELAY = 2
+# FILE_PUSH may hash an existing copy on the slave first
+BEGIN_TIMEOUT = 60
+# Idle time allowed on the data connection, including the slave's final check
+DATA_TIMEOUT = 30
+# Bytes handed to sendfile between bandwidth checks
+SEND_SLICE = 256 * 1024
+DISCOVERY_WAIT = 11
+
+
+class TokenBucket:
+    """Blocking rate limiter shared by the threads that draw from it."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate / 4, SEND_SLICE)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount  # May go negative; the wait pays it back
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def _send_file(sock, f, offset, size, buckets):
+    while offset < size:
+        count = min(SEND_SLICE, size - offset)
+        for bucket in buckets:
+            bucket.consume(count)
+        sent = sock.sendfile(f, offset, count)
+        if not sent:
+            raise ConnectionError("Connection closed by slave")
+        offset += sent
+
+
+def push_file(ip, local_path, remote_path, digest=None, rate=None, shared_bucket=None):
+    """Push one file to one slave; returns a dict with "status" skipped, pushed or error.
+
+    `digest` is file_digest(local_path), passed in when pushing to many
+    slaves so the file is hashed only once. `rate` caps this push in
+    bytes/s and `shared_bucket` caps it together with other pushes.
+    """
+    sha256, chunks = digest or file_digest(local_path)
+    size = os.path.getsize(local_path)
+    buckets = [bucket for bucket in (TokenBucket(rate) if rate else None, shared_bucket) if bucket]
+    started = time.monotonic()
+    sent = 0
+    error = None
+    for attempt in range(ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_DELAY)
+        response = protocol.send_command(ip, "FILE_PUSH", {
+            "path": remote_path, "size": size, "sha256": sha256, "chunks": chunks,
+        }, timeout=BEGIN_TIMEOUT)
+        if response.get("status") != "success":
+            # Rejected or unreachable; only broken transfers are retried
+            error = response.get("message", "FILE_PUSH failed")
+            break
+        transfer = response["data"]
+        if transfer["skipped"]:
+            return {"status": "skipped", "bytes": 0, "seconds": time.monotonic() - started}
+        try:
+            with socket.create_connection((ip, transfer["port"]), timeout=DATA_TIMEOUT) as sock, \
+                    open(local_path, "rb") as f:
+                sock.sendall(f"{transfer['token']} {transfer['offset']}\n".encode())
+                _send_file(sock, f, transfer["offset"], size, buckets)
+                sock.shutdown(socket.SHUT_WR)
+                reply = sock.makefile("rb").readline().decode().strip()
+        except OSError as e:
+            error = str(e)
+            continue
+        sent += size - transfer["offset"]
+        if reply == "OK":
+            return {"status": "pushed", "bytes": sent, "seconds": time.monotonic() - started,
+                    "resumed_from": transfer["offset"]}
+        error = reply.partition(" ")[2] or "No reply from slave"
+    return {"status": "error", "message": error, "bytes": sent, "seconds": time.monotonic() - started}
+
+
+def push_to_all(local_path, remote_path, registry=REGISTRY, rate=None, total_rate=None,
+                max_parallel=MAX_PARALLEL, on_result=None):
+    """Push a file to every registered slave in parallel; returns {name: result}.
+
+    `rate` caps each slave's transfer and `total_rate` the sum of all of
+    them, both in bytes/s.
+    """
+    digest = file_digest(local_path)
+    shared_bucket = TokenBucket(total_rate) if total_rate else None
+    slaves = {slave["ip"]: slave["name"] for slave in registry.all()}  # One push per host
+
+    def push(ip):
+        result = push_file(ip, local_path, remote_path, digest, rate, shared_bucket)
+        if on_result:
+            on_result(slaves[ip], ip, result)
+        return slaves[ip], result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(slaves)))) as pool:
+        return dict(pool.map(push, slaves))
+
+
+def print_result(name, ip, result):
+    if result["status"] == "error":
+        print(f"[ERROR] {name} ({ip}): {result['message']}")
+    elif result["status"] == "skipped":
+        print(f"[INFO] {name} ({ip}): unchanged, skipped")
+    else:
+        print(f"[INFO] {name} ({ip}): {result['bytes']} bytes in {result['seconds']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push a file to every PiVortex slave")
+    parser.add_argument("local_path")
+    parser.add_argument("remote_path", help="Destination relative to the slave's files directory")
+    parser.add_argument("--rate", type=float, help="Per-slave cap in MB/s")
+    parser.add_argument("--total-rate", type=float, help="Cap on all transfers together in MB/s")
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL, help="Slaves pushed to at once")
+    parser.add_argument("--wait", type=float, default=DISCOVERY_WAIT, help="Seconds to wait for broadcasts")
+    args = parser.parse_args()
+
+    threading.Thread(target=listen_for_slaves, daemon=True).start()
+    print(f"Waiting {args.wait}s for slave broadcasts...")
+    time.sleep(args.wait)
+    results = push_to_all(
+        args.local_path, args.remote_path,
+        rate=args.rate and args.rate * 1e6, total_rate=args.total_rate and args.total_rate * 1e6,
+        max_parallel=args.parallel, on_result=print_result,
+    )
+    counts = {}
+    for result in results.values():
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(f"[INFO] Done: {counts.get('pushed', 0)} pushed, {counts.get('skipped', 0)} skipped, "
+          f"{counts.get('error', 0)} failed")
+    protocol.close_all()
+
+
+if __name__ == "__main__":
+    main()
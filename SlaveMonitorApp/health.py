@@ -0,0 +1,148 @@
+"""Failure detection for slave connections.
+
+Each connection owns a CircuitBreaker. After a few consecutive failures
+the breaker opens and requests fail immediately instead of waiting out
+a connect timeout. Once the backoff expires a single request is let
+through as a probe; if it succeeds the breaker closes again, otherwise
+the backoff doubles. A discovery broadcast from an open slave means it is
+probably back, so the next request may probe right away.
+
+Timeouts adapt to the round-trip times observed on the connection, the
+same way TCP derives its retransmission timeout (SRTT + 4 * RTTVAR).
+"""
+import random
+import threading
+import time
+
+FAILURE_THRESHOLD = 3
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+BACKOFF_JITTER = 0.2  # Spread probes so slaves that died together are not retried together
+
+MIN_CONNECT_TIMEOUT = 0.5
+MIN_REQUEST_TIMEOUT = 1.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class RttEstimator:
+    """Smoothed round-trip time and its variance (RFC 6298)."""
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+
+    def record(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+    def timeout(self, floor, ceiling):
+        """Timeout for the next attempt; the ceiling until there are samples."""
+        if self.srtt is None:
+            return ceiling
+        return min(ceiling, max(floor, self.srtt + 4 * self.rttvar))
+
+
+class CircuitBreaker:
+    """Tracks the health of one slave and decides whether to contact it."""
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, base_backoff=BASE_BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0  # Consecutive times the breaker opened, drives the backoff
+        self.retry_at = 0.0
+        self.last_success = None
+        self.last_heartbeat = None
+        self.connect_rtt = RttEstimator()
+        self.request_rtt = RttEstimator()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go out now.
+
+        When the backoff has expired exactly one caller gets True and acts
+        as the probe; the rest keep failing fast until it reports back.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 when closed)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.retry_at - time.monotonic())
+
+    def record_rtt(self, rtt):
+        with self._lock:
+            self.request_rtt.record(rtt)
+
+    def record_connect(self, rtt):
+        """A connection was accepted; only a response counts as a success."""
+        with self._lock:
+            self.connect_rtt.record(rtt)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"[INFO] {self.name} is reachable again after {self.failures} failures")
+            self.state = CLOSED
+            self.failures = 0
+            self.opened = 0
+            self.last_success = time.time()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** self.opened)
+                backoff *= 1 + random.uniform(-BACKOFF_JITTER, BACKOFF_JITTER)
+                if self.state == CLOSED:
+                    print(f"[WARNING] {self.name} unreachable, backing off {backoff:.1f}s")
+                self.state = OPEN
+                self.opened += 1
+                self.retry_at = time.monotonic() + backoff
+
+    def note_heartbeat(self):
+        """A discovery broadcast arrived; let an open breaker probe at once."""
+        with self._lock:
+            self.last_heartbeat = time.time()
+            if self.state == OPEN:
+                self.retry_at = min(self.retry_at, time.monotonic())
+
+    def connect_timeout(self, ceiling):
+        with self._lock:
+            return self.connect_rtt.timeout(MIN_CONNECT_TIMEOUT, ceiling)
+
+    def request_timeout(self, ceiling):
+        with self._lock:
+            return self.request_rtt.timeout(MIN_REQUEST_TIMEOUT, ceiling)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": max(0.0, self.retry_at - time.monotonic()) if self.state != CLOSED else 0.0,
+                "srtt": self.request_rtt.srtt,
+                "connect_srtt": self.connect_rtt.srtt,
+                "last_success": self.last_success,
+                "last_heartbeat": self.last_heartbeat,
+            }
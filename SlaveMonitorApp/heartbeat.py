@@ -0,0 +1,155 @@
+"""Binary heartbeat that slaves broadcast and the master's discovery listener reads.
+
+Each heartbeat is one small datagram: a fixed-layout header followed by
+the slave's name and description as length-prefixed UTF-8.
+
+    offset  size  field
+    0       4     magic b"PVHB"
+    4       1     format version
+    5       1     flags (reserved, 0)
+    6       4     sequence number, +1 per heartbeat, restarts at 0
+    10      4     uptime, seconds
+    14      2     heartbeat interval, 0.1 s units
+    16      2     CPU temperature, 0.01 'C, signed
+    18      2     1-minute load average, 0.01 units
+    20      2     root filesystem usage, 0.01 %
+    22      1+n   name
+    23+n    1+m   description
+
+A metric that could not be read is sent as MISSING (INT16_MISSING for
+the temperature). Together with the sequence number and the interval
+this gives the master liveness, packet loss and basic health for every
+slave from a single UDP socket, without a TCP round trip.
+"""
+import struct
+import threading
+import time
+
+HEARTBEAT_PORT = 65433
+MAGIC = b"PVHB"
+VERSION = 1
+HEADER = struct.Struct(">4sBBIIHhHH")
+MISSING = 0xFFFF
+INT16_MISSING = -0x8000
+MAX_TEXT = 255
+# A slave is overdue after this many missed heartbeats
+MISSED_HEARTBEATS = 3
+# Heartbeat fields named like the snapshot metrics they stand in for
+HEALTH_FIELDS = ("cpu_temp", "load", "disk_usage", "uptime_seconds")
+
+
+def _scaled(value, scale, missing=MISSING, low=0, high=0xFFFE):
+    if value is None:
+        return missing
+    return max(low, min(high, round(value * scale)))
+
+
+def _unscaled(value, scale, missing=MISSING):
+    return None if value == missing else value / scale
+
+
+def _text(value):
+    data = value.encode()[:MAX_TEXT]
+    return bytes([len(data)]) + data
+
+
+def encode_heartbeat(seq, name, description="", uptime=None, interval=10, cpu_temp=None, load=None,
+                     disk_usage=None):
+    return HEADER.pack(
+        MAGIC, VERSION, 0, seq & 0xFFFFFFFF,
+        0 if uptime is None else min(int(uptime), 0xFFFFFFFF),
+        _scaled(interval, 10, high=0xFFFF),
+        _scaled(cpu_temp, 100, INT16_MISSING, -0x7FFF, 0x7FFF),
+        _scaled(load, 100),
+        _scaled(disk_usage, 100),
+    ) + _text(name) + _text(description)
+
+
+def health(heartbeat):
+    """The metrics a heartbeat carries, keyed like a snapshot."""
+    return {field: heartbeat[field] for field in HEALTH_FIELDS}
+
+
+def is_heartbeat(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def decode_heartbeat(data):
+    """Parse a heartbeat datagram into a dict; raises ValueError if it is not one."""
+    if len(data) < HEADER.size + 2 or not is_heartbeat(data):
+        raise ValueError("Not a heartbeat")
+    magic, version, flags, seq, uptime, interval, temp, load, disk = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported heartbeat version {version}")
+    offset = HEADER.size
+    texts = []
+    for _ in range(2):
+        if offset >= len(data):
+            raise ValueError("Truncated heartbeat")
+        length = data[offset]
+        texts.append(data[offset + 1:offset + 1 + length].decode(errors="replace"))
+        offset += 1 + length
+    return {
+        "seq": seq,
+        "uptime_seconds": uptime,
+        "interval": interval / 10,
+        "cpu_temp": _unscaled(temp, 100, INT16_MISSING),
+        "load": _unscaled(load, 100),
+        "disk_usage": _unscaled(disk, 100),
+        "name": texts[0],
+        "description": texts[1],
+    }
+
+
+class HeartbeatTable:
+    """Latest heartbeat of every slave, with loss and restart counts."""
+    def __init__(self):
+        self._slaves = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """Call `listener(entry)` with every heartbeat recorded, on the discovery thread."""
+        self._listeners.append(listener)
+
+    def record(self, heartbeat, ip, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            previous = self._slaves.get(heartbeat["name"])
+            entry = dict(heartbeat, ip=ip, received=now, lost=0, restarts=0)
+            if previous is not None:
+                entry["lost"] = previous["lost"]
+                entry["restarts"] = previous["restarts"]
+                gap = heartbeat["seq"] - previous["seq"]
+                if gap <= 0:
+                    entry["restarts"] += 1  # The sender started counting again
+                else:
+                    entry["lost"] += gap - 1
+            self._slaves[heartbeat["name"]] = entry
+        for listener in list(self._listeners):
+            try:
+                listener(dict(entry))
+            except Exception as e:
+                print(f"[ERROR] Heartbeat listener failed for {entry['name']}: {e}")
+
+    def _with_liveness(self, entry, now):
+        overdue = now - entry["received"] > MISSED_HEARTBEATS * max(entry["interval"], 0.1)
+        return dict(entry, age=now - entry["received"], alive=not overdue)
+
+    def get(self, name):
+        now = time.time()
+        with self._lock:
+            entry = self._slaves.get(name)
+            return self._with_liveness(entry, now) if entry else None
+
+    def all(self):
+        now = time.time()
+        with self._lock:
+            return [self._with_liveness(entry, now) for _, entry in sorted(self._slaves.items())]
+
+    def remove(self, name):
+        with self._lock:
+            self._slaves.pop(name, None)
+
+
+HEARTBEATS = HeartbeatTable()
@@ -0,0 +1,244 @@
+"""Managed execution of RUN_SCRIPT jobs on the slave.
+
+Scripts run as jobs with an ID, so a master can submit one, poll or tail
+its output and cancel it without holding a connection open. A limited
+number run at once and the rest wait in a queue. Each job is killed, with
+its whole process group, when it runs past its wall-clock limit or
+produces more than MAX_OUTPUT_BYTES. Output is kept in a fixed-size ring
+buffer addressed by absolute byte offset: a reader that falls behind is
+told how many bytes it missed instead of the slave holding everything.
+"""
+import itertools
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+MAX_RUNNING_JOBS = 4
+MAX_QUEUED_JOBS = 32
+# Default and maximum wall-clock time of a job, in seconds
+SCRIPT_TIMEOUT = 300
+# Output kept per job for readers; older bytes are dropped
+OUTPUT_BUFFER_BYTES = 256 * 1024
+# Jobs producing more than this in total are killed
+MAX_OUTPUT_BYTES = 64 * 1024 * 1024
+READ_CHUNK_SIZE = 4096
+# Finished jobs are kept this long, and at most this many, for late readers
+JOB_RETENTION = 600
+MAX_FINISHED_JOBS = 100
+
+QUEUED = "queued"
+RUNNING = "running"
+EXITED = "exited"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+OUTPUT_LIMIT = "output_limit"
+FAILED = "failed"  # Could not be started
+
+
+class JobError(Exception):
+    pass
+
+
+class OutputBuffer:
+    """Ring buffer of the most recent output bytes, addressed by absolute offset."""
+    def __init__(self, capacity=OUTPUT_BUFFER_BYTES):
+        self.capacity = capacity
+        self.data = bytearray()
+        self.start = 0  # Offset of data[0]
+        self.closed = False
+        self._changed = threading.Condition()
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def append(self, chunk):
+        with self._changed:
+            self.data += chunk
+            excess = len(self.data) - self.capacity
+            if excess > 0:
+                del self.data[:excess]
+                self.start += excess
+            self._changed.notify_all()
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def read(self, offset=0, max_bytes=None, wait=0):
+        """Return (bytes, next offset, bytes dropped before them, closed and drained).
+
+        With `wait`, block up to that many seconds for output past `offset`.
+        """
+        with self._changed:
+            if wait:
+                self._changed.wait_for(lambda: self.end > offset or self.closed, wait)
+            dropped = max(0, self.start - offset)
+            offset = max(offset, self.start)
+            stop = self.end if max_bytes is None else min(self.end, offset + max_bytes)
+            chunk = bytes(self.data[offset - self.start:stop - self.start])
+            return chunk, stop, dropped, self.closed and stop == self.end
+
+
+class Job:
+    """One script run: its process, limits, state and output."""
+    def __init__(self, job_id, script, timeout):
+        self.id = job_id
+        self.script = script
+        self.timeout = timeout
+        self.state = QUEUED
+        self.returncode = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.output = OutputBuffer()
+        self.process = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def status(self):
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "returncode": self.returncode,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "output_bytes": self.output.end,
+        }
+
+    def kill(self, state):
+        """Stop the job's process group, recording why."""
+        if self.state == RUNNING:
+            self.state = state
+        if self.process and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (OSError, AttributeError):
+                self.process.kill()
+
+
+class JobPool:
+    """Runs submitted scripts with concurrency, time and output limits."""
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self._jobs = OrderedDict()
+        self._queue = []
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, script, timeout=None, may_queue=True):
+        """Queue a script and return its Job; raises JobError when the queue is full.
+
+        With `may_queue` false the job must start at once, or JobError is raised.
+        """
+        timeout = SCRIPT_TIMEOUT if timeout is None else min(float(timeout), SCRIPT_TIMEOUT)
+        with self._lock:
+            self._expire()
+            if not may_queue and (self._queue or self._running >= self.max_running):
+                raise JobError(f"All {self.max_running} job slots are busy")
+            if len(self._queue) >= self.max_queued:
+                raise JobError(f"Too many queued jobs ({self.max_queued})")
+            job = Job(f"{os.getpid()}-{next(self._ids)}", script, timeout)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._start_queued()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobError(f"Unknown job: {job_id}")
+        return job
+
+    def jobs(self):
+        with self._lock:
+            self._expire()
+            return [job.status() for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        with self._lock:
+            if job.state == QUEUED:
+                self._queue.remove(job)
+                job.state = CANCELLED
+                self._finish(job)
+                return job
+        job.kill(CANCELLED)
+        return job
+
+    def _start_queued(self):
+        while self._queue and self._running < self.max_running:
+            job = self._queue.pop(0)
+            self._running += 1
+            job.state = RUNNING
+            job.started = time.time()
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _finish(self, job):
+        job.finished = time.time()
+        job.output.close()
+        job._done.set()
+
+    def _expire(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        for index, job in enumerate(finished):
+            if now - job.finished > JOB_RETENTION or index < len(finished) - MAX_FINISHED_JOBS:
+                del self._jobs[job.id]
+
+    def _run(self, job):
+        try:
+            # A new session lets a kill reach everything the script started
+            job.process = subprocess.Popen(job.script, shell=True, stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT, start_new_session=True)
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+        else:
+            if job.state != RUNNING:
+                job.kill(job.state)  # Cancelled while starting
+            timer = threading.Timer(job.timeout, job.kill, (TIMED_OUT,))
+            timer.daemon = True
+            timer.start()
+            try:
+                while True:
+                    chunk = job.process.stdout.read1(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    job.output.append(chunk)
+                    if job.output.end > MAX_OUTPUT_BYTES:
+                        job.kill(OUTPUT_LIMIT)
+                        break
+                job.returncode = job.process.wait()
+            finally:
+                timer.cancel()
+                job.process.stdout.close()
+            if job.state == RUNNING:
+                job.state = EXITED
+            elif job.state == TIMED_OUT:
+                job.error = f"Script timed out after {job.timeout:g}s"
+            elif job.state == OUTPUT_LIMIT:
+                job.error = f"Script output exceeded {MAX_OUTPUT_BYTES} bytes"
+        with self._lock:
+            self._running -= 1
+            self._finish(job)
+            self._start_queued()
+
+
+JOBS = JobPool()
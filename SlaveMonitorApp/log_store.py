@@ -0,0 +1,199 @@
+"""Rotating, compressed, indexed storage for slave logs.
+
+Records are buffered into blocks. Each full block is gzip-compressed and
+appended to the active segment file as an independent gzip member, so a
+segment stays a valid .gz file while single blocks can be read back on
+their own. For every block a line is appended to the segment's index
+file with its byte range, time range, per-slave line counts and the
+store-wide number of its first record. Record numbers never change, so
+they double as stable pagination cursors.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+
+LOG_DIR = os.environ.get("PIVORTEX_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"))
+BLOCK_LINES = 1000
+BLOCK_SECONDS = 2
+SEGMENT_BYTES = 32 * 1024 * 1024
+MAX_SEGMENTS = 64
+
+
+class Segment:
+    """One segment file and the index entries of its blocks."""
+    def __init__(self, directory, segment_id):
+        self.segment_id = segment_id
+        self.data_path = os.path.join(directory, f"segment-{segment_id}.log.gz")
+        self.index_path = os.path.join(directory, f"segment-{segment_id}.idx")
+        self.blocks = []
+        self.size = 0
+
+    @property
+    def start(self):
+        return self.blocks[0]["start"] if self.blocks else None
+
+    @property
+    def end(self):
+        return self.blocks[-1]["end"] if self.blocks else None
+
+    def load(self):
+        """Read the block index back from disk."""
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.blocks = [json.loads(line) for line in f if line.strip()]
+        self.size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        return self
+
+    def read_block(self, block):
+        """Return the records of one indexed block."""
+        with open(self.data_path, "rb") as f:
+            f.seek(block["offset"])
+            data = gzip.decompress(f.read(block["length"]))
+        return [json.loads(line) for line in data.splitlines()]
+
+
+class LogStore:
+    """Append-only log storage with block-level time and slave index."""
+    def __init__(self, directory=LOG_DIR, block_lines=BLOCK_LINES, block_seconds=BLOCK_SECONDS,
+                 segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS):
+        self.directory = directory
+        self.block_lines = block_lines
+        self.block_seconds = block_seconds
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._pending = []
+        self._pending_since = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = self._load_segments()
+        if not self.segments:
+            self.segments.append(Segment(directory, self._next_segment_id()))
+        last_blocks = [segment.blocks[-1] for segment in self.segments if segment.blocks]
+        self.written = last_blocks[-1]["first"] + last_blocks[-1]["count"] if last_blocks else 0
+
+    def _load_segments(self):
+        ids = sorted(
+            int(name[len("segment-"):-len(".idx")])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".idx")
+        )
+        return [Segment(self.directory, segment_id).load() for segment_id in ids]
+
+    def _next_segment_id(self):
+        # Millisecond ids keep segments in creation order
+        last = self.segments[-1].segment_id if getattr(self, "segments", None) else 0
+        return max(int(time.time() * 1000), last + 1)
+
+    def append(self, records):
+        """Buffer records (dicts with at least "ts" and "slave") and flush full blocks."""
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.extend(records)
+            while len(self._pending) >= self.block_lines:
+                block, self._pending = self._pending[:self.block_lines], self._pending[self.block_lines:]
+                self._write_block(block)
+            if not self._pending:
+                self._pending_since = None
+
+    def flush(self, force=False):
+        """Write the buffered partial block if it is old enough (or always with force)."""
+        with self._lock:
+            if not self._pending:
+                return
+            if force or time.monotonic() - self._pending_since >= self.block_seconds:
+                block, self._pending = self._pending, []
+                self._pending_since = None
+                self._write_block(block)
+
+    def query(self, slave=None, since=None, until=None, grep=None, cursor=0):
+        """Yield (record number, record) for matching records in arrival order.
+
+        Blocks whose indexed time range or slave set cannot match are skipped
+        without being read. `cursor` is the first record number to consider;
+        pass the last yielded number + 1 to continue a previous query.
+        """
+        with self._lock:
+            blocks = [(segment, list(segment.blocks)) for segment in self.segments]
+            pending = list(self._pending)
+            pending_first = self.written
+
+        def matches(record):
+            return ((slave is None or record["slave"] == slave)
+                    and (since is None or record["ts"] >= since)
+                    and (until is None or record["ts"] <= until)
+                    and (grep is None or grep in record["message"]))
+
+        for segment, entries in blocks:
+            if entries and entries[-1]["first"] + entries[-1]["count"] <= cursor:
+                continue
+            for entry in entries:
+                if entry["first"] + entry["count"] <= cursor:
+                    continue
+                if slave is not None and slave not in entry["slaves"]:
+                    continue
+                if (since is not None and entry["end"] < since) or (until is not None and entry["start"] > until):
+                    continue
+                try:
+                    records = segment.read_block(entry)
+                except OSError:
+                    continue  # Segment expired while we were reading
+                for offset, record in enumerate(records):
+                    number = entry["first"] + offset
+                    if number >= cursor and matches(record):
+                        yield number, record
+
+        for offset, record in enumerate(pending):
+            number = pending_first + offset
+            if number >= cursor and matches(record):
+                yield number, record
+
+    def _write_block(self, records):
+        segment = self.segments[-1]
+        if segment.size >= self.segment_bytes:
+            segment = self._rotate()
+        payload = gzip.compress("".join(json.dumps(record) + "\n" for record in records).encode())
+        slaves = {}
+        for record in records:
+            slaves[record["slave"]] = slaves.get(record["slave"], 0) + 1
+        entry = {
+            "first": self.written,
+            "offset": segment.size,
+            "length": len(payload),
+            "start": min(record["ts"] for record in records),
+            "end": max(record["ts"] for record in records),
+            "count": len(records),
+            "slaves": slaves,
+        }
+        with open(segment.data_path, "ab") as f:
+            f.write(payload)
+        with open(segment.index_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        segment.size += len(payload)
+        segment.blocks.append(entry)
+        self.written += len(records)
+
+    def _rotate(self):
+        segment = Segment(self.directory, self._next_segment_id())
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            expired = self.segments.pop(0)
+            for path in (expired.data_path, expired.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return segment
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """The LogStore shared by the logging server and the dashboard in one process."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = LogStore()
+        return _default_store
@@ -1,20 +1,171 @@
-import socket
 import json
+import math
+import queue
+import select
+import socket
+import threading
+import time
 
-def receive_logs():
-    """
-    Listens for log messages sent by slaves and prints them to the console.
+from log_store import default_store
+
+LOGGING_PORT = 65434
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel socket buffer to absorb bursts
+MAX_DATAGRAM_SIZE = 65535
+RECV_BATCH_SIZE = 256
+QUEUE_MAX_BATCHES = 1024
+ECHO_LOGS = False
+
+
+class LogIngestor:
+    """Receives log datagrams from slaves and appends them to a LogStore.
+
+    The receiver thread only drains the socket in batches and hands them to
+    a bounded queue; parsing, loss detection and disk writes happen on the
+    writer thread. When the queue is full whole batches are dropped and
+    counted rather than blocking the socket.
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.bind(('', 65434))  # Bind to the logging port
-        print("Listening for logs on port 65434...")
+    def __init__(self, store=None, port=LOGGING_PORT, echo=ECHO_LOGS):
+        self.store = store if store is not None else default_store()
+        self.port = port
+        self.echo = echo
+        self.queue = queue.Queue(maxsize=QUEUE_MAX_BATCHES)
+        self.next_seq = {}
+        self.stats = {"received": 0, "dropped": 0, "malformed": 0, "lost": 0, "stored": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats, queued_batches=self.queue.qsize())
+
+    def receive_loop(self, sock):
+        """Drain the socket in batches: wait until readable, then take everything that is ready."""
+        sock.setblocking(False)
+        while True:
+            select.select([sock], [], [])
+            batch = []
+            try:
+                while len(batch) < RECV_BATCH_SIZE:
+                    batch.append(sock.recvfrom(MAX_DATAGRAM_SIZE))
+            except BlockingIOError:
+                pass
+            if not batch:
+                continue
+            self._count("received", len(batch))
+            try:
+                self.queue.put_nowait((time.time(), batch))
+            except queue.Full:
+                self._count("dropped", len(batch))
+
+    def write_loop(self):
+        """Parse queued batches and append them to the store."""
         while True:
-            data, addr = s.recvfrom(1024)  # Receive logs
             try:
-                log = json.loads(data.decode())
-                print(f"Log from {log['slave_name']} ({addr[0]}): {log['log_message']}")
-            except json.JSONDecodeError:
-                print(f"Received malformed log data from {addr[0]}: {data.decode()}")
+                received, batch = self.queue.get(timeout=self.store.block_seconds)
+            except queue.Empty:
+                self.store.flush()
+                continue
+            # One bad batch must not stop ingestion for good
+            try:
+                records = []
+                for data, addr in batch:
+                    records.extend(self.parse_datagram(data, addr[0], received))
+                if records:
+                    self.store.append(records)
+                    self._count("stored", len(records))
+                self.store.flush()
+            except Exception as e:
+                print(f"[ERROR] Failed to store a batch of {len(batch)} log datagrams: {e}")
+
+    def parse_datagram(self, data, ip, received):
+        """Turn one datagram into log records, tracking sequence gaps per slave."""
+        try:
+            message = json.loads(data.decode())
+            slave = str(message["slave_name"])
+            if "logs" in message:
+                sent = len(message["logs"])
+                entries = [entry for entry in message["logs"] if isinstance(entry, dict)]
+                seq = message.get("seq")
+                if seq is not None:
+                    seq = int(seq)
+            else:
+                # Older slaves send a single unsequenced message per datagram
+                entries = [{"message": message.get("log_message", "")}]
+                sent = 1
+                seq = None
+        except (UnicodeDecodeError, ValueError, KeyError, TypeError, AttributeError):
+            self._count("malformed")
+            if self.echo:
+                print(f"Received malformed log data from {ip}: {data[:200]!r}")
+            return []
+
+        if seq is not None:
+            expected = self.next_seq.get(slave)
+            if expected is not None and seq > expected:
+                self._count("lost", seq - expected)
+            # A lower sequence number means the slave restarted; resync to it
+            self.next_seq[slave] = seq + sent
+
+        records = []
+        for offset, entry in enumerate(entries):
+            ts = entry.get("ts", received)
+            try:
+                ts = float(ts)
+                if not math.isfinite(ts):
+                    raise ValueError
+            except (TypeError, ValueError):
+                self._count("malformed")  # Kept, stamped with the time it arrived
+                ts = received
+            record = {
+                "ts": ts,
+                "slave": slave,
+                "ip": ip,
+                "message": entry.get("message", ""),
+            }
+            if "level" in entry:
+                record["level"] = entry["level"]
+            if seq is not None:
+                record["seq"] = seq + offset
+            records.append(record)
+            if self.echo:
+                print(f"Log from {slave} ({ip}): {record['message']}")
+        return records
+
+    def serve_forever(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+            s.bind(('', self.port))  # Bind to the logging port
+            print(f"Listening for logs on port {self.port}...")
+            threading.Thread(target=self.write_loop, daemon=True).start()
+            self.receive_loop(s)
+
+
+_default_ingestor = None
+_default_ingestor_lock = threading.Lock()
+
+
+def default_ingestor():
+    """The LogIngestor of this process, so its counters can be read while it runs."""
+    global _default_ingestor
+    with _default_ingestor_lock:
+        if _default_ingestor is None:
+            _default_ingestor = LogIngestor()
+        return _default_ingestor
+
+
+def receive_logs(store=None):
+    """
+    Listens for log messages sent by slaves and stores them in rotating log segments.
+    """
+    ingestor = default_ingestor()
+    if store is not None:
+        ingestor.store = store
+    ingestor.serve_forever()
 
 if __name__ == "__main__":
-    receive_logs()
+    ingestor = default_ingestor()
+    ingestor.echo = True
+    ingestor.serve_forever()
@@ -1,54 +1,105 @@
-import socket
-import json
-from textwrap import indent
-
-SLAVES = {
-    "slavepi1": "192.168.0.15", 
-    "slavepi2": "192.168.0.20", 
-    "slavepi3": "192.168.0.25",
-    "slavepi4": "192.168.0.30"
-}
+import threading
+import time
+
+import protocol
+from master_discovery import listen_for_slaves
+from registry import REGISTRY
+
+# Slaves broadcast every 10 s; wait a little longer when run standalone
+DISCOVERY_WAIT = 11
 PORT = 65432
-TIMEOUT = 5
+# Seconds each JOB_OUTPUT call may wait on the slave for new output
+JOB_TAIL_WAIT = 2
 
-DETAIL_COMMANDS = [
-    "GET_CPU_TEMP",
-    "GET_UPTIME",
-    "GET_DISK_USAGE",
-    "LIST_USB"
+SNAPSHOT_FIELDS = [
+    ("cpu_temp", "CPU Temp", "{:.1f}'C"),
+    ("uptime", "Uptime", "{}"),
+    ("disk_usage", "Disk Usage", "{:.1f}%"),
+    ("usb_devices", "USB Devices", "{}"),
+    ("adc_value", "ADC (EXT5V_V)", "{:.2f}V"),
+    ("model", "Model", "{}"),
 ]
 
-def send_command(ip, command, params=None):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(TIMEOUT)
-            s.connect((ip, PORT))
-            s.sendall(json.dumps({"command": command, "params": params}).encode())
-            data = s.recv(1024)
-            return json.loads(data.decode())
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
-
-def query_slaves():
-    for name, ip in SLAVES.items():
+def send_command(ip, command, params=None, timeout=None):
+    # Without a timeout it adapts to the slave's RTT, see health.py
+    return protocol.send_command(ip, command, params, timeout=timeout)
+
+def fetch_snapshot(ip):
+    """Fetch all metrics of a slave in one round trip."""
+    return send_command(ip, "GET_SNAPSHOT", {"channel": "EXT5V_V"})
+
+def submit_script(ip, script, timeout=None):
+    """Start a script on a slave without waiting for it; returns the job ID or None."""
+    params = {"script": script, "async": True}
+    if timeout is not None:
+        params["timeout"] = timeout
+    response = send_command(ip, "RUN_SCRIPT", params)
+    if response.get("status") != "success":
+        print(f"[ERROR] Could not start script on {ip}: {response.get('message')}")
+        return None
+    return response["data"]["job_id"]
+
+def tail_job(ip, job_id, on_output=lambda text: print(text, end=""), wait=JOB_TAIL_WAIT):
+    """Follow a job's output until it finishes and return its final status.
+
+    Only output not seen yet is fetched on each call; if the slave's buffer
+    wrapped in between, the gap is reported instead of the missing bytes.
+    """
+    offset = 0
+    while True:
+        # The slave may hold the call for `wait` seconds, longer than an RTT-based timeout
+        response = send_command(ip, "JOB_OUTPUT", {"job_id": job_id, "offset": offset, "wait": wait},
+                                timeout=wait + protocol.TIMEOUT)
+        if response.get("status") != "success":
+            print(f"[ERROR] Lost job {job_id} on {ip}: {response.get('message')}")
+            return None
+        result = response["data"]
+        if result["dropped"]:
+            on_output(f"\n[... {result['dropped']} bytes skipped ...]\n")
+        if result["output"]:
+            on_output(result["output"])
+        offset = result["offset"]
+        if result["done"]:
+            return result["job"]
+
+def cancel_job(ip, job_id):
+    return send_command(ip, "JOB_CANCEL", {"job_id": job_id})
+
+def query_slaves(registry=REGISTRY):
+    for slave in registry.all():
+        name, ip = slave["name"], slave["ip"]
         print(f"\nQuerying details from {name} ({ip})...")
-        results = {"slave": name, "ip": ip, "details": {}}
-        for command in DETAIL_COMMANDS:
-            response = send_command(ip, command)
-            results["details"][command] = response
+        response = fetch_snapshot(ip)
 
         # Print results in a structured and readable format
         print("=" * 40)
-        print(f"Slave: {results['slave']} ({results['ip']})")
-        for cmd, result in results["details"].items():
-            status = result.get('status', 'unknown')
-            if status == 'success':
-                data = result.get('data', 'No data available')
-                print(f"{cmd}:\n{indent(data, '  ')}")
-            else:
-                message = result.get('message', 'Unknown error')
-                print(f"{cmd}: ERROR - {message}")
+        print(f"Slave: {name} ({ip})")
+        if response.get("status") == "success":
+            snapshot = response.get("data", {})
+            errors = response.get("errors", {})
+            for field, label, fmt in SNAPSHOT_FIELDS:
+                value = snapshot.get(field)
+                if value is None:
+                    print(f"{label}: ERROR - {errors.get(field, 'No data available')}")
+                else:
+                    print(f"{label}: {fmt.format(value)}")
+        else:
+            print(f"ERROR - {response.get('message', 'Unknown error')}")
         print("=" * 40)
 
+def print_update(ip, state, delta):
+    """Print the fields that changed on a slave, or that it went offline."""
+    slave = REGISTRY.find_by_ip(ip)
+    name = slave["name"] if slave else ip
+    if not state:
+        print(f"[WARNING] {name} ({ip}) went offline")
+        return
+    for field, label, fmt in SNAPSHOT_FIELDS:
+        if field in delta and delta[field] is not None:
+            print(f"{name} ({ip}) {label}: {fmt.format(delta[field])}")
+
 if __name__ == "__main__":
+    threading.Thread(target=listen_for_slaves, daemon=True).start()
+    print(f"Waiting {DISCOVERY_WAIT}s for slave broadcasts...")
+    time.sleep(DISCOVERY_WAIT)
     query_slaves()
@@ -1,15 +1,58 @@
 import socket
 import json
+import time
 
-def listen_for_slaves():
-    slaves = {}
+import protocol
+from heartbeat import HEARTBEAT_PORT, HEARTBEATS, decode_heartbeat, is_heartbeat
+from registry import REGISTRY
+
+DISCOVERY_PORT = HEARTBEAT_PORT
+# Room for a burst of heartbeats from hundreds of slaves
+RECV_BUFFER_SIZE = 1024 * 1024
+EXPIRE_INTERVAL = 1
+
+def parse_broadcast(data):
+    """Slave info from a binary heartbeat, or from the JSON older slaves send."""
+    if is_heartbeat(data):
+        return decode_heartbeat(data)
+    return json.loads(data.decode())
+
+def listen_for_slaves(registry=REGISTRY, heartbeats=HEARTBEATS):
+    """Feed slave broadcasts into the registry and expire slaves that go quiet.
+
+    Heartbeat metrics go to `heartbeats`, not the registry, so a changing
+    reading does not look like a changed slave.
+    """
+    registry.subscribe(lambda event, slave: event == "removed" and heartbeats.remove(slave["name"]))
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        s.bind(('', 65433))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        s.bind(('', DISCOVERY_PORT))
+        s.settimeout(EXPIRE_INTERVAL)  # Wake up regularly to expire silent slaves
+        expired = time.monotonic()
         while True:
-            data, addr = s.recvfrom(1024)
-            slave = json.loads(data.decode())
-            slaves[addr[0]] = slave
-            print(f"Discovered: {slave}")
+            # Expiry scans every slave, so run it once per interval rather than per datagram
+            if time.monotonic() - expired >= EXPIRE_INTERVAL:
+                registry.expire()
+                expired = time.monotonic()
+            try:
+                data, addr = s.recvfrom(1024)
+            except socket.timeout:
+                continue
+            try:
+                slave = parse_broadcast(data)
+            except (ValueError, UnicodeDecodeError):
+                print(f"[WARNING] Malformed discovery broadcast from {addr[0]}")
+                continue
+            # The source address is authoritative; the payload may carry a stale IP
+            name = slave.get("name") or addr[0]
+            # The advertised interval sets how long the registry waits before expiring the slave
+            info = {"heartbeat_interval": slave["interval"]} if slave.get("interval") else {}
+            if registry.update(name, addr[0], slave.get("description", ""), **info) == "added":
+                print(f"Discovered: {name} ({addr[0]}) {slave.get('description', '')}")
+            if "seq" in slave:
+                heartbeats.record(dict(slave, name=name), addr[0])
+            # A broadcast from a slave we could not reach suggests it is back
+            protocol.get_connection(addr[0]).breaker.note_heartbeat()
 
 if __name__ == "__main__":
-    listen_for_slaves()
\ No newline at end of file
+    listen_for_slaves()
@@ -1,18 +1,46 @@
+import argparse
 import threading
-from master import query_slaves
+from aggregator import AGGREGATOR_PORT, RACK_NAME, register_aggregators, serve_aggregator
+from alerting import ALERTS, LogSink, WebhookSink, serve_webhook
+from heartbeat import HEARTBEATS, health
+from master import print_update
+from metrics_store import STORE
+from poller import default_poller
+from registry import REGISTRY
+from telemetry import diff_snapshot
+import protocol
 from master_discovery import listen_for_slaves
+from cluster_state import CLUSTER
 from dashboard import app
 from logging_server import receive_logs
+from log_store import default_store
 import time
 
 
 def run_master():
     print("Starting Master Command Handler...")
+    previous = {}
+
+    def on_result(result):
+        # Runs on the poller's event loop; keep it quick
+        state = result.data if result.ok else {}
+        if state or previous.get(result.name):
+            print_update(result.ip, state, diff_snapshot(previous.get(result.name, {}), state))
+        previous[result.name] = state
+        STORE.record_snapshot(result.name, state, result.ok, result.timestamp)
+
+    # One event loop polls every slave the registry knows about; slaves with
+    # live heartbeats only slowly, so their health is recorded from those
+    poller = default_poller()
+    poller.subscribe(on_result)
+    HEARTBEATS.subscribe(lambda beat: STORE.record_snapshot(beat["name"], health(beat), True, beat["received"]))
+    ALERTS.attach(poller)
+    poller.start()
     while True:
-        print("\n[INFO] Querying slaves...")
-        query_slaves()
-        print("[INFO] Completed querying slaves. Waiting for next cycle...\n")
         time.sleep(30)
+        latest = list(poller.latest.values())
+        online = sum(1 for result in latest if result.ok)
+        print(f"[INFO] {online}/{len(latest)} slaves responding.")
 
 
 def run_discovery():
@@ -22,6 +50,8 @@ def run_discovery():
 
 def run_dashboard():
     print("Starting Dashboard Server...")
+    # The dashboard only reads what the poller publishes; requests never reach a slave
+    CLUSTER.attach(default_poller(), REGISTRY)
     app.run(host="0.0.0.0", port=5000)
 
 
@@ -30,14 +60,44 @@ def run_logging_server():
     receive_logs()
 
 
+def run_alerting():
+    print("Starting Alerting...")
+    # Heartbeats carry health for slaves the poller only visits now and then
+    HEARTBEATS.subscribe(lambda beat: ALERTS.observe(beat["name"], health(beat), beat["received"]))
+    # Alerts go to the slave's log and to the webhook; the local receiver prints them
+    ALERTS.subscribe(LogSink())
+    ALERTS.subscribe(WebhookSink())
+    ALERTS.start()
+    serve_webhook()
+
+
+def run_aggregator(rack, port):
+    print("Starting Rack Aggregator...")
+    serve_aggregator(default_poller(), rack=rack, port=port)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="PiVortex master")
+    parser.add_argument("--aggregator", action="store_true",
+                        help="Also serve this rack's pre-aggregated state to an upstream master")
+    parser.add_argument("--rack", default=RACK_NAME, help="Rack name reported upstream")
+    parser.add_argument("--upstream-port", type=int, default=AGGREGATOR_PORT,
+                        help="Port upstream masters connect to in aggregator mode")
+    parser.add_argument("--aggregators", nargs="+", default=[], metavar="HOST[:PORT]",
+                        help="Rack aggregators to poll, each as one slave")
+    args = parser.parse_args()
+    register_aggregators(args.aggregators)
+
     # Run each service in a separate thread
     threads = [
         threading.Thread(target=run_master, daemon=True),
         threading.Thread(target=run_discovery, daemon=True),
         threading.Thread(target=run_dashboard, daemon=True),
         threading.Thread(target=run_logging_server, daemon=True),
+        threading.Thread(target=run_alerting, daemon=True),
     ]
+    if args.aggregator:
+        threads.append(threading.Thread(target=run_aggregator, args=(args.rack, args.upstream_port), daemon=True))
 
     for thread in threads:
         thread.start()
@@ -49,6 +109,8 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\n[INFO] Shutting down services... Exiting program.")
+        protocol.close_all()
+        default_store().flush(force=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+"""Embedded append-only time-series store for per-slave metrics.
+
+Raw samples live in fixed-size columnar segments (one array of timestamps
+and one of values) that are dropped whole once they fall out of the raw
+retention window. Every sample is also folded into fixed-interval rollups
+(1 min and 1 h by default) whose buckets are addressed by index, so they
+need no timestamp column and range queries are plain slicing.
+"""
+import bisect
+import threading
+import time
+from array import array
+
+# Metrics taken from a GET_SNAPSHOT result; "online" is recorded as 1/0
+SNAPSHOT_METRICS = ("cpu_temp", "disk_usage", "adc_value")
+
+SEGMENT_SIZE = 900
+RAW_RETENTION = 3600
+# (bucket width, retention) in seconds
+DEFAULT_ROLLUPS = (
+    (60, 7 * 24 * 3600),
+    (3600, 90 * 24 * 3600),
+)
+
+
+class _Segment:
+    """A run of raw samples stored column-wise."""
+    __slots__ = ("timestamps", "values")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.values = array("f")
+
+
+class RawSeries:
+    """Raw samples in append-only segments with whole-segment retention."""
+    def __init__(self, retention=RAW_RETENTION, segment_size=SEGMENT_SIZE):
+        self.retention = retention
+        self.segment_size = segment_size
+        self.segments = [_Segment()]
+
+    def append(self, ts, value):
+        segment = self.segments[-1]
+        if segment.timestamps and ts < segment.timestamps[-1]:
+            return False  # Append-only: late samples only feed the rollups
+        if len(segment.timestamps) >= self.segment_size:
+            segment = _Segment()
+            self.segments.append(segment)
+        segment.timestamps.append(ts)
+        segment.values.append(value)
+        cutoff = ts - self.retention
+        while len(self.segments) > 1 and self.segments[0].timestamps[-1] < cutoff:
+            del self.segments[0]
+        return True
+
+    def query(self, start, end):
+        firsts = [segment.timestamps[0] if segment.timestamps else float("inf") for segment in self.segments]
+        index = max(bisect.bisect_right(firsts, start) - 1, 0)
+        points = []
+        for segment in self.segments[index:]:
+            if not segment.timestamps or segment.timestamps[0] > end:
+                break
+            lo = bisect.bisect_left(segment.timestamps, start)
+            hi = bisect.bisect_right(segment.timestamps, end)
+            points.extend(zip(segment.timestamps[lo:hi], segment.values[lo:hi]))
+        return points
+
+    def nbytes(self):
+        return sum(
+            segment.timestamps.itemsize * len(segment.timestamps)
+            + segment.values.itemsize * len(segment.values)
+            for segment in self.segments
+        )
+
+
+class RollupSeries:
+    """Fixed-width min/max/sum/count buckets addressed by bucket index."""
+    def __init__(self, interval, retention):
+        self.interval = interval
+        self.max_buckets = max(int(retention // interval), 1)
+        self.first_bucket = None
+        self.mins = array("f")
+        self.maxs = array("f")
+        self.sums = array("d")
+        self.counts = array("I")
+
+    def add(self, ts, value):
+        bucket = int(ts // self.interval)
+        if self.first_bucket is None:
+            self.first_bucket = bucket
+        index = bucket - self.first_bucket
+        if index < 0:
+            return  # Older than anything retained
+        missing = index - len(self.counts) + 1
+        if missing > self.max_buckets:
+            # The gap is longer than the retention; nothing retained is still valid
+            self.first_bucket = bucket
+            for column in (self.mins, self.maxs, self.sums, self.counts):
+                del column[:]
+            index = 0
+            missing = 1
+        if missing > 0:
+            self._extend(missing)
+            index = bucket - self.first_bucket
+        if self.counts[index]:
+            self.mins[index] = min(self.mins[index], value)
+            self.maxs[index] = max(self.maxs[index], value)
+        else:
+            self.mins[index] = value
+            self.maxs[index] = value
+        self.sums[index] += value
+        self.counts[index] += 1
+
+    def _extend(self, count):
+        self.mins.extend([0.0] * count)
+        self.maxs.extend([0.0] * count)
+        self.sums.extend([0.0] * count)
+        self.counts.extend([0] * count)
+        # Trim in batches so retention does not cost a memmove per bucket
+        excess = len(self.counts) - self.max_buckets
+        if excess > self.max_buckets // 10:
+            for column in (self.mins, self.maxs, self.sums, self.counts):
+                del column[:excess]
+            self.first_bucket += excess
+
+    def query(self, start, end):
+        """Return (bucket start, min, max, mean, count) for non-empty buckets in range."""
+        if self.first_bucket is None:
+            return []
+        lo = max(int(start // self.interval) - self.first_bucket, 0)
+        hi = min(int(end // self.interval) - self.first_bucket + 1, len(self.counts))
+        rows = []
+        for index in range(lo, hi):
+            count = self.counts[index]
+            if count:
+                rows.append((
+                    (self.first_bucket + index) * self.interval,
+                    self.mins[index],
+                    self.maxs[index],
+                    self.sums[index] / count,
+                    count,
+                ))
+        return rows
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.mins, self.maxs, self.sums, self.counts))
+
+
+class MetricsStore:
+    """Thread-safe store of (slave, metric) series with raw data and rollups."""
+    def __init__(self, raw_retention=RAW_RETENTION, rollups=DEFAULT_ROLLUPS, segment_size=SEGMENT_SIZE):
+        self.raw_retention = raw_retention
+        self.rollups = rollups
+        self.segment_size = segment_size
+        self._raw = {}
+        self._rollups = {}
+        self._lock = threading.Lock()
+
+    def append(self, slave, metric, value, ts=None):
+        """Record one sample; None values are skipped."""
+        if value is None:
+            return
+        ts = time.time() if ts is None else ts
+        key = (slave, metric)
+        with self._lock:
+            raw = self._raw.get(key)
+            if raw is None:
+                raw = self._raw[key] = RawSeries(self.raw_retention, self.segment_size)
+                self._rollups[key] = {interval: RollupSeries(interval, retention)
+                                      for interval, retention in self.rollups}
+            raw.append(ts, float(value))
+            for rollup in self._rollups[key].values():
+                rollup.add(ts, float(value))
+
+    def record_snapshot(self, slave, snapshot, online, ts=None):
+        """Record the numeric metrics of a GET_SNAPSHOT result and the online flag."""
+        ts = time.time() if ts is None else ts
+        self.append(slave, "online", 1 if online else 0, ts)
+        if online:
+            for metric in SNAPSHOT_METRICS:
+                value = snapshot.get(metric)
+                if isinstance(value, (int, float)):
+                    self.append(slave, metric, value, ts)
+
+    def query(self, slave, metric, start=None, end=None, resolution=None):
+        """Return samples in [start, end].
+
+        With no resolution, raw (timestamp, value) pairs are returned; with a
+        rollup interval (e.g. 60 or 3600), (bucket start, min, max, mean,
+        count) rows.
+        """
+        end = time.time() if end is None else end
+        start = 0 if start is None else start
+        with self._lock:
+            if resolution is None:
+                raw = self._raw.get((slave, metric))
+                return raw.query(start, end) if raw else []
+            rollups = self._rollups.get((slave, metric))
+            if not rollups:
+                return []
+            if resolution not in rollups:
+                raise ValueError(f"No {resolution}s rollup; available: {sorted(rollups)}")
+            return rollups[resolution].query(start, end)
+
+    def latest(self, slave, metric):
+        """Return the most recent raw (timestamp, value), or None."""
+        with self._lock:
+            raw = self._raw.get((slave, metric))
+            if raw is None or not raw.segments[-1].timestamps:
+                return None
+            segment = raw.segments[-1]
+            return segment.timestamps[-1], segment.values[-1]
+
+    def series(self):
+        """List the (slave, metric) pairs that have data."""
+        with self._lock:
+            return sorted(self._raw)
+
+    def memory_usage(self):
+        """Approximate bytes held by sample arrays."""
+        with self._lock:
+            total = sum(raw.nbytes() for raw in self._raw.values())
+            total += sum(rollup.nbytes() for rollups in self._rollups.values() for rollup in rollups.values())
+        return total
+
+
+STORE = MetricsStore()
@@ -0,0 +1,395 @@
+"""Asyncio polling engine for the master, usable without the GUI.
+
+One event loop polls every registered slave over its own persistent
+connection. Each slave has its own interval; polls are spread with
+jitter and scheduled on a heap, and a poll never runs past the moment
+the next one for the same slave is due. Results are published as
+PollResult objects to subscribers such as the metrics store, the
+dashboard or alerting.
+
+Slaves whose heartbeats show them alive get their liveness and basic
+health over UDP (see heartbeat.py), so they are only polled every
+BACKGROUND_INTERVAL unless something is looking at their detail and has
+called focus().
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import socket
+import threading
+import time
+
+import protocol
+from heartbeat import HEARTBEATS
+from registry import REGISTRY
+from timing import TIMINGS
+
+DEFAULT_INTERVAL = 2
+BACKGROUND_INTERVAL = 30
+# How long focus() keeps a slave at the full poll rate
+FOCUS_SECONDS = 60
+JITTER = 0.1  # Fraction of the interval each poll is shifted by at random
+MAX_IN_FLIGHT = 256
+MIN_POLL_BUDGET = 0.05  # Polls with less time than this before their deadline are skipped
+POLL_COMMAND = "GET_SNAPSHOT"
+POLL_PARAMS = {"channel": "EXT5V_V"}
+
+
+class PollResult:
+    """Outcome of one poll of one slave."""
+    __slots__ = ("name", "ip", "ok", "data", "errors", "error", "latency", "timestamp")
+
+    def __init__(self, name, ip, ok, data=None, errors=None, error=None, latency=None, timestamp=None):
+        self.name = name
+        self.ip = ip
+        self.ok = ok
+        self.data = data if data is not None else {}
+        self.errors = errors or {}
+        self.error = error
+        self.latency = latency
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        return f"PollResult({self.name!r}, ok={self.ok}, latency={self.latency})"
+
+
+class AsyncSlaveClient:
+    """asyncio counterpart of protocol.SlaveConnection for request/response use.
+
+    Shares the slave's circuit breaker with the threaded connection, so
+    both see the same health and RTT estimates.
+    """
+    def __init__(self, ip, port=protocol.PORT, timeout=protocol.TIMEOUT, encodings=None, compression=True):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.breaker = protocol.get_connection(ip, port).breaker
+        self.hello = protocol.hello_params(encodings, compression)
+        self.codec = protocol.FrameCodec()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._writer = None
+        self._reader_task = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure_connected(self):
+        async with self._lock:
+            if self._writer is not None:
+                return self._writer
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ip, self.port), self.breaker.connect_timeout(self.timeout)
+                )
+            except (OSError, asyncio.TimeoutError):
+                protocol.CONNECTS.inc(self.ip, "failed")
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_connect(loop.time() - started)
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                writer.write(protocol.encode_frame({"id": 0, "command": "HELLO", "params": self.hello}))
+                frame = await asyncio.wait_for(protocol.read_frame_async(reader), self.timeout)
+                if frame is None:
+                    raise ConnectionError("Connection closed during handshake")
+                self.codec = protocol.codec_from_hello(protocol.decode_message(*frame))
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                writer.close()
+                protocol.CONNECTS.inc(self.ip, "handshake_failed")
+                self.breaker.record_failure()
+                raise ConnectionError(f"Handshake failed: {e}")
+            protocol.CONNECTS.inc(self.ip, "ok")
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read_loop(reader, writer))
+            return writer
+
+    async def _read_loop(self, reader, writer):
+        try:
+            while True:
+                frame = await protocol.read_frame_async(reader)
+                if frame is None:
+                    break
+                try:
+                    with TIMINGS.time("decode"):
+                        response = protocol.decode_message(*frame)
+                except ValueError:
+                    continue
+                self.breaker.record_success()
+                future = self._pending.get(response.pop("id", None))
+                # Streamed chunks and pushed updates are not used by the poller
+                if future and not future.done() and response.get("status") not in ("partial", "update"):
+                    future.set_result(response)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(writer, "Connection lost")
+
+    def _drop(self, writer, message):
+        if self._writer is not writer:
+            return
+        self._writer = None
+        writer.close()
+        if message != "Connection closed":
+            self.breaker.record_failure()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(message))
+
+    async def request(self, command, params=None, timeout=None, deadline=None):
+        """Send a command and wait for its response.
+
+        Without an explicit timeout the RTT-derived one is used, cut short
+        at `deadline` (a loop.time() value) if that comes first.
+        """
+        loop = asyncio.get_running_loop()
+        adaptive = timeout is None
+        if adaptive:
+            timeout = self.breaker.request_timeout(self.timeout)
+        if deadline is not None:
+            timeout = min(timeout, deadline - loop.time())
+        if not self.breaker.allow():
+            message = f"Slave unreachable, retrying in {self.breaker.retry_in():.0f}s"
+            return protocol.record_request(self.ip, command, None, {"status": "error", "message": message},
+                                           "unreachable")
+        try:
+            writer = await self._ensure_connected()
+        except (OSError, asyncio.TimeoutError) as e:
+            response = {"status": "error", "message": str(e) or "Connect timed out"}
+            return protocol.record_request(self.ip, command, None, response, "connect")
+
+        request_id = next(self._ids)
+        future = loop.create_future()
+        self._pending[request_id] = future
+        started = time.monotonic()
+        try:
+            writer.write(self.codec.encode({"id": request_id, "command": command, "params": params}))
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            response = {"status": "error", "message": f"Timed out waiting for {command}"}
+            return protocol.record_request(self.ip, command, None, response, "timeout")
+        except OSError as e:
+            self._drop(writer, str(e))
+            return protocol.record_request(self.ip, command, None, {"status": "error", "message": str(e)}, "lost")
+        finally:
+            self._pending.pop(request_id, None)
+        if adaptive:
+            self.breaker.record_rtt(time.monotonic() - started)
+        return protocol.record_request(self.ip, command, started, response)
+
+    def close(self):
+        if self._writer is not None:
+            self._drop(self._writer, "Connection closed")
+
+
+class _Target:
+    """Scheduling state of one polled slave."""
+    def __init__(self, name, ip, interval, client):
+        self.name = name
+        self.ip = ip
+        self.interval = interval
+        self.client = client
+        self.token = object()  # Replaced to invalidate heap entries
+        self.in_flight = False
+        self.polls = 0
+        self.skipped = 0
+
+
+class Poller:
+    """Polls every slave in the registry on one event loop.
+
+    Subscribers are called as `callback(result)` on the event loop thread
+    and must not block; consumers with their own thread (like the Tk GUI)
+    should hand the result off. The latest result per slave is kept in
+    `latest`.
+    """
+    def __init__(self, registry=REGISTRY, interval=DEFAULT_INTERVAL, intervals=None,
+                 command=POLL_COMMAND, params=POLL_PARAMS, max_in_flight=MAX_IN_FLIGHT, jitter=JITTER,
+                 heartbeats=None, background_interval=BACKGROUND_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self.intervals = dict(intervals or {})
+        self.heartbeats = heartbeats
+        self.background_interval = background_interval
+        self._focused = {}  # Slave name -> monotonic time its full-rate polling ends
+        self.command = command
+        self.params = params
+        self.max_in_flight = max_in_flight
+        self.jitter = jitter
+        self.latest = {}
+        self._subscribers = []
+        self._targets = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._loop = None
+        self._wakeup = None
+        self._stopped = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def interval_for(self, name):
+        """Current poll interval of a slave."""
+        if name in self.intervals:
+            return self.intervals[name]
+        if self._focused.get(name, 0) > time.monotonic() or self.heartbeats is None:
+            return self.interval
+        heartbeat = self.heartbeats.get(name)
+        if heartbeat is not None and heartbeat["alive"]:
+            return max(self.interval, self.background_interval)
+        return self.interval
+
+    def focus(self, name, seconds=FOCUS_SECONDS):
+        """Poll a slave at the full rate for the next `seconds`; safe to call from any thread."""
+        now = time.monotonic()
+        was_focused = self._focused.get(name, 0) > now
+        self._focused[name] = now + seconds
+        if not was_focused and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._reschedule, name)
+
+    def set_interval(self, name, interval):
+        """Change one slave's poll interval; safe to call from any thread."""
+        self.intervals[name] = interval
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._reschedule, name)
+
+    def stats(self):
+        return {
+            name: {"interval": target.interval, "polls": target.polls, "skipped": target.skipped,
+                   "in_flight": target.in_flight}
+            for name, target in list(self._targets.items())
+        }
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _schedule(self, target, due):
+        heapq.heappush(self._heap, (due, next(self._sequence), target.name, target.token))
+        self._wakeup.set()
+
+    def _reschedule(self, name):
+        target = self._targets.get(name)
+        if target is not None:
+            target.interval = self.interval_for(name)
+            target.token = object()
+            self._schedule(target, self._loop.time() + random.uniform(0, target.interval))
+
+    def _on_registry_event(self, event, slave):
+        # Registry listeners run on the discovery thread
+        self._loop.call_soon_threadsafe(self._apply_registry_event, event, slave)
+
+    def _apply_registry_event(self, event, slave):
+        target = self._targets.pop(slave["name"], None)
+        if target is not None:
+            target.client.close()
+        self.latest.pop(slave["name"], None)
+        if event == "removed":
+            self._focused.pop(slave["name"], None)
+            return
+        interval = self.interval_for(slave["name"])
+        client = AsyncSlaveClient(slave["ip"], slave.get("port", protocol.PORT))
+        target = _Target(slave["name"], slave["ip"], interval, client)
+        self._targets[target.name] = target
+        # A random first offset keeps slaves discovered together from polling in lockstep
+        self._schedule(target, self._loop.time() + random.uniform(0, interval))
+
+    async def run(self):
+        """Poll until stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.registry.subscribe(self._on_registry_event)
+        for slave in self.registry.all():
+            self._apply_registry_event("added", slave)
+        try:
+            while not self._stopped.is_set():
+                now = self._loop.time()
+                while self._heap and self._heap[0][0] <= now:
+                    due, _, name, token = heapq.heappop(self._heap)
+                    target = self._targets.get(name)
+                    if target is None or target.token is not token:
+                        continue  # Removed or rescheduled since this entry was queued
+                    target.interval = self.interval_for(name)
+                    next_due = due + self._jittered(target.interval)
+                    if next_due <= now:
+                        next_due = now + self._jittered(target.interval)  # Fell behind; do not burst
+                    self._schedule(target, next_due)
+                    if target.in_flight:
+                        target.skipped += 1
+                    else:
+                        target.in_flight = True
+                        asyncio.create_task(self._poll(target, next_due, semaphore))
+                self._wakeup.clear()
+                timeout = self._heap[0][0] - self._loop.time() if self._heap else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.registry.unsubscribe(self._on_registry_event)
+            for target in self._targets.values():
+                target.client.close()
+
+    async def _poll(self, target, deadline, semaphore):
+        """Poll one slave, giving up when its next poll is due."""
+        try:
+            async with semaphore:
+                if deadline - self._loop.time() < MIN_POLL_BUDGET:
+                    target.skipped += 1  # Waited too long for a slot
+                    return
+                started = self._loop.time()
+                response = await target.client.request(self.command, self.params, deadline=deadline)
+                latency = self._loop.time() - started
+        finally:
+            target.in_flight = False
+        if self._targets.get(target.name) is not target:
+            return  # Removed while polling
+        target.polls += 1
+        ok = response.get("status") == "success"
+        result = PollResult(
+            target.name, target.ip, ok,
+            data=response.get("data") if ok else None,
+            errors=response.get("errors"),
+            error=None if ok else response.get("message", "Unknown error"),
+            latency=latency,
+        )
+        self.latest[target.name] = result
+        for callback in list(self._subscribers):
+            try:
+                callback(result)
+            except Exception as e:
+                print(f"[ERROR] Poll subscriber failed for {target.name}: {e}")
+
+    def start(self):
+        """Run the poller on its own event loop thread; returns self."""
+        threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop polling; safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+
+_default_poller = None
+_default_poller_lock = threading.Lock()
+
+
+def default_poller():
+    """The Poller shared by the master's services in one process."""
+    global _default_poller
+    with _default_poller_lock:
+        if _default_poller is None:
+            _default_poller = Poller(heartbeats=HEARTBEATS)
+        return _default_poller
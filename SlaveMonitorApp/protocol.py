@@ -0,0 +1,449 @@
+"""Framed request/response protocol between the master and its slaves.
+
+Every frame is a 4-byte big-endian header followed by the payload. The
+low 24 bits of the header are the payload length, the top byte holds
+flags describing how the payload is encoded:
+
+    0x01  payload is zlib-compressed
+    0x02  payload is msgpack instead of JSON
+
+A flag byte of 0 is a plain JSON frame, which is all that version 1 peers
+understand. The master opens every connection with a HELLO request in
+plain JSON listing the encodings it accepts; the slave answers with the
+protocol version, encoding and compression it picked for the connection.
+Older slaves reject HELLO as an unknown command and both sides keep
+talking plain JSON. Receivers decode any frame by its flags, so only the
+sending side depends on the negotiated settings.
+
+When a request times out the master sends CANCEL with the request's id,
+and the slave cancels its work on it (a streamed script is killed).
+"""
+import asyncio
+import itertools
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from exposition import Counter, Histogram
+from health import CircuitBreaker
+from timing import TIMINGS
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PORT = 65432
+TIMEOUT = 5
+
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct(">I")
+LENGTH_MASK = 0xFFFFFF
+MAX_FRAME_SIZE = LENGTH_MASK
+FLAG_ZLIB = 0x01
+FLAG_MSGPACK = 0x02
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+COMPRESSION_ZLIB = "zlib"
+# In order of preference; msgpack is used only where it is installed
+SUPPORTED_ENCODINGS = ([ENCODING_MSGPACK] if msgpack else []) + [ENCODING_JSON]
+# Payloads smaller than this are not worth compressing
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 1
+
+# Master side of the channel, exported on the dashboard's /metrics
+REQUEST_LATENCY = Histogram(
+    "pivortex_master_request_duration_seconds", "Round trip of commands answered by slaves", ("command",))
+REQUEST_ERRORS = Counter(
+    "pivortex_master_request_errors_total", "Commands that failed, by slave and reason", ("slave", "reason"))
+CONNECTS = Counter("pivortex_master_connects_total", "Connection attempts to slaves", ("slave", "result"))
+
+
+def record_request(slave, command, started, response, reason=None):
+    """Account one finished request in the channel metrics; returns the response."""
+    if reason is None:
+        elapsed = time.monotonic() - started
+        REQUEST_LATENCY.observe(elapsed, command)
+        TIMINGS.record(f"request.{command}", elapsed)
+        TIMINGS.record(f"slave.{slave}", elapsed)
+        if response.get("status") == "error":
+            REQUEST_ERRORS.inc(slave, "error")
+    else:
+        REQUEST_ERRORS.inc(slave, reason)
+    return response
+
+
+def encode_frame(message, encoding=ENCODING_JSON, compress=False):
+    """Serialize a message dict into a length-prefixed frame."""
+    flags = 0
+    if encoding == ENCODING_MSGPACK:
+        payload = msgpack.packb(message, use_bin_type=True)
+        flags |= FLAG_MSGPACK
+    else:
+        payload = json.dumps(message).encode()
+    # Checked before compressing too, since the receiver inflates at most this much
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {len(payload)} bytes")
+    if compress and len(payload) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload, COMPRESS_LEVEL)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_ZLIB
+    return HEADER.pack(flags << 24 | len(payload)) + payload
+
+
+def decode_message(payload, flags=0):
+    """Parse a frame payload back into a message dict."""
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            # Bounded, so a small frame cannot inflate into an unbounded allocation
+            payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed frame: {e}")
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Compressed frame inflates past {MAX_FRAME_SIZE} bytes")
+    if flags & FLAG_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Received a msgpack frame but msgpack is not installed")
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload.decode())
+
+
+def split_header(header):
+    """Return (flags, length) from a frame header."""
+    (value,) = HEADER.unpack(header)
+    return value >> 24, value & LENGTH_MASK
+
+
+class FrameCodec:
+    """The encoding a connection has negotiated for the frames it sends."""
+    def __init__(self, encoding=ENCODING_JSON, compress=False, version=1):
+        self.encoding = encoding
+        self.compress = compress
+        self.version = version
+
+    def encode(self, message):
+        return encode_frame(message, self.encoding, self.compress)
+
+
+def hello_params(encodings=None, compression=True):
+    """Parameters of the HELLO request a master opens a connection with."""
+    return {
+        "version": PROTOCOL_VERSION,
+        "encodings": [encoding for encoding in (encodings or SUPPORTED_ENCODINGS) if encoding in SUPPORTED_ENCODINGS],
+        "compression": [COMPRESSION_ZLIB] if compression else [],
+    }
+
+
+def codec_from_hello(response):
+    """The codec a master uses after the slave's HELLO response."""
+    if response.get("status") != "success":
+        return FrameCodec()  # Slave predates HELLO
+    data = response.get("data") or {}
+    encoding = data.get("encoding", ENCODING_JSON)
+    return FrameCodec(
+        encoding if encoding in SUPPORTED_ENCODINGS else ENCODING_JSON,
+        data.get("compression") == COMPRESSION_ZLIB,
+        data.get("version", 1),
+    )
+
+
+def negotiate(params):
+    """Pick the slave's side of a HELLO: the first offered encoding both sides support."""
+    offered = params.get("encodings") or [ENCODING_JSON]
+    return {
+        "version": min(int(params.get("version", 1)), PROTOCOL_VERSION),
+        "encoding": next((encoding for encoding in offered if encoding in SUPPORTED_ENCODINGS), ENCODING_JSON),
+        "compression": COMPRESSION_ZLIB if COMPRESSION_ZLIB in (params.get("compression") or []) else None,
+    }
+
+
+def recv_exact(sock, size):
+    """Read exactly `size` bytes, or return None if the peer closed the socket."""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(sock):
+    """Read one frame from the socket as (payload, flags), or None on a clean close."""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    flags, length = split_header(header)
+    payload = recv_exact(sock, length)
+    if payload is None:
+        raise ConnectionError("Connection closed mid-frame")
+    return payload, flags
+
+
+async def read_frame_async(reader, header=None):
+    """Read one frame from an asyncio stream as (payload, flags), or None on a clean close.
+
+    `header` lets the caller pass header bytes it has already consumed.
+    """
+    try:
+        if header is None:
+            header = await reader.readexactly(HEADER.size)
+        flags, length = split_header(header)
+        return await reader.readexactly(length), flags
+    except asyncio.IncompleteReadError as e:
+        if not e.partial and header is None:
+            return None
+        raise ConnectionError("Connection closed mid-frame")
+
+
+class _PendingRequest:
+    """A request waiting for the response frame carrying its id."""
+    def __init__(self, on_partial=None):
+        self.event = threading.Event()
+        self.response = None
+        self.on_partial = on_partial
+        self.lost = False
+
+
+class SlaveConnection:
+    """Long-lived connection to one slave that multiplexes many requests.
+
+    A circuit breaker fails requests fast while the slave is unreachable;
+    connect and default request timeouts adapt to the observed RTT, with
+    `timeout` as the upper bound.
+    """
+    def __init__(self, ip, port=PORT, timeout=TIMEOUT, encodings=None, compression=True):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(ip)
+        self.hello = hello_params(encodings, compression)
+        self.codec = FrameCodec()
+        self._sock = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def _ensure_connected(self):
+        """Open the socket and start the reader thread if not connected yet."""
+        with self._lock:
+            if self._sock is not None:
+                return self._sock
+            started = time.monotonic()
+            try:
+                sock = socket.create_connection(
+                    (self.ip, self.port), timeout=self.breaker.connect_timeout(self.timeout)
+                )
+            except OSError:
+                CONNECTS.inc(self.ip, "failed")
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_connect(time.monotonic() - started)
+            try:
+                self.codec = self._handshake(sock)
+            except (OSError, ValueError) as e:
+                sock.close()
+                CONNECTS.inc(self.ip, "handshake_failed")
+                self.breaker.record_failure()
+                raise ConnectionError(f"Handshake failed: {e}")
+            CONNECTS.inc(self.ip, "ok")
+            TIMINGS.record("connect", time.monotonic() - started)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self._sock = sock
+            threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+            return sock
+
+    def _handshake(self, sock):
+        """Agree on the frame encoding; plain JSON if the slave predates HELLO."""
+        sock.settimeout(self.timeout)
+        sock.sendall(encode_frame({"id": 0, "command": "HELLO", "params": self.hello}))
+        frame = read_frame(sock)
+        if frame is None:
+            raise ConnectionError("Connection closed during handshake")
+        return codec_from_hello(decode_message(*frame))
+
+    def _read_loop(self, sock):
+        """Route incoming response frames to the requests waiting on them."""
+        try:
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    break
+                try:
+                    with TIMINGS.time("decode"):
+                        response = decode_message(*frame)
+                except ValueError:
+                    continue
+                # Any frame proves the slave is alive
+                self.breaker.record_success()
+                request_id = response.pop("id", None)
+                if response.get("status") == "update":
+                    # Pushed telemetry for an active subscription
+                    with self._lock:
+                        subscription = self._subscriptions.get(request_id)
+                    if subscription:
+                        subscription[0](response)
+                    continue
+                if response.get("status") == "partial":
+                    # Streamed output; the request stays pending until its final frame.
+                    with self._lock:
+                        pending = self._pending.get(request_id)
+                    if pending and pending.on_partial:
+                        pending.on_partial(response.get("data", ""))
+                    continue
+                with self._lock:
+                    pending = self._pending.pop(request_id, None)
+                if pending:
+                    pending.response = response
+                    pending.event.set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(sock, "Connection lost")
+
+    def _drop(self, sock, message):
+        """Close a broken socket and fail every request still waiting on it."""
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pending, self._pending = self._pending, {}
+            subscriptions, self._subscriptions = self._subscriptions, {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if message != "Connection closed":
+            self.breaker.record_failure()
+        for request in pending.values():
+            request.lost = True
+            request.response = {"status": "error", "message": message}
+            request.event.set()
+        for _, on_lost in subscriptions.values():
+            if on_lost:
+                on_lost(message)
+
+    def request(self, command, params=None, timeout=None, on_partial=None):
+        """Send a command and block until its response arrives or times out.
+
+        Streamed output chunks are passed to `on_partial` as they arrive.
+        """
+        return self._request(next(self._ids), command, params, timeout, on_partial)
+
+    def _request(self, request_id, command, params, timeout, on_partial=None):
+        adaptive = timeout is None
+        if adaptive:
+            timeout = self.breaker.request_timeout(self.timeout)
+        if not self.breaker.allow():
+            message = f"Slave unreachable, retrying in {self.breaker.retry_in():.0f}s"
+            return record_request(self.ip, command, None, {"status": "error", "message": message}, "unreachable")
+        try:
+            sock = self._ensure_connected()
+        except OSError as e:
+            return record_request(self.ip, command, None, {"status": "error", "message": str(e)}, "connect")
+
+        pending = _PendingRequest(on_partial)
+        with self._lock:
+            self._pending[request_id] = pending
+        try:
+            with self._send_lock, TIMINGS.time("send"):
+                sock.sendall(self.codec.encode({"id": request_id, "command": command, "params": params}))
+        except OSError as e:
+            self._drop(sock, str(e))
+            return record_request(self.ip, command, None, {"status": "error", "message": str(e)}, "send")
+
+        started = time.monotonic()
+        if not pending.event.wait(timeout):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            self._cancel(sock, request_id)
+            self.breaker.record_failure()
+            message = f"Timed out waiting for {command}"
+            return record_request(self.ip, command, None, {"status": "error", "message": message}, "timeout")
+        if pending.lost:
+            return record_request(self.ip, command, None, pending.response, "lost")
+        if adaptive:
+            # Only default-timeout commands are cheap enough to be RTT samples
+            self.breaker.record_rtt(time.monotonic() - started)
+        return record_request(self.ip, command, started, pending.response)
+
+    def _cancel(self, sock, request_id):
+        """Tell the slave to stop working on a request nobody waits for any more; no reply is awaited."""
+        message = {"id": next(self._ids), "command": "CANCEL", "params": {"request": request_id}}
+        try:
+            with self._send_lock:
+                sock.sendall(self.codec.encode(message))
+        except OSError:
+            pass  # The connection is gone, and the slave cancels everything on it
+
+    def subscribe(self, command, interval, on_update, on_lost=None, params=None, timeout=None):
+        """Ask the slave to push changes of `command`'s result every `interval` seconds.
+
+        `on_update` receives each pushed message; `on_lost` is called with a
+        reason if the connection drops. Returns the slave's acknowledgement,
+        whose data carries the subscription id.
+        """
+        request_id = next(self._ids)
+        with self._lock:
+            self._subscriptions[request_id] = (on_update, on_lost)
+        response = self._request(
+            request_id, "SUBSCRIBE", {"command": command, "params": params, "interval": interval}, timeout
+        )
+        if response.get("status") != "success":
+            with self._lock:
+                self._subscriptions.pop(request_id, None)
+        return response
+
+    def unsubscribe(self, subscription_id, timeout=None):
+        """Stop a subscription created by `subscribe`."""
+        with self._lock:
+            self._subscriptions.pop(subscription_id, None)
+        return self.request("UNSUBSCRIBE", {"subscription": subscription_id}, timeout=timeout)
+
+    def close(self):
+        """Close the connection, failing any outstanding requests."""
+        sock = self._sock
+        if sock is not None:
+            self._drop(sock, "Connection closed")
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(ip, port=PORT):
+    """Return the shared persistent connection for a slave, creating it on first use."""
+    with _connections_lock:
+        connection = _connections.get((ip, port))
+        if connection is None:
+            connection = SlaveConnection(ip, port)
+            _connections[(ip, port)] = connection
+        return connection
+
+
+def send_command(ip, command, params=None, timeout=None, on_partial=None, port=PORT):
+    """Send a command over the slave's persistent connection."""
+    try:
+        return get_connection(ip, port).request(command, params, timeout=timeout, on_partial=on_partial)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+def close_all():
+    """Close every persistent slave connection."""
+    with _connections_lock:
+        connections = list(_connections.values())
+        _connections.clear()
+    for connection in connections:
+        connection.close()
@@ -0,0 +1,115 @@
+"""In-memory registry of slaves, fed by discovery broadcasts."""
+import threading
+import time
+
+from heartbeat import MISSED_HEARTBEATS
+
+# Slaves that stop broadcasting for this long are dropped; slaves that
+# advertise a heartbeat interval are kept for MISSED_HEARTBEATS of them if
+# that is longer
+EXPIRY_SECONDS = 35
+
+# Slaves that cannot broadcast can be pinned here as {name: ip}; they never expire
+STATIC_SLAVES = {}
+
+
+class SlaveRegistry:
+    """Thread-safe set of known slaves with liveness expiry and change notifications.
+
+    Listeners are called as `listener(event, slave)` with event "added",
+    "updated" or "removed" and a copy of the slave's entry. They run on the
+    thread that made the change, so GUI listeners must hand off to their
+    own thread.
+    """
+    def __init__(self, expiry=EXPIRY_SECONDS, static=STATIC_SLAVES):
+        self.expiry = expiry
+        self._slaves = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        for name, ip in static.items():
+            self.update(name, ip, static=True)
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify(self, events):
+        with self._lock:
+            listeners = list(self._listeners)
+        for event, slave in events:
+            for listener in listeners:
+                try:
+                    listener(event, slave)
+                except Exception as e:
+                    print(f"[ERROR] Registry listener failed on {event} {slave['name']}: {e}")
+
+    def update(self, name, ip, description="", static=False, **info):
+        """Record that a slave was seen; returns the event fired, if any."""
+        now = time.time()
+        with self._lock:
+            current = self._slaves.get(name)
+            entry = {"name": name, "ip": ip, "description": description,
+                     "static": static or bool(current and current["static"]), "last_seen": now}
+            entry.update(info)
+            self._slaves[name] = entry
+            if current is None:
+                event = "added"
+            elif any(current.get(key) != value for key, value in entry.items() if key != "last_seen"):
+                event = "updated"
+            else:
+                event = None
+            slave = dict(entry)
+        if event:
+            self._notify([(event, slave)])
+        return event
+
+    def remove(self, name):
+        with self._lock:
+            slave = self._slaves.pop(name, None)
+        if slave:
+            self._notify([("removed", slave)])
+
+    def _expiry(self, slave):
+        interval = slave.get("heartbeat_interval")
+        return max(self.expiry, MISSED_HEARTBEATS * interval) if interval else self.expiry
+
+    def expire(self, now=None):
+        """Drop slaves whose last broadcast is older than their expiry window."""
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [name for name, slave in self._slaves.items()
+                       if not slave["static"] and now - slave["last_seen"] > self._expiry(slave)]
+            removed = [self._slaves.pop(name) for name in expired]
+        if removed:
+            self._notify([("removed", slave) for slave in removed])
+        return len(removed)
+
+    def get(self, name):
+        with self._lock:
+            slave = self._slaves.get(name)
+            return dict(slave) if slave else None
+
+    def find_by_ip(self, ip):
+        with self._lock:
+            for slave in self._slaves.values():
+                if slave["ip"] == ip:
+                    return dict(slave)
+        return None
+
+    def all(self):
+        """Copies of all live entries, sorted by name."""
+        self.expire()
+        with self._lock:
+            return [dict(self._slaves[name]) for name in sorted(self._slaves)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._slaves)
+
+
+REGISTRY = SlaveRegistry()
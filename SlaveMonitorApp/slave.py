@@ -1,45 +1,417 @@
-import socket
+import argparse
+import asyncio
 import json
-from commands import COMMANDS
+import threading
+import time
+from cache import METRIC_CACHE
+from concurrent.futures import ThreadPoolExecutor
+from commands import COMMANDS, SYNC_SCRIPT_GRACE, ScriptStream
+from jobs import JOBS, SCRIPT_TIMEOUT
+from transfers import TRANSFERS
+from slave_broadcast import BROADCAST_ADDRESS, HEARTBEAT_INTERVAL, broadcast_slave_info
+from protocol import (
+    COMPRESSION_ZLIB, HEADER, FrameCodec, decode_message, negotiate, read_frame_async,
+)
+from telemetry import KEEPALIVE_INTERVAL, MIN_INTERVAL, diff_snapshot
+from exposition import CONTENT_TYPE, Counter, Histogram, gauge, render
+from timing import TIMINGS
 
 HOST = "0.0.0.0"
 PORT = 65432
+# Prometheus /metrics; 0 disables it
+METRICS_PORT = 9101
+# /metrics renders the last snapshot a master asked for; while /metrics is
+# served, a background task takes one if none is newer than this
+EXPORTER_REFRESH = 15
+HTTP_TIMEOUT = 5
 
-def handle_request(command, params):
-    handler = COMMANDS.get(command)
+# Concurrency and timeout limits for command handlers
+MAX_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 10
+COMMAND_TIMEOUTS = {
+    "RUN_SCRIPT": SCRIPT_TIMEOUT + SYNC_SCRIPT_GRACE,  # Lets a synchronous script report its own timeout
+    "FILE_PUSH": 60,  # May hash a large file already on disk
+}
+
+# Seconds a command's successful result is shared between requests with the
+# same parameters. Commands not listed here are never cached.
+COMMAND_TTLS = {
+    "GET_SNAPSHOT": 1,
+    "GET_CPU_TEMP": 1,
+    "REQUEST_ADC": 1,
+    "GET_UPTIME": 10,
+    "LIST_USB": 10,
+    "GET_DISK_USAGE": 30,
+}
+
+COMMAND_LATENCY = Histogram(
+    "pivortex_slave_command_duration_seconds", "Time to execute a command, including queueing", ("command",))
+COMMAND_ERRORS = Counter("pivortex_slave_command_errors_total", "Commands that returned an error", ("command",))
+CONNECTIONS = Counter("pivortex_slave_connections_total", "Master connections accepted")
+
+def run_handler(handler, params, command=None):
+    try:
+        with TIMINGS.time(f"handler.{command or handler.__name__}"):
+            return handler(params)
+    except Exception as e:
+        return {"status": "error", "message": f"Command failed: {str(e)}"}
+
+def handle_request(command, params, commands=COMMANDS, timeout=DEFAULT_TIMEOUT):
+    handler = commands.get(command)
     if handler:
-        try:
-            result = handler(params)
-            return result
-        except Exception as e:
-            return {"status": "error", "message": f"Command failed: {str(e)}"}
+        # handler.* timers only see cache misses; this one sees every request
+        with TIMINGS.time(f"handle_request.{command}"):
+            if command not in COMMAND_TTLS:
+                return run_handler(handler, params, command)
+            return METRIC_CACHE.get_or_compute(
+                command,
+                json.dumps(params, sort_keys=True),
+                COMMAND_TTLS[command],
+                lambda: run_handler(handler, params, command),
+                cacheable=lambda result: result.get("status") == "success",
+                wait_timeout=timeout,
+            )
     else:
         return {"status": "error", "message": f"Unknown command: {command}"}
 
-def main():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen()
-        print("Slave is ready to receive requests...")
+
+class SlaveServer:
+    """Asyncio command server that runs handlers concurrently on a worker pool."""
+    def __init__(self, host=HOST, port=PORT, max_concurrency=MAX_CONCURRENCY,
+                 default_timeout=DEFAULT_TIMEOUT, command_timeouts=None, metrics_port=METRICS_PORT,
+                 commands=None, file_port=None):
+        self.host = host
+        self.port = port
+        self.file_port = TRANSFERS.port if file_port is None else file_port
+        self.commands = COMMANDS if commands is None else commands
+        self.metrics_port = metrics_port
+        self.active_connections = 0
+        self.last_snapshot = {}
+        self.snapshot_checked = 0
+        self.default_timeout = default_timeout
+        self.command_timeouts = dict(COMMAND_TIMEOUTS, **(command_timeouts or {}))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def timeout_for(self, command):
+        return self.command_timeouts.get(command, self.default_timeout)
+
+    async def _run(self, func, *args):
+        """Run a blocking function on the worker pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def execute(self, command, params, send):
+        """Run one command within the concurrency limit and its timeout.
+
+        `send` is a coroutine function used for streamed partial output; the
+        final response dict is returned.
+        """
+        started = time.monotonic()
+        response = await self._execute(command, params, send)
+        label = command if command in self.commands else "unknown"
+        COMMAND_LATENCY.observe(time.monotonic() - started, label)
+        if response.get("status") == "error":
+            COMMAND_ERRORS.inc(label)
+        elif command == "GET_SNAPSHOT":
+            self.last_snapshot = response.get("data") or {}
+            self.snapshot_checked = time.time()
+        return response
+
+    async def _execute(self, command, params, send):
+        timeout = self.timeout_for(command)
+        loop = asyncio.get_running_loop()
+        queued = loop.time()
+        async with self._semaphore:
+            TIMINGS.record("queue", loop.time() - queued)
+            deadline = loop.time() + timeout
+            run = self._run(handle_request, command, params, self.commands, timeout)
+            try:
+                result = await asyncio.wait_for(run, timeout)
+            except asyncio.TimeoutError:
+                return {"status": "error", "message": f"{command} timed out after {timeout}s"}
+            if isinstance(result, ScriptStream):
+                return await self._stream(command, result, deadline, send)
+            return result
+
+    async def _stream(self, command, stream, deadline, send):
+        """Forward script output chunk by chunk until it exits or runs out of time."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                chunk = await asyncio.wait_for(self._run(stream.read_chunk), remaining)
+                if chunk is None:
+                    return await self._run(stream.finish)
+                await send({"status": "partial", "data": chunk})
+        except asyncio.TimeoutError:
+            return {"status": "error", "message": f"{command} timed out after {self.timeout_for(command)}s"}
+        finally:
+            stream.cancel()
+
+    async def _publish(self, command, params, interval, send):
+        """Push changed fields of a command's result every `interval` seconds."""
+        loop = asyncio.get_running_loop()
+        last_sent = {}
+        last_push = loop.time()
         while True:
-            conn, addr = s.accept()
-            with conn:
-                print(f"Connection from {addr}")
+            response = await self.execute(command, params, self._discard)
+            data = response.get("data")
+            if response.get("status") == "success" and isinstance(data, dict):
+                delta = diff_snapshot(last_sent, data)
+                if delta or loop.time() - last_push >= KEEPALIVE_INTERVAL:
+                    await send({"status": "update", "data": delta})
+                    last_sent.update(delta)
+                    last_push = loop.time()
+            else:
+                await send({"status": "update", "data": {}, "error": response.get("message", "Command failed")})
+                last_push = loop.time()
+            await asyncio.sleep(interval)
+
+    async def _subscribe(self, request_id, params, send, subscriptions):
+        command = params.get("command")
+        if command not in self.commands:
+            return {"status": "error", "message": f"Unknown command: {command}"}
+        interval = max(float(params.get("interval") or MIN_INTERVAL), MIN_INTERVAL)
+
+        async def send_update(message):
+            await send(message, request_id)
+
+        # Acknowledge before the first push so the master knows the id is live
+        await send({"status": "success", "data": {"subscription": request_id, "interval": interval}}, request_id)
+        subscriptions[request_id] = asyncio.create_task(
+            self._publish(command, params.get("params") or {}, interval, send_update)
+        )
+        return None
+
+    @staticmethod
+    def _unsubscribe(params, subscriptions):
+        task = subscriptions.pop(params.get("subscription"), None)
+        if task is None:
+            return {"status": "error", "message": "Unknown subscription"}
+        task.cancel()
+        return {"status": "success", "message": "Unsubscribed"}
+
+    async def _handle_frame(self, request, send, subscriptions):
+        request_id = request.get("id")
+        command = request.get("command")
+        params = request.get("params") or {}
+
+        # Subscriptions belong to the connection, not to the COMMANDS registry
+        if command == "SUBSCRIBE":
+            response = await self._subscribe(request_id, params, send, subscriptions)
+            if response is None:
+                return
+        elif command == "UNSUBSCRIBE":
+            response = self._unsubscribe(params, subscriptions)
+        else:
+            async def send_partial(message):
+                await send(message, request_id)
+
+            response = await self.execute(command, params, send_partial)
+        await send(response, request_id)
+
+    async def _handle_legacy(self, data, reader, writer):
+        """Serve a single unframed JSON request from an older master."""
+        data += await reader.read(1024 - len(data))
+        try:
+            request = json.loads(data.decode())
+            response = await self.execute(request.get("command"), request.get("params", {}), self._discard)
+        except json.JSONDecodeError:
+            print("Received malformed JSON request.")
+            response = {"status": "error", "message": "Invalid JSON format"}
+        except Exception as e:
+            response = {"status": "error", "message": str(e)}
+        writer.write(json.dumps(response).encode())
+        await writer.drain()
+
+    @staticmethod
+    async def _discard(message):
+        pass
+
+    async def handle_connection(self, reader, writer):
+        """Serve framed requests on a persistent connection until the master hangs up."""
+        addr = writer.get_extra_info("peername")
+        print(f"Connection from {addr}")
+        CONNECTIONS.inc()
+        self.active_connections += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+        running = {}  # Request id -> task, so the master can CANCEL a request it gave up on
+        subscriptions = {}
+        codec = FrameCodec()  # Plain JSON until the master says HELLO
+
+        async def send(message, request_id):
+            try:
+                frame = codec.encode(dict(message, id=request_id))
+            except (ValueError, TypeError) as e:
+                # Still answer, so the master does not wait for its timeout
+                print(f"[ERROR] Could not encode response: {e}")
+                frame = codec.encode({"status": "error", "message": f"Response not sent: {e}", "id": request_id})
+            async with write_lock:
+                writer.write(frame)
+                await writer.drain()
+
+        try:
+            header = await reader.readexactly(HEADER.size)
+            if header.startswith(b"{"):
+                await self._handle_legacy(header, reader, writer)
+                return
+            while True:
+                frame = await read_frame_async(reader, header)
+                header = None
+                if frame is None:
+                    break
                 try:
-                    data = conn.recv(1024)
-                    if not data:
-                        print("No data received. Closing connection.")
-                        continue
-                    request = json.loads(data.decode())
-                    command = request.get("command")
-                    params = request.get("params", {})
-                    response = handle_request(command, params)
-                    conn.sendall(json.dumps(response).encode())
-                except json.JSONDecodeError:
-                    print("Received malformed JSON request.")
-                    conn.sendall(json.dumps({"status": "error", "message": "Invalid JSON format"}).encode())
-                except Exception as e:
-                    conn.sendall(json.dumps({"status": "error", "message": str(e)}).encode())
+                    request = decode_message(*frame)
+                except ValueError:
+                    print("Received malformed request frame.")
+                    await send({"status": "error", "message": "Invalid request format"}, None)
+                    continue
+                if request.get("command") == "HELLO":
+                    # Answer in the old encoding, then switch for everything after
+                    agreed = negotiate(request.get("params") or {})
+                    await send({"status": "success", "data": agreed}, request.get("id"))
+                    codec.encoding = agreed["encoding"]
+                    codec.compress = agreed["compression"] == COMPRESSION_ZLIB
+                    codec.version = agreed["version"]
+                    continue
+                if request.get("command") == "CANCEL":
+                    # Cancelling a streamed script's task kills the script too
+                    task = running.get((request.get("params") or {}).get("request"))
+                    if task is not None:
+                        task.cancel()
+                    response = {"status": "success", "message": "Cancelled"} if task is not None else \
+                        {"status": "error", "message": "Unknown request"}
+                    await send(response, request.get("id"))
+                    continue
+                request_id = request.get("id")
+                task = asyncio.create_task(self._handle_frame(request, send, subscriptions))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if request_id is not None:
+                    running[request_id] = task
+                    task.add_done_callback(lambda _, request_id=request_id: running.pop(request_id, None))
+        except asyncio.IncompleteReadError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Connection from {addr} closed: {e}")
+        finally:
+            for task in list(tasks) + list(subscriptions.values()):
+                task.cancel()
+            self.active_connections -= 1
+            writer.close()
+
+    async def refresh_snapshot(self):
+        """Keep the exported snapshot at most EXPORTER_REFRESH old, so scrapes never collect."""
+        while True:
+            age = time.time() - self.snapshot_checked
+            if age >= EXPORTER_REFRESH:
+                self.snapshot_checked = time.time()
+                await self.execute("GET_SNAPSHOT", {"channel": "EXT5V_V"}, self._discard)
+                age = 0
+            await asyncio.sleep(EXPORTER_REFRESH - age)
+
+    async def render_metrics(self):
+        """Prometheus exposition of the slave's state as last collected."""
+        data = self.last_snapshot
+        cache = METRIC_CACHE.stats()["counters"]
+        return render(
+            gauge("pivortex_cpu_temperature_celsius", "CPU temperature", [({}, data.get("cpu_temp"))]),
+            gauge("pivortex_disk_usage_percent", "Root filesystem usage", [({}, data.get("disk_usage"))]),
+            gauge("pivortex_adc_volts", "PMIC ADC reading (EXT5V_V)", [({}, data.get("adc_value"))]),
+            gauge("pivortex_uptime_seconds", "System uptime", [({}, data.get("uptime_seconds"))]),
+            gauge("pivortex_usb_devices", "Connected USB devices", [({}, data.get("usb_devices"))]),
+            gauge("pivortex_snapshot_timestamp_seconds", "When the metrics above were collected",
+                  [({}, self.snapshot_checked if data else None)]),
+            COMMAND_LATENCY.render(),
+            COMMAND_ERRORS.render(),
+            CONNECTIONS.render(),
+            gauge("pivortex_slave_active_connections", "Open master connections", [({}, self.active_connections)]),
+            gauge("pivortex_cache_hits_total", "Metric cache hits",
+                  [({"name": name}, counts["hits"]) for name, counts in sorted(cache.items())], kind="counter"),
+            gauge("pivortex_cache_misses_total", "Metric cache misses",
+                  [({"name": name}, counts["misses"]) for name, counts in sorted(cache.items())], kind="counter"),
+        )
+
+    async def handle_http(self, reader, writer):
+        """Minimal HTTP/1.1 responder for GET /metrics."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT)
+            while (await asyncio.wait_for(reader.readline(), HTTP_TIMEOUT)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, (await self.render_metrics()).encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, reuse_address=True)
+        if self.metrics_port:
+            await asyncio.start_server(self.handle_http, self.host, self.metrics_port, reuse_address=True)
+            self._refresh_task = asyncio.create_task(self.refresh_snapshot())
+            print(f"Serving Prometheus metrics on port {self.metrics_port}")
+        if self.file_port:
+            await asyncio.start_server(TRANSFERS.receive, self.host, self.file_port, reuse_address=True)
+            print(f"Receiving file pushes into {TRANSFERS.root} on port {self.file_port}")
+        TRANSFERS.port = self.file_port
+        print("Slave is ready to receive requests...")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PiVortex slave agent")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="Maximum number of commands executed at once")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Default per-command timeout in seconds")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port of the Prometheus /metrics endpoint; 0 disables it")
+    parser.add_argument("--ttl", action="append", default=[], metavar="COMMAND=SECONDS",
+                        help="Override a command's cache TTL; 0 disables caching for it")
+    parser.add_argument("--max-jobs", type=int, default=JOBS.max_running,
+                        help="Maximum number of RUN_SCRIPT jobs running at once")
+    parser.add_argument("--file-port", type=int, default=TRANSFERS.port,
+                        help="Port receiving pushed files; 0 disables file pushes")
+    parser.add_argument("--files-dir", default=TRANSFERS.root, help="Directory pushed files are written to")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL,
+                        help="Seconds between discovery heartbeats; 0 disables them")
+    parser.add_argument("--heartbeat-address", default=BROADCAST_ADDRESS,
+                        help="Where to send heartbeats; the master's IP avoids broadcasting")
+    args = parser.parse_args()
+    JOBS.max_running = args.max_jobs
+    TRANSFERS.root = args.files_dir
+
+    for override in args.ttl:
+        command, _, seconds = override.partition("=")
+        if float(seconds) > 0:
+            COMMAND_TTLS[command] = float(seconds)
+        else:
+            COMMAND_TTLS.pop(command, None)
+
+    # The master only learns about this slave from its heartbeats
+    if args.heartbeat_interval > 0:
+        threading.Thread(target=broadcast_slave_info, args=(args.heartbeat_interval, args.heartbeat_address),
+                         daemon=True).start()
+
+    async def run():
+        server = SlaveServer(max_concurrency=args.max_concurrency, default_timeout=args.timeout,
+                             metrics_port=args.metrics_port, file_port=args.file_port)
+        await server.serve_forever()
+
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,61 @@
+import argparse
+import os
+import platform
 import socket
 import time
-import json
 
-def broadcast_slave_info():
-    slave_info = {"name": "slavepi1", "ip": "192.168.0.15", "description": "Raspberry Pi 4"}
-    message = json.dumps(slave_info).encode()
-    while True:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            s.sendto(message, ("<broadcast>", 65433))
-        time.sleep(10)
+import collectors
+from heartbeat import HEARTBEAT_PORT, encode_heartbeat
+
+# The master expires a slave after MISSED_HEARTBEATS intervals (35 s at least)
+HEARTBEAT_INTERVAL = 10
+BROADCAST_ADDRESS = "<broadcast>"
+
+def get_slave_info():
+    """Describe this slave for the master's registry."""
+    try:
+        description = collectors.read_model()
+    except OSError:
+        description = platform.platform()
+    return {"name": socket.gethostname(), "description": description}
+
+def _read(reader):
+    try:
+        return reader()
+    except (OSError, ValueError, IndexError):
+        return None
+
+def read_health():
+    """Metrics carried in each heartbeat; those that cannot be read are None."""
+    return {
+        "cpu_temp": _read(collectors.read_cpu_temp),
+        "load": _read(lambda: os.getloadavg()[0]),
+        "disk_usage": _read(lambda: collectors.read_disk_usage("/")["percent"]),
+        "uptime": _read(collectors.read_uptime_seconds),
+    }
+
+def broadcast_slave_info(interval=HEARTBEAT_INTERVAL, address=BROADCAST_ADDRESS, port=HEARTBEAT_PORT):
+    """Send a binary heartbeat (see heartbeat.py) every `interval` seconds from one socket."""
+    info = get_slave_info()
+    seq = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        next_send = time.monotonic()
+        while True:
+            message = encode_heartbeat(seq, info["name"], info["description"], interval=interval, **read_health())
+            try:
+                s.sendto(message, (address, port))
+            except OSError as e:
+                print(f"[WARNING] Heartbeat not sent: {e}")
+            seq += 1
+            # A fixed schedule, so the rate does not drift by the time spent reading metrics
+            next_send = max(next_send + interval, time.monotonic())
+            time.sleep(max(0, next_send - time.monotonic()))
 
 if __name__ == "__main__":
-    broadcast_slave_info()
+    parser = argparse.ArgumentParser(description="PiVortex slave heartbeat")
+    parser.add_argument("--interval", type=float, default=HEARTBEAT_INTERVAL, help="Seconds between heartbeats")
+    parser.add_argument("--address", default=BROADCAST_ADDRESS,
+                        help="Where to send heartbeats; the master's IP avoids broadcasting")
+    args = parser.parse_args()
+    broadcast_slave_info(args.interval, args.address)
@@ -1,22 +1,98 @@
 import socket
 import json
+import threading
 import time
 
 LOGGING_MASTER_IP = "192.168.0.10"  # IP of the master
 LOGGING_PORT = 65434
+SLAVE_NAME = socket.gethostname()
+
+FLUSH_INTERVAL = 1.0
+MAX_BATCH_BYTES = 8 * 1024  # Small enough that one lost fragment costs few messages
+MAX_QUEUED_MESSAGES = 10000
+FLUSH_THRESHOLD = 256  # Flush early once this many messages are waiting
+
+
+class LogPusher:
+    """Batches log messages and sends them to the master's logging server.
+
+    Every message gets a sequence number so the master can count messages
+    lost in transit; a batch datagram carries the sequence number of its
+    first entry.
+    """
+    def __init__(self, master_ip=LOGGING_MASTER_IP, port=LOGGING_PORT, slave_name=SLAVE_NAME,
+                 flush_interval=FLUSH_INTERVAL):
+        self.address = (master_ip, port)
+        self.slave_name = slave_name
+        self.flush_interval = flush_interval
+        self.next_seq = 0
+        self.dropped = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def log(self, message, level="INFO"):
+        """Queue a message; it is sent with the next batch."""
+        with self._lock:
+            if len(self._buffer) >= MAX_QUEUED_MESSAGES:
+                # Keep the sequence moving so the master sees the gap
+                self.next_seq += 1
+                self.dropped += 1
+                return
+            self._buffer.append({"seq": self.next_seq, "ts": time.time(), "level": level, "message": message})
+            self.next_seq += 1
+            if len(self._buffer) >= FLUSH_THRESHOLD:
+                self._wakeup.set()
+
+    def flush(self):
+        """Send everything queued, split into datagrams of at most MAX_BATCH_BYTES."""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        batch = []
+        size = 0
+        for entry in entries:
+            encoded_size = len(json.dumps(entry))
+            # A gap in sequence numbers (dropped entries) also starts a new batch
+            if batch and (size + encoded_size > MAX_BATCH_BYTES or entry["seq"] != batch[-1]["seq"] + 1):
+                self._send(batch)
+                batch, size = [], 0
+            batch.append(entry)
+            size += encoded_size
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch):
+        message = {
+            "slave_name": self.slave_name,
+            "seq": batch[0]["seq"],
+            "logs": [{key: value for key, value in entry.items() if key != "seq"} for entry in batch],
+        }
+        try:
+            self._sock.sendto(json.dumps(message).encode(), self.address)
+        except OSError as e:
+            print(f"[WARNING] Failed to send {len(batch)} log messages: {e}")
+
+    def run(self):
+        """Flush periodically; blocks forever."""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
 
 def push_logs_to_master():
     """
     Periodically sends log messages to the logging server on the master.
     """
-    log_data = {
-        "slave_name": "slavepi1",
-        "log_message": "System is operational"
-    }
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        while True:
-            s.sendto(json.dumps(log_data).encode(), (LOGGING_MASTER_IP, LOGGING_PORT))
-            time.sleep(10)
+    pusher = LogPusher().start()
+    while True:
+        pusher.log("System is operational")
+        time.sleep(10)
 
 if __name__ == "__main__":
     push_logs_to_master()
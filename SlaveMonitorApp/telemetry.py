@@ -0,0 +1,126 @@
+"""Push-based metric streaming between slaves and the master.
+
+The slave evaluates a command on a schedule and pushes only the fields
+that changed since the last update (delta encoding). The master merges
+those deltas back into the full state for each slave.
+"""
+import threading
+import time
+
+import protocol
+
+DEFAULT_INTERVAL = 2
+MIN_INTERVAL = 0.5
+# Push an empty update at least this often so the master sees the slave is alive
+KEEPALIVE_INTERVAL = 15
+RESUBSCRIBE_DELAY = 5
+
+# Changes smaller than these are not worth a push
+DELTA_TOLERANCES = {
+    "cpu_temp": 0.2,
+    "disk_usage": 0.1,
+    "adc_value": 0.01,
+    "uptime_seconds": 60,
+}
+
+_MISSING = object()
+
+
+def diff_snapshot(previous, current, tolerances=DELTA_TOLERANCES):
+    """Return the fields of `current` that differ from `previous` beyond their tolerance."""
+    delta = {}
+    for field, value in current.items():
+        old = previous.get(field, _MISSING)
+        if old is _MISSING or old is None or value is None:
+            if old is not value:
+                delta[field] = value
+        elif field in tolerances and isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            if abs(value - old) >= tolerances[field]:
+                delta[field] = value
+        elif value != old:
+            delta[field] = value
+    return delta
+
+
+class SlaveTelemetry:
+    """Keeps a subscription open to one slave and the merged state it pushes.
+
+    `on_change(ip, state, delta)` is called from the connection's reader
+    thread whenever new values arrive, and with an empty state and delta
+    when the slave goes offline or reports that its command failed.
+    """
+    def __init__(self, ip, on_change=None, command="GET_SNAPSHOT", params=None,
+                 interval=DEFAULT_INTERVAL):
+        self.ip = ip
+        self.command = command
+        self.params = params
+        self.interval = interval
+        self.on_change = on_change
+        self.state = {}
+        self.online = False
+        self.last_update = None
+        self.last_error = None
+        self._lost = threading.Event()
+        self._stopped = threading.Event()
+        self._subscription_id = None
+
+    @property
+    def is_live(self):
+        """True while the slave is connected and its keepalives are on time."""
+        return self.online and time.time() - self.last_update < 2 * max(KEEPALIVE_INTERVAL, self.interval)
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self, unsubscribe=True):
+        """Stop resubscribing; optionally tell the slave to stop pushing.
+
+        The unsubscribe request is sent from a background thread so that
+        stopping never blocks on an unreachable slave.
+        """
+        self._stopped.set()
+        self._lost.set()
+        if unsubscribe and self._subscription_id is not None:
+            connection = protocol.get_connection(self.ip)
+            threading.Thread(target=connection.unsubscribe, args=(self._subscription_id,), daemon=True).start()
+
+    def _run(self):
+        """Subscribe, and subscribe again whenever the connection drops."""
+        connection = protocol.get_connection(self.ip)
+        while not self._stopped.is_set():
+            self._lost.clear()
+            response = connection.subscribe(
+                self.command, self.interval, self._on_update, self._on_lost, params=self.params
+            )
+            if response.get("status") == "success":
+                self._subscription_id = response["data"]["subscription"]
+                self._lost.wait()
+            else:
+                self._on_lost(response.get("message", "Subscription failed"))
+            # Do not retry before the circuit breaker lets a probe through
+            self._stopped.wait(max(RESUBSCRIBE_DELAY, connection.breaker.retry_in()))
+
+    def _on_update(self, message):
+        delta = message.get("data", {})
+        # Later deltas build on this state even while the command fails
+        self.state.update(delta)
+        self.last_update = time.time()  # Before online, so is_live never sees it unset
+        self.last_error = message.get("error")
+        was_online, self.online = self.online, self.last_error is None
+        if not self.online:
+            if was_online and self.on_change:
+                self.on_change(self.ip, {}, {})
+            return
+        if self.on_change:
+            self.on_change(self.ip, dict(self.state), delta if was_online else dict(self.state))
+
+    def _on_lost(self, reason):
+        self._subscription_id = None
+        self.last_error = reason
+        was_online, self.online = self.online, False
+        # Deltas are relative to what this subscription saw, so start over
+        self.state = {}
+        self._lost.set()
+        if was_online and self.on_change:
+            self.on_change(self.ip, {}, {})
@@ -0,0 +1,144 @@
+import unittest
+
+from alerting import AbsenceRule, AlertEngine, RateRule, ThresholdRule
+from registry import SlaveRegistry
+
+
+def drain(engine):
+    alerts = []
+    while not engine._queue.empty():
+        alerts.append(engine._queue.get_nowait())
+    return [(alert["rule"], alert["slave"], alert["state"]) for alert in alerts]
+
+
+class ThresholdRuleTest(unittest.TestCase):
+    def setUp(self):
+        self.rule = ThresholdRule("hot", "cpu_temp", above=80, clear=75, for_seconds=10)
+        self.state = {}
+
+    def test_fires_only_after_for_seconds(self):
+        self.assertIsNone(self.rule.evaluate(self.state, 85, 0, False))
+        self.assertIsNone(self.rule.evaluate(self.state, 85, 9, False))
+        self.assertTrue(self.rule.evaluate(self.state, 85, 10, False))
+
+    def test_dip_restarts_the_wait(self):
+        self.rule.evaluate(self.state, 85, 0, False)
+        self.rule.evaluate(self.state, 70, 5, False)
+        self.assertIsNone(self.rule.evaluate(self.state, 85, 12, False))
+        self.assertTrue(self.rule.evaluate(self.state, 85, 22, False))
+
+    def test_resolves_only_past_clear(self):
+        self.assertIsNone(self.rule.evaluate(self.state, 78, 30, True))
+        self.assertIs(self.rule.evaluate(self.state, 75, 31, True), False)
+
+    def test_new_breach_after_resolve_waits_again(self):
+        self.rule.evaluate(self.state, 85, 0, False)
+        self.assertTrue(self.rule.evaluate(self.state, 85, 10, False))
+        self.assertIs(self.rule.evaluate(self.state, 70, 20, True), False)
+        self.assertIsNone(self.rule.evaluate(self.state, 85, 100, False))
+        self.assertTrue(self.rule.evaluate(self.state, 85, 110, False))
+
+    def test_below(self):
+        rule = ThresholdRule("undervoltage", "adc_value", below=4.75, clear=4.85)
+        self.assertTrue(rule.evaluate({}, 4.7, 0, False))
+        self.assertIsNone(rule.evaluate({}, 4.8, 1, True))
+        self.assertIs(rule.evaluate({}, 4.9, 2, True), False)
+
+    def test_ignores_missing_values(self):
+        self.assertIsNone(self.rule.evaluate(self.state, None, 0, False))
+        self.assertIsNone(self.rule.evaluate(self.state, True, 0, False))
+
+
+class RateRuleTest(unittest.TestCase):
+    def test_fires_on_fast_rise_and_resolves_under_clear(self):
+        rule = RateRule("heating", "cpu_temp", per_minute=10, window=60)
+        state = {}
+        self.assertIsNone(rule.evaluate(state, 40, 0, False))
+        self.assertIsNone(rule.evaluate(state, 45, 20, False))  # Span too short to judge
+        self.assertTrue(rule.evaluate(state, 52, 40, False))  # 18/min
+        self.assertIsNone(rule.evaluate(state, 55, 60, True))  # 15/min
+        self.assertIs(rule.evaluate(state, 55, 120, True), False)
+
+    def test_negative_rate_watches_drops(self):
+        rule = RateRule("cooling", "cpu_temp", per_minute=-10, window=60)
+        rising, falling = {}, {}
+        rule.evaluate(rising, 60, 0, False)
+        self.assertIsNone(rule.evaluate(rising, 70, 40, False))
+        rule.evaluate(falling, 70, 0, False)
+        self.assertTrue(rule.evaluate(falling, 50, 40, False))
+
+
+class AlertEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = AlertEngine(
+            rules=[ThresholdRule("hot", "cpu_temp", above=80, clear=75), AbsenceRule("offline", 30)])
+
+    def test_fire_and_resolve(self):
+        self.engine.observe("pi1", {"cpu_temp": 85}, 0)
+        self.assertEqual([alert["rule"] for alert in self.engine.active()], ["hot"])
+        self.engine.observe("pi1", {"cpu_temp": 70}, 5)
+        self.assertEqual(self.engine.active(), [])
+        self.assertEqual(drain(self.engine), [("hot", "pi1", "firing"), ("hot", "pi1", "resolved")])
+
+    def test_absence_fires_after_deadline_and_rearms(self):
+        self.engine.observe("pi1", {"cpu_temp": 50}, 0)
+        self.engine.observe("pi1", None, 20)
+        self.engine.tick(29)
+        self.assertEqual(self.engine.active(), [])
+        self.engine.tick(31)
+        self.assertEqual([alert["rule"] for alert in self.engine.active()], ["offline"])
+        self.engine.observe("pi1", {"cpu_temp": 50}, 40)
+        self.assertEqual(self.engine.active(), [])
+        self.engine.tick(69)
+        self.assertEqual(self.engine.active(), [])
+        self.engine.tick(71)
+        self.assertEqual(len(self.engine.active()), 1)
+
+    def test_answer_before_deadline_pushes_it_back(self):
+        self.engine.observe("pi1", {"cpu_temp": 50}, 0)
+        self.engine.observe("pi1", {"cpu_temp": 50}, 25)
+        self.engine.tick(31)
+        self.assertEqual(self.engine.active(), [])
+        self.engine.tick(56)
+        self.assertEqual(len(self.engine.active()), 1)
+
+    def test_refiring_within_notify_interval_is_held_back(self):
+        engine = AlertEngine(rules=[ThresholdRule("hot", "cpu_temp", above=80, clear=75)], notify_interval=300)
+        engine.observe("pi1", {"cpu_temp": 85}, 0)
+        engine.observe("pi1", {"cpu_temp": 70}, 10)
+        engine.observe("pi1", {"cpu_temp": 85}, 20)
+        self.assertEqual(engine.stats["suppressed"], 1)
+        engine.tick(100)
+        self.assertEqual(engine.stats["suppressed"], 1)
+        engine.tick(301)
+        self.assertEqual(drain(engine), [
+            ("hot", "pi1", "firing"), ("hot", "pi1", "resolved"), ("hot", "pi1", "firing")])
+
+    def test_rate_limit_across_slaves(self):
+        engine = AlertEngine(rules=[ThresholdRule("hot", "cpu_temp", above=80)], max_per_minute=2)
+        for slave in ("pi1", "pi2", "pi3"):
+            engine.observe(slave, {"cpu_temp": 90}, 0)
+        self.assertEqual(len(drain(engine)), 2)
+        engine.tick(61)
+        self.assertEqual(drain(engine), [("hot", "pi3", "firing")])
+
+    def test_forget_resolves_and_drops_state(self):
+        self.engine.observe("pi1", {"cpu_temp": 85}, 0)
+        self.engine.forget("pi1", 5)
+        self.assertEqual(self.engine.active(), [])
+        self.assertEqual(drain(self.engine), [("hot", "pi1", "firing"), ("hot", "pi1", "resolved")])
+        self.engine.tick(100)
+        self.assertEqual(self.engine.active(), [])
+        self.assertFalse(any(key[1] == "pi1" for key in self.engine._states))
+
+    def test_follow_forgets_slaves_removed_from_registry(self):
+        registry = SlaveRegistry()
+        self.engine.follow(registry)
+        registry.update("pi1", "10.0.0.2", "Raspberry Pi 4")
+        self.engine.observe("pi1", {"cpu_temp": 85})
+        registry.remove("pi1")
+        self.assertEqual(self.engine.active(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cache import MetricCache
+
+
+class MetricCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetricCache()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_cached_until_ttl(self):
+        with mock.patch("cache.time.monotonic", return_value=100.0) as clock:
+            self.assertEqual(self.cache.get_or_compute("cpu", None, 5, self.compute), 1)
+            clock.return_value = 104.9
+            self.assertEqual(self.cache.get_or_compute("cpu", None, 5, self.compute), 1)
+            clock.return_value = 105.0
+            self.assertEqual(self.cache.get_or_compute("cpu", None, 5, self.compute), 2)
+        counters = self.cache.stats()["counters"]["cpu"]
+        self.assertEqual((counters["hits"], counters["misses"]), (1, 2))
+
+    def test_ttl_none_caches_forever(self):
+        self.cache.get_or_compute("model", None, None, self.compute)
+        self.assertEqual(self.cache.get_or_compute("model", None, None, self.compute), 1)
+
+    def test_keys_are_separate(self):
+        self.cache.get_or_compute("disk", "/", 5, self.compute)
+        self.assertEqual(self.cache.get_or_compute("disk", "/boot", 5, self.compute), 2)
+
+    def test_uncacheable_value_is_not_stored(self):
+        self.cache.get_or_compute("adc", None, 5, lambda: None, cacheable=lambda value: value is not None)
+        self.assertEqual(self.cache.get_or_compute("adc", None, 5, self.compute), 1)
+
+    def test_concurrent_lookups_share_one_computation(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return self.compute()
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.cache.get_or_compute("cpu", None, 5, slow)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(self.cache.get_or_compute("cpu", None, 5, slow)))
+        second.start()
+        time.sleep(0.05)
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, [1, 1])
+        self.assertEqual(self.calls, 1)
+
+    def test_waiter_computes_itself_after_wait_timeout(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def stuck():
+            started.set()
+            release.wait(5)
+            return "late"
+
+        first = threading.Thread(target=lambda: self.cache.get_or_compute("usb", None, 5, stuck))
+        first.start()
+        started.wait(5)
+        try:
+            began = time.monotonic()
+            value = self.cache.get_or_compute("usb", None, 5, lambda: "own", wait_timeout=0.05)
+            self.assertEqual(value, "own")
+            self.assertLess(time.monotonic() - began, 1)
+        finally:
+            release.set()
+            first.join(5)
+        self.assertEqual(self.cache.stats()["counters"]["usb"]["misses"], 2)
+
+    def test_invalidate_name_and_the_names_under_it(self):
+        for name in ("disk", "disk.usage", "diskette", "cpu"):
+            self.cache.get_or_compute(name, None, None, self.compute)
+        self.assertEqual(self.cache.invalidate("disk"), 2)
+        self.assertEqual(self.cache.get_or_compute("diskette", None, None, self.compute), 3)
+        self.assertEqual(self.cache.get_or_compute("disk.usage", None, None, self.compute), 5)
+
+    def test_invalidate_everything(self):
+        self.cache.get_or_compute("cpu", None, None, self.compute)
+        self.cache.get_or_compute("disk", None, None, self.compute)
+        self.assertEqual(self.cache.invalidate(), 2)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import master
+from jobs import EXITED, TIMED_OUT, JobError, JobPool, OutputBuffer
+
+
+class OutputBufferTest(unittest.TestCase):
+    def test_read_from_offsets(self):
+        buffer = OutputBuffer(capacity=16)
+        buffer.append(b"hello ")
+        buffer.append(b"world")
+        self.assertEqual(buffer.read(), (b"hello world", 11, 0, False))
+        self.assertEqual(buffer.read(6), (b"world", 11, 0, False))
+        self.assertEqual(buffer.read(0, max_bytes=5), (b"hello", 5, 0, False))
+        self.assertEqual(buffer.read(11), (b"", 11, 0, False))
+
+    def test_wrapped_buffer_reports_dropped_bytes(self):
+        buffer = OutputBuffer(capacity=8)
+        buffer.append(b"0123456789")
+        buffer.append(b"abcd")
+        self.assertEqual((buffer.start, buffer.end), (6, 14))
+        self.assertEqual(buffer.read(2), (b"6789abcd", 14, 4, False))
+        self.assertEqual(buffer.read(10), (b"abcd", 14, 0, False))
+
+    def test_done_only_once_drained(self):
+        buffer = OutputBuffer()
+        buffer.append(b"tail")
+        buffer.close()
+        self.assertEqual(buffer.read(0, max_bytes=2), (b"ta", 2, 0, False))
+        self.assertEqual(buffer.read(2), (b"il", 4, 0, True))
+
+    def test_wait_returns_when_output_arrives(self):
+        buffer = OutputBuffer()
+        threading.Timer(0.05, buffer.append, (b"late",)).start()
+        began = time.monotonic()
+        self.assertEqual(buffer.read(0, wait=5), (b"late", 4, 0, False))
+        self.assertLess(time.monotonic() - began, 1)
+
+    def test_wait_gives_up_after_timeout(self):
+        self.assertEqual(OutputBuffer().read(0, wait=0.05), (b"", 0, 0, False))
+
+
+class JobPoolTest(unittest.TestCase):
+    def test_job_output_and_exit(self):
+        job = JobPool().submit("echo one; echo two")
+        self.assertTrue(job.wait(10))
+        self.assertEqual(job.state, EXITED)
+        self.assertEqual(job.returncode, 0)
+        self.assertEqual(job.output.read()[0], b"one\ntwo\n")
+
+    def test_job_killed_after_timeout(self):
+        job = JobPool().submit("sleep 10", timeout=0.2)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.state, TIMED_OUT)
+
+    def test_busy_pool_refuses_jobs_that_may_not_queue(self):
+        pool = JobPool(max_running=1)
+        job = pool.submit("sleep 10")
+        try:
+            with self.assertRaises(JobError):
+                pool.submit("true", may_queue=False)
+        finally:
+            pool.cancel(job.id)
+            job.wait(5)
+
+
+class TailJobTest(unittest.TestCase):
+    def test_request_timeout_covers_the_wait(self):
+        responses = [
+            {"status": "success", "data": {"output": "a", "offset": 1, "dropped": 0, "done": False}},
+            {"status": "success", "data": {"output": "b", "offset": 12, "dropped": 10, "done": True,
+                                           "job": {"state": EXITED}}},
+        ]
+        output = []
+        with mock.patch("master.send_command", side_effect=responses) as send:
+            status = master.tail_job("10.0.0.2", "1-1", output.append, wait=30)
+        self.assertEqual(status, {"state": EXITED})
+        self.assertEqual(output, ["a", "\n[... 10 bytes skipped ...]\n", "b"])
+        for call in send.call_args_list:
+            self.assertGreater(call.kwargs["timeout"], 30)
+        self.assertEqual(send.call_args_list[1].args[2]["offset"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from metrics_store import MetricsStore, RawSeries, RollupSeries
+
+
+class RawSeriesTest(unittest.TestCase):
+    def test_query_across_segments(self):
+        series = RawSeries(retention=1000, segment_size=3)
+        for ts in range(10):
+            series.append(ts, ts * 2)
+        self.assertEqual(len(series.segments), 4)
+        self.assertEqual(series.query(2, 6), [(ts, ts * 2) for ts in range(2, 7)])
+
+    def test_late_samples_are_refused(self):
+        series = RawSeries()
+        self.assertTrue(series.append(10, 1))
+        self.assertFalse(series.append(5, 2))
+        self.assertEqual(series.query(0, 20), [(10, 1)])
+
+    def test_whole_segments_expire(self):
+        series = RawSeries(retention=10, segment_size=5)
+        for ts in range(30):
+            series.append(ts, 0)
+        self.assertEqual(series.query(0, 30)[0][0], 15)
+
+
+class RollupSeriesTest(unittest.TestCase):
+    def test_buckets_keep_min_max_mean_count(self):
+        rollup = RollupSeries(60, 3600)
+        for ts, value in ((0, 4), (30, 8), (59, 6), (150, 1)):
+            rollup.add(ts, value)
+        self.assertEqual(rollup.query(0, 200), [(0, 4, 8, 6, 3), (120, 1, 1, 1, 1)])
+        self.assertEqual(rollup.query(60, 119), [])
+
+    def test_samples_older_than_the_first_bucket_are_ignored(self):
+        rollup = RollupSeries(60, 3600)
+        rollup.add(600, 1)
+        rollup.add(10, 5)
+        self.assertEqual(rollup.query(0, 700), [(600, 1, 1, 1, 1)])
+
+    def test_retention_trims_old_buckets(self):
+        rollup = RollupSeries(1, 10)
+        for ts in range(100):
+            rollup.add(ts, ts)
+        self.assertLessEqual(len(rollup.counts), 11)
+        rows = rollup.query(0, 100)
+        self.assertEqual(rows[-1][0], 99)
+        self.assertGreaterEqual(rows[0][0], 89)
+
+    def test_gap_longer_than_retention_starts_over(self):
+        rollup = RollupSeries(60, 600)
+        rollup.add(0, 1)
+        rollup.add(6000, 2)
+        self.assertEqual(rollup.query(0, 7000), [(6000, 2, 2, 2, 1)])
+
+
+class MetricsStoreTest(unittest.TestCase):
+    def test_record_snapshot(self):
+        store = MetricsStore()
+        store.record_snapshot("pi1", {"cpu_temp": 50, "disk_usage": "n/a", "model": "Pi 4"}, True, 100)
+        store.record_snapshot("pi1", {}, False, 110)
+        self.assertEqual(store.series(), [("pi1", "cpu_temp"), ("pi1", "online")])
+        self.assertEqual(store.query("pi1", "online", 0, 200), [(100, 1), (110, 0)])
+        self.assertEqual(store.latest("pi1", "cpu_temp"), (100, 50))
+
+    def test_query_by_resolution(self):
+        store = MetricsStore()
+        for ts in range(0, 180, 10):
+            store.append("pi1", "cpu_temp", ts, ts)
+        self.assertEqual([row[4] for row in store.query("pi1", "cpu_temp", 0, 200, resolution=60)], [6, 6, 6])
+        with self.assertRaises(ValueError):
+            store.query("pi1", "cpu_temp", resolution=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import socket
+import unittest
+import zlib
+
+import protocol
+
+
+def decode_frame(frame):
+    flags, length = protocol.split_header(frame[:protocol.HEADER.size])
+    payload = frame[protocol.HEADER.size:]
+    assert length == len(payload)
+    return protocol.decode_message(payload, flags), flags
+
+
+class FrameTest(unittest.TestCase):
+    def test_plain_json_round_trip(self):
+        message = {"command": "GET_SNAPSHOT", "params": {"fields": ["cpu_temp"]}, "id": 7}
+        decoded, flags = decode_frame(protocol.encode_frame(message))
+        self.assertEqual(decoded, message)
+        self.assertEqual(flags, 0)
+
+    def test_small_payload_is_not_compressed(self):
+        _, flags = decode_frame(protocol.encode_frame({"data": "x"}, compress=True))
+        self.assertFalse(flags & protocol.FLAG_ZLIB)
+
+    def test_large_payload_is_compressed(self):
+        message = {"data": "x" * (protocol.COMPRESS_THRESHOLD * 4)}
+        frame = protocol.encode_frame(message, compress=True)
+        decoded, flags = decode_frame(frame)
+        self.assertTrue(flags & protocol.FLAG_ZLIB)
+        self.assertLess(len(frame), protocol.COMPRESS_THRESHOLD)
+        self.assertEqual(decoded, message)
+
+    def test_oversized_payload_is_refused_even_if_it_compresses(self):
+        message = {"data": "x" * (protocol.MAX_FRAME_SIZE + 1)}
+        with self.assertRaises(ValueError):
+            protocol.encode_frame(message, compress=True)
+
+    def test_decompression_is_bounded(self):
+        bomb = zlib.compress(b" " * (protocol.MAX_FRAME_SIZE + 1))
+        with self.assertRaises(ValueError):
+            protocol.decode_message(bomb, protocol.FLAG_ZLIB)
+
+    def test_corrupt_compressed_payload(self):
+        with self.assertRaises(ValueError):
+            protocol.decode_message(b"not zlib", protocol.FLAG_ZLIB)
+
+    @unittest.skipIf(protocol.msgpack is not None, "msgpack is installed")
+    def test_msgpack_frame_without_msgpack(self):
+        with self.assertRaises(ValueError):
+            protocol.decode_message(b"\x80", protocol.FLAG_MSGPACK)
+
+    def test_read_frame_from_socket(self):
+        left, right = socket.socketpair()
+        with left, right:
+            message = {"status": "success", "data": "y" * 5000}
+            left.sendall(protocol.encode_frame(message, compress=True) + protocol.encode_frame({"id": 2}))
+            payload, flags = protocol.read_frame(right)
+            self.assertEqual(protocol.decode_message(payload, flags), message)
+            payload, flags = protocol.read_frame(right)
+            self.assertEqual(protocol.decode_message(payload, flags), {"id": 2})
+            left.close()
+            self.assertIsNone(protocol.read_frame(right))
+
+    def test_read_frame_closed_mid_frame(self):
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(protocol.encode_frame({"data": "z" * 100})[:20])
+            left.close()
+            with self.assertRaises(ConnectionError):
+                protocol.read_frame(right)
+
+
+class HelloTest(unittest.TestCase):
+    def test_negotiate_picks_first_supported_encoding(self):
+        params = {"version": 9, "encodings": ["cbor", protocol.ENCODING_JSON], "compression": ["zlib"]}
+        self.assertEqual(protocol.negotiate(params), {
+            "version": protocol.PROTOCOL_VERSION,
+            "encoding": protocol.ENCODING_JSON,
+            "compression": protocol.COMPRESSION_ZLIB,
+        })
+
+    def test_negotiate_without_compression(self):
+        chosen = protocol.negotiate({"version": 2, "encodings": ["cbor"]})
+        self.assertEqual(chosen["encoding"], protocol.ENCODING_JSON)
+        self.assertIsNone(chosen["compression"])
+
+    def test_hello_round_trip(self):
+        chosen = protocol.negotiate(protocol.hello_params())
+        codec = protocol.codec_from_hello({"status": "success", "data": chosen})
+        self.assertEqual(codec.encoding, protocol.SUPPORTED_ENCODINGS[0])
+        self.assertTrue(codec.compress)
+        self.assertEqual(codec.version, protocol.PROTOCOL_VERSION)
+
+    def test_hello_params_without_compression(self):
+        self.assertEqual(protocol.hello_params(compression=False)["compression"], [])
+
+    def test_old_slave_rejecting_hello_gets_plain_json(self):
+        codec = protocol.codec_from_hello({"status": "error", "message": "Unknown command"})
+        self.assertEqual((codec.encoding, codec.compress, codec.version), (protocol.ENCODING_JSON, False, 1))
+
+    def test_unsupported_encoding_in_response_falls_back_to_json(self):
+        codec = protocol.codec_from_hello({"status": "success", "data": {"encoding": "cbor", "version": 2}})
+        self.assertEqual(codec.encoding, protocol.ENCODING_JSON)
+        self.assertFalse(codec.compress)
+
+
+if __name__ == "__main__":
+    unittest.main()
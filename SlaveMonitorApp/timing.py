@@ -0,0 +1,70 @@
+"""Rolling latency percentiles for where time goes in a request.
+
+Each named timer keeps its most recent samples in a ring buffer; samples
+older than the window are ignored when percentiles are computed, so the
+numbers follow the current load rather than the whole uptime.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+WINDOW_SECONDS = 300
+MAX_SAMPLES = 1024
+PERCENTILES = (50, 90, 99)
+
+
+class RollingTimer:
+    """Recent durations of one operation."""
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.samples = deque(maxlen=max_samples)  # (monotonic time, seconds)
+        self.total = 0
+
+    def record(self, seconds, now):
+        self.samples.append((now, seconds))
+        self.total += 1
+
+    def summary(self, now, window):
+        values = sorted(seconds for at, seconds in self.samples if now - at <= window)
+        if not values:
+            return {"count": 0, "total": self.total}
+        summary = {"count": len(values), "total": self.total, "max_ms": round(values[-1] * 1000, 3)}
+        for percentile in PERCENTILES:
+            index = min(len(values) - 1, int(len(values) * percentile / 100))
+            summary[f"p{percentile}_ms"] = round(values[index] * 1000, 3)
+        return summary
+
+
+class Timings:
+    """Thread-safe set of named RollingTimers."""
+    def __init__(self, window=WINDOW_SECONDS, max_samples=MAX_SAMPLES):
+        self.window = window
+        self.max_samples = max_samples
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = RollingTimer(self.max_samples)
+            timer.record(seconds, time.monotonic())
+
+    @contextmanager
+    def time(self, name):
+        """Time the body of a with-block under `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self, prefix=""):
+        """Percentiles of every timer whose name starts with `prefix`."""
+        now = time.monotonic()
+        with self._lock:
+            return {name: timer.summary(now, self.window)
+                    for name, timer in sorted(self._timers.items()) if name.startswith(prefix)}
+
+
+TIMINGS = Timings()
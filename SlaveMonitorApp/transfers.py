@@ -0,0 +1,232 @@
+"""Receiving side of file pushes from the master.
+
+A push starts with a FILE_PUSH command carrying the file's size, SHA-256
+and the SHA-256 of every CHUNK_SIZE chunk. If the destination already has
+that content the push is skipped. Otherwise the slave answers with a token
+and the offset to start from, and the master streams the raw bytes over a
+separate data connection (so it can use sendfile):
+
+    master -> slave   b"<token> <offset>\\n" followed by the file from offset
+    slave  -> master  b"OK\\n" or b"ERROR <reason>\\n"
+
+Bytes land in "<destination>.part". Each chunk is checked as soon as it is
+complete, and a partial file is only ever kept up to its last good chunk,
+so a broken push resumes from there. The finished file is renamed into
+place once the whole-file hash matches.
+"""
+import asyncio
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+# Port of the data connection; 0 disables file pushes
+FILE_PORT = 65436
+FILES_DIR = os.path.expanduser("~/pivortex_files")
+CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+# Pushes not continued for this long are forgotten (the .part file stays)
+TRANSFER_EXPIRY = 600
+# A data connection that sends nothing for this long is dropped
+DATA_TIMEOUT = 30
+PART_SUFFIX = ".part"
+
+
+class TransferError(Exception):
+    pass
+
+
+def file_digest(path):
+    """SHA-256 of a file and of each of its CHUNK_SIZE chunks."""
+    whole = hashlib.sha256()
+    chunks = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            whole.update(chunk)
+            chunks.append(hashlib.sha256(chunk).hexdigest())
+    return whole.hexdigest(), chunks
+
+
+def _write(f, data, *hashes):
+    f.write(data)
+    for digest in hashes:
+        digest.update(data)
+
+
+async def _read(read, *args):
+    try:
+        return await asyncio.wait_for(read(*args), DATA_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise TransferError(f"No data for {DATA_TIMEOUT} s") from None
+
+
+class Transfer:
+    """A push in progress: where it writes, what it expects and how far it got."""
+    def __init__(self, token, path, size, sha256, chunks):
+        self.token = token
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.size = size
+        self.sha256 = sha256
+        self.chunks = chunks
+        self.offset = 0  # Bytes verified so far, always on a chunk boundary
+        self.whole = hashlib.sha256()
+        self.active = False
+        self.touched = time.monotonic()
+
+    def resume(self):
+        """Keep the good chunks of an earlier partial file and drop the rest."""
+        if not os.path.exists(self.part_path):
+            open(self.part_path, "wb").close()
+            return
+        with open(self.part_path, "r+b") as f:
+            for expected in self.chunks:
+                chunk = f.read(CHUNK_SIZE)
+                if len(chunk) < min(CHUNK_SIZE, self.size - self.offset) or \
+                        hashlib.sha256(chunk).hexdigest() != expected:
+                    break
+                self.whole.update(chunk)
+                self.offset += len(chunk)
+            f.truncate(self.offset)
+
+
+class TransferManager:
+    """Tracks pushes between FILE_PUSH and the end of their data connection."""
+    def __init__(self, root=FILES_DIR):
+        self.root = root
+        self.port = FILE_PORT
+        self._transfers = {}
+        self._digests = {}  # path -> ((size, mtime_ns), sha256) of files already on disk
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        """Absolute destination of a relative name; it may not leave the root."""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, name))
+        if not name or os.path.isabs(name) or os.path.commonpath([root, path]) != root:
+            raise TransferError(f"Invalid destination: {name}")
+        return path
+
+    def current_digest(self, path):
+        """SHA-256 of what is at `path` now, or None; cached while the file is unchanged."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+        cached = self._digests.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = file_digest(path)[0]
+        self._digests[path] = (key, digest)
+        return digest
+
+    def begin(self, name, size, sha256, chunks):
+        """Start or resume a push; returns None if the file is already there."""
+        path = self.resolve(name)
+        if len(chunks) != -(-size // CHUNK_SIZE):
+            raise TransferError("Chunk list does not match the file size")
+        if self.current_digest(path) == sha256:
+            return None
+        with self._lock:
+            self._expire()
+            for transfer in self._transfers.values():
+                if transfer.path == path:
+                    if transfer.active:
+                        raise TransferError(f"{name} is already being pushed")
+                    del self._transfers[transfer.token]
+                    break
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            transfer = Transfer(secrets.token_hex(16), path, size, sha256, chunks)
+            transfer.resume()
+            self._transfers[transfer.token] = transfer
+            return transfer
+
+    def claim(self, token, offset):
+        """Hand a transfer to a data connection starting at `offset`."""
+        with self._lock:
+            transfer = self._transfers.get(token)
+            if transfer is None:
+                raise TransferError("Unknown transfer")
+            if transfer.active:
+                raise TransferError("Transfer already in progress")
+            if offset != transfer.offset:
+                raise TransferError(f"Expected offset {transfer.offset}")
+            transfer.active = True
+            return transfer
+
+    def release(self, transfer, complete):
+        with self._lock:
+            transfer.active = False
+            transfer.touched = time.monotonic()
+            if complete:
+                self._transfers.pop(transfer.token, None)
+                self._digests.pop(transfer.path, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        for token, transfer in list(self._transfers.items()):
+            if not transfer.active and now - transfer.touched > TRANSFER_EXPIRY:
+                del self._transfers[token]
+
+    async def receive(self, reader, writer):
+        """Serve one data connection (asyncio).
+
+        Writing and hashing run in the loop's default executor, so a fast
+        push does not hold up the commands served on the same loop.
+        """
+        loop = asyncio.get_running_loop()
+        transfer = None
+        complete = False
+        try:
+            token, offset = (await _read(reader.readline)).decode().split()
+            transfer = self.claim(token, int(offset))
+            with open(transfer.part_path, "r+b") as f:
+                f.seek(transfer.offset)
+                chunk_hash = hashlib.sha256()
+                whole = transfer.whole.copy()
+                chunk_length = 0
+                while transfer.offset + chunk_length < transfer.size:
+                    wanted = min(READ_SIZE, CHUNK_SIZE - chunk_length,
+                                 transfer.size - transfer.offset - chunk_length)
+                    data = await _read(reader.read, wanted)
+                    if not data:
+                        raise TransferError("Connection closed mid-transfer")
+                    await loop.run_in_executor(None, _write, f, data, chunk_hash, whole)
+                    chunk_length += len(data)
+                    if chunk_length == CHUNK_SIZE or transfer.offset + chunk_length == transfer.size:
+                        if chunk_hash.hexdigest() != transfer.chunks[transfer.offset // CHUNK_SIZE]:
+                            raise TransferError(f"Checksum mismatch in chunk {transfer.offset // CHUNK_SIZE}")
+                        f.flush()
+                        transfer.whole = whole
+                        transfer.offset += chunk_length
+                        chunk_hash = hashlib.sha256()
+                        whole = transfer.whole.copy()
+                        chunk_length = 0
+            if transfer.whole.hexdigest() != transfer.sha256:
+                os.remove(transfer.part_path)
+                complete = True  # Nothing left to resume
+                raise TransferError("File checksum mismatch")
+            os.replace(transfer.part_path, transfer.path)
+            complete = True
+            writer.write(b"OK\n")
+        except (TransferError, ValueError, OSError) as e:
+            print(f"[WARNING] File push failed: {e}")
+            writer.write(f"ERROR {e}\n".encode())
+            if transfer is not None and not complete and os.path.exists(transfer.part_path):
+                os.truncate(transfer.part_path, transfer.offset)  # Drop the unverified tail
+        finally:
+            if transfer is not None:
+                self.release(transfer, complete)
+            try:
+                await writer.drain()
+            except OSError:
+                pass
+            writer.close()
+
+
+TRANSFERS = TransferManager()